@@ -0,0 +1,327 @@
+"""Микробенчмарк хендлеров бота на заполненной БД.
+
+Настоящие хендлеры из bot/main.py вызываются с поддельными Update и Bot
+(без сети, см. fake_bot.py) против локального Postgres. Для каждого
+сценария — ops/s, p50/p99 и среднее число SQL-запросов на вызов.
+
+БД берётся из тех же переменных DB_*, что и у бота; по умолчанию
+DB_NAME=bot_bench. Данные пересоздаются, если масштаб не совпадает.
+
+    python bench/bench_handlers.py --users 10000 --subjects 200 --labs 5000
+    python bench/bench_handlers.py --save before.json
+    python bench/bench_handlers.py --compare before.json
+
+--cold сбрасывает кэш каталога перед каждым вызовом — так видна цена
+запросов к БД, а не только попадания в кэш.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("DB_NAME", "bot_bench")
+os.environ.setdefault("METRICS_PORT", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from sqlalchemy import func, insert, select, text  # noqa: E402
+
+import main  # noqa: E402
+from db import AsyncSessionLocal, async_engine, DB_NAME  # noqa: E402
+from models import User, Subject, Lab, LabFile, FileBlob  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+from catalog import catalog  # noqa: E402
+from broadcast import broadcaster  # noqa: E402
+from router import router  # noqa: E402
+from metrics import instrument_engine, track_queries  # noqa: E402
+
+from fake_bot import FakeTelegram  # noqa: E402
+
+NEW_LAB_PREFIX = "bench-new-"
+INSERT_CHUNK = 5000
+
+
+# --- Заполнение БД ---
+async def current_scale():
+    async with AsyncSessionLocal() as session:
+        return {
+            "users": await session.scalar(select(func.count(User.id))),
+            "subjects": await session.scalar(select(func.count(Subject.id))),
+            "labs": await session.scalar(select(func.count(Lab.id))),
+            "files": await session.scalar(select(func.count(LabFile.id))),
+        }
+
+
+async def insert_rows(session, model, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        await session.execute(insert(model), rows[start:start + INSERT_CHUNK])
+
+
+async def seed(scale, rng):
+    print(f"🌱 Заполняем {DB_NAME}: {scale}")
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as session:
+        await session.execute(text(
+            "TRUNCATE users, subjects, labs, lab_files, file_blobs, broadcasts RESTART IDENTITY CASCADE"
+        ))
+        await insert_rows(session, User, [
+            {"tg_id": 10_000_000 + i, "is_admin": i == 0} for i in range(scale["users"])
+        ])
+        await insert_rows(session, Subject, [
+            {"name": f"Предмет {i + 1}"} for i in range(scale["subjects"])
+        ])
+        await insert_rows(session, Lab, [
+            {
+                "subject_id": i % scale["subjects"] + 1,
+                "title": f"Лабораторная {i + 1}",
+                "desc": "Описание лабораторной работы. " * 3,
+                # Половина дедлайнов в будущем, часть — без дедлайна
+                "deadline": now + timedelta(days=rng.randint(-60, 60)) if i % 5 else None,
+                "reminder_stage": 0,
+            }
+            for i in range(scale["labs"])
+        ])
+        # Одинаковые файлы встречаются в разных лабораторных — как в жизни
+        blob_count = max(1, scale["files"] // 3)
+        blobs = [f"{i:064x}" for i in range(blob_count)]
+        files = [
+            {
+                "lab_id": i % scale["labs"] + 1,
+                "file_name": f"task{i}.pdf",
+                "file_path": f"/app/lab_files/objects/{blobs[i % blob_count]}",
+                "file_size": 100_000 + i,
+                "content_hash": blobs[i % blob_count],
+                "tg_file_id": f"file-{i}",
+                "tg_file_kind": "document",
+            }
+            for i in range(scale["files"])
+        ]
+        refs = {}
+        for f in files:
+            refs[f["content_hash"]] = refs.get(f["content_hash"], 0) + 1
+        await insert_rows(session, FileBlob, [
+            {"sha256": sha, "path": f"/app/lab_files/objects/{sha}", "size": 100_000, "ref_count": refs.get(sha, 0)}
+            for sha in blobs
+        ])
+        await insert_rows(session, LabFile, files)
+        await session.commit()
+    async with async_engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM ANALYZE"))
+
+
+async def prepare_database(scale, reseed, rng):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(apply_migrations)
+    if reseed or await current_scale() != scale:
+        await seed(scale, rng)
+
+
+async def cleanup():
+    """Убирает то, что наплодили сценарии записи"""
+    async with AsyncSessionLocal() as session:
+        new_labs = select(Lab.id).where(Lab.title.startswith(NEW_LAB_PREFIX)).scalar_subquery()
+        await session.execute(text("DELETE FROM broadcasts"))
+        await session.execute(LabFile.__table__.delete().where(LabFile.lab_id.in_(new_labs)))
+        await session.execute(Lab.__table__.delete().where(Lab.title.startswith(NEW_LAB_PREFIX)))
+        await session.execute(text(
+            "UPDATE file_blobs SET ref_count = "
+            "(SELECT count(*) FROM lab_files WHERE content_hash = file_blobs.sha256)"
+        ))
+        await session.commit()
+    catalog.invalidate()
+
+
+# --- Сценарии ---
+class Scenarios:
+    def __init__(self, telegram, scale, rng):
+        self.tg = telegram
+        self.scale = scale
+        self.rng = rng
+        self.admin_chat = 10_000_000
+        self._new_labs = 0
+
+    def _chat(self):
+        return 10_000_000 + self.rng.randrange(self.scale["users"])
+
+    async def my_subjects(self):
+        update = self.tg.message(self._chat(), "Мои предметы")
+        await main.my_subjects(update, self.tg.context(update))
+
+    async def actual_labs(self):
+        update = self.tg.message(self._chat(), "Актуально")
+        await main.actual_labs(update, self.tg.context(update))
+
+    async def show_lab_files(self):
+        # Через роутер — как настоящее нажатие кнопки
+        lab_id = self.rng.randint(1, self.scale["labs"])
+        update = self.tg.callback(self._chat(), f"lab_files:{lab_id}")
+        await router.dispatch(update, self.tg.context(update))
+
+    async def notify_send(self):
+        update = self.tg.message(self.admin_chat, "Пара переносится на 10:00")
+        await main.notify_send(update, self.tg.context(update))
+
+    async def add_lab_finish(self):
+        self._new_labs += 1
+        update = self.tg.message(self.admin_chat, "/done")
+        context = self.tg.context(update)
+        lab_id = self.rng.randint(1, self.scale["labs"])
+        context.user_data.update({
+            "lab_subject_id": self.rng.randint(1, self.scale["subjects"]),
+            "lab_title": f"{NEW_LAB_PREFIX}{self._new_labs}",
+            "lab_desc": "Новая лабораторная",
+            "lab_deadline": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+            "lab_files": [
+                {
+                    "file_id": f"new-{self._new_labs}-{i}",
+                    "file_kind": "document",
+                    "file_name": f"new{i}.pdf",
+                    "file_size": 1000,
+                    "content_hash": f"{(lab_id + i) % max(1, self.scale['files'] // 3):064x}",
+                    "file_path": "/app/lab_files/objects/new",
+                }
+                for i in range(2)
+            ],
+        })
+        await main.add_lab_finish(update, context)
+
+
+SCENARIOS = ["my_subjects", "actual_labs", "show_lab_files", "notify_send", "add_lab_finish"]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_scenario(scenarios, name, iterations, warmup, cold):
+    call = getattr(scenarios, name)
+    for _ in range(warmup):
+        await call()
+
+    latencies = []
+    queries = []
+    total = 0.0
+    for _ in range(iterations):
+        if cold:
+            catalog.invalidate()
+        with track_queries() as stats:
+            started = time.perf_counter()
+            await call()
+            elapsed = time.perf_counter() - started
+        total += elapsed
+        latencies.append(elapsed * 1000)
+        queries.append(stats.queries)
+
+    return {
+        "ops": iterations / total,
+        "p50": statistics.median(latencies),
+        "p99": percentile(latencies, 0.99),
+        "queries": sum(queries) / len(queries),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(__file__), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    scale = {"users": args.users, "subjects": args.subjects, "labs": args.labs,
+             "files": args.labs * args.files_per_lab}
+    instrument_engine(async_engine)
+    await prepare_database(scale, args.reseed, rng)
+
+    # Рассылка не запускается — меряется постановка в outbox, а не отправка 10k сообщений
+    broadcaster.start = lambda broadcast_id: None
+
+    telegram = await FakeTelegram().start()
+    scenarios = Scenarios(telegram, scale, rng)
+    results = {}
+    try:
+        for name in args.scenarios.split(","):
+            results[name] = await run_scenario(scenarios, name, args.iterations, args.warmup, args.cold)
+    finally:
+        await cleanup()
+        await telegram.stop()
+        await async_engine.dispose()
+
+    return {
+        "commit": git_commit(),
+        "scale": scale,
+        "cold": args.cold,
+        "iterations": args.iterations,
+        "results": results,
+        "api_calls": dict(telegram.request.calls),
+    }
+
+
+# --- Отчёт ---
+def _delta(new, old, lower_is_better):
+    if not old:
+        return ""
+    change = (new - old) / old * 100
+    better = change < 0 if lower_is_better else change > 0
+    mark = "✅" if better and abs(change) >= 5 else ("❌" if abs(change) >= 5 else "  ")
+    return f" {change:+6.1f}%{mark}"
+
+
+def print_report(report, baseline=None):
+    print(f"commit={report['commit']} cold={report['cold']} iterations={report['iterations']} scale={report['scale']}")
+    if baseline:
+        print(f"сравнение с commit={baseline['commit']}")
+    print(f"{'handler':<16}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries':>9}")
+    for name, r in report["results"].items():
+        old = (baseline or {}).get("results", {}).get(name, {})
+        print(f"{name:<16}{r['ops']:>10.1f}{r['p50']:>10.2f}{r['p99']:>10.2f}{r['queries']:>9.1f}")
+        if old:
+            print(f"{'':<16}{_delta(r['ops'], old.get('ops'), False):>10}"
+                  f"{_delta(r['p50'], old.get('p50'), True):>10}"
+                  f"{_delta(r['p99'], old.get('p99'), True):>10}"
+                  f"{_delta(r['queries'], old.get('queries'), True):>9}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--subjects", type=int, default=200)
+    parser.add_argument("--labs", type=int, default=5000)
+    parser.add_argument("--files-per-lab", type=int, default=2)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--cold", action="store_true", help="сбрасывать кэш каталога перед каждым вызовом")
+    parser.add_argument("--reseed", action="store_true", help="пересоздать данные даже при совпадающем масштабе")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    if "bench" not in DB_NAME:
+        parser.error(f"бенчмарк перезаписывает данные, а DB_NAME={DB_NAME!r} не похожа на тестовую БД")
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,128 @@
+"""Сравнение приёма апдейтов: long polling против webhook.
+
+Бот с одним хендлером-«эхо» (с имитацией работы с БД) работает против
+локальной заглушки Bot API. Замеряется задержка от появления апдейта до
+прихода ответа в sendMessage и общая пропускная способность.
+
+    python bench/bench_ingest.py --updates 2000 --chats 200 --concurrency 16 --work-ms 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+from telegram.ext import Application, MessageHandler, filters
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+from updates import PerChatUpdateProcessor  # noqa: E402
+
+from fake_bot_api import FakeBotApi, make_update  # noqa: E402
+
+TOKEN = "123456:BENCH"
+SECRET = "bench-secret"
+
+
+def build_app(api, concurrency, work_s):
+    async def echo(update, context):
+        # Имитация ожидания БД: при параллельной обработке апдейты не ждут друг друга
+        await asyncio.sleep(work_s)
+        await update.message.reply_text(update.message.text)
+
+    builder = Application.builder().token(TOKEN).base_url(api.base_url)
+    if concurrency > 1:
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(concurrency))
+    app = builder.build()
+    app.add_handler(MessageHandler(filters.TEXT, echo))
+    return app
+
+
+async def deliver_webhook(port, updates, sent_at, connections):
+    """Отправка апдейтов на webhook — как это делает Telegram, до connections параллельно"""
+    limits = httpx.Limits(max_connections=connections)
+    async with httpx.AsyncClient(limits=limits) as client:
+        semaphore = asyncio.Semaphore(connections)
+
+        async def deliver(update):
+            async with semaphore:
+                sent_at[update["message"]["text"]] = time.perf_counter()
+                await client.post(
+                    f"http://127.0.0.1:{port}/hook", json=update,
+                    headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+                )
+
+        await asyncio.gather(*(deliver(u) for u in updates))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_mode(mode, args):
+    api = FakeBotApi().start()
+    app = build_app(api, args.concurrency, args.work_ms / 1000)
+    await app.initialize()
+    await app.start()
+
+    updates = [make_update(i + 1, 1000 + i % args.chats, f"ping {i + 1}") for i in range(args.updates)]
+    sent_at = {}
+
+    if mode == "polling":
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+        started = time.perf_counter()
+        for update in updates:
+            sent_at[update["message"]["text"]] = time.perf_counter()
+            api.push_update(update)
+    else:
+        port = args.webhook_port
+        await app.updater.start_webhook(
+            listen="127.0.0.1", port=port, url_path="hook",
+            webhook_url=f"http://127.0.0.1:{port}/hook", secret_token=SECRET
+        )
+        started = time.perf_counter()
+        await api.run(deliver_webhook(port, updates, sent_at, args.webhook_connections))
+
+    complete = await api.wait_replies(len(updates), timeout=args.timeout)
+    finished = max(api.replies.values()) if api.replies else time.perf_counter()
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    await api.stop()
+
+    latencies = [(api.replies[text] - t0) * 1000 for text, t0 in sent_at.items() if text in api.replies]
+    return {
+        "mode": mode,
+        "complete": complete,
+        "replies": len(latencies),
+        "throughput": len(latencies) / (finished - started),
+        "p50": statistics.median(latencies),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200, help="сколько разных чатов пишут боту")
+    parser.add_argument("--concurrency", type=int, default=16, help="1 = последовательная обработка")
+    parser.add_argument("--work-ms", type=float, default=20, help="имитация работы хендлера")
+    parser.add_argument("--webhook-port", type=int, default=8765)
+    parser.add_argument("--webhook-connections", type=int, default=40)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--modes", default="polling,webhook")
+    args = parser.parse_args()
+
+    print(f"updates={args.updates} chats={args.chats} concurrency={args.concurrency} work={args.work_ms}ms")
+    print(f"{'mode':<10}{'ok':>6}{'upd/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for mode in args.modes.split(","):
+        r = asyncio.run(run_mode(mode, args))
+        ok = "yes" if r["complete"] else f"{r['replies']}"
+        print(f"{r['mode']:<10}{ok:>6}{r['throughput']:>10.1f}{r['p50']:>10.1f}{r['p99']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Бот без сети для бенчмарков хендлеров.
+
+FakeBotRequest подменяет HTTP-транспорт PTB: запросы к Bot API проходят
+всю сериализацию PTB, но ответ собирается в памяти. Так в замерах остаются
+только хендлер, БД и сам PTB.
+"""
+import itertools
+import json
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import Application, CallbackContext, ExtBot
+from telegram.request import BaseRequest
+
+TOKEN = "123456:BENCH"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+# Методы, в ответ на которые Telegram присылает сообщение
+MESSAGE_METHODS = {
+    "sendMessage", "editMessageText", "editMessageReplyMarkup",
+    "sendDocument", "sendPhoto", "sendVideo",
+}
+
+
+class FakeBotRequest(BaseRequest):
+    def __init__(self):
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.parameters if request_data else {}
+        result = self._result(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _result(self, api_method, params):
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method not in MESSAGE_METHODS:
+            return True
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if api_method == "sendDocument":
+            message["document"] = {"file_id": f"doc-{message['message_id']}",
+                                   "file_unique_id": f"udoc-{message['message_id']}"}
+        return message
+
+
+class FakeTelegram:
+    """Приложение PTB с FakeBotRequest и фабрика апдейтов"""
+
+    def __init__(self):
+        self.request = FakeBotRequest()
+        self.bot = ExtBot(TOKEN, request=self.request, get_updates_request=FakeBotRequest())
+        self.app = Application.builder().bot(self.bot).updater(None).build()
+        self._ids = itertools.count(1)
+
+    async def start(self):
+        await self.app.initialize()
+        return self
+
+    async def stop(self):
+        await self.app.shutdown()
+
+    def context(self, update):
+        return CallbackContext.from_update(update, self.app)
+
+    def _message(self, chat_id, text):
+        user = User(chat_id, f"user{chat_id}", False)
+        message = Message(
+            next(self._ids), datetime.now(timezone.utc), Chat(chat_id, "private"),
+            from_user=user, text=text
+        )
+        message.set_bot(self.bot)
+        return message, user
+
+    def message(self, chat_id, text):
+        message, _ = self._message(chat_id, text)
+        return Update(next(self._ids), message=message)
+
+    def callback(self, chat_id, data):
+        message, user = self._message(chat_id, "…")
+        query = CallbackQuery(str(next(self._ids)), user, "bench", message=message, data=data)
+        query.set_bot(self.bot)
+        return Update(next(self._ids), callback_query=query)
@@ -0,0 +1,158 @@
+"""Локальная заглушка Telegram Bot API для бенчмарков.
+
+Понимает ровно те методы, которые нужны боту для приёма апдейтов и ответа:
+getMe, getUpdates, setWebhook, deleteWebhook, sendMessage.
+
+Сервер работает в отдельном потоке со своим event loop — как настоящий
+Telegram, он не отнимает время у event loop бота.
+"""
+import asyncio
+import json
+import threading
+import time
+
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.web import Application, RequestHandler
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+def make_update(update_id, chat_id, text):
+    """Апдейт с текстовым сообщением в личном чате"""
+    user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+class _MethodHandler(RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def post(self, token, method):
+        params = {k: self.get_body_argument(k) for k in self.request.body_arguments}
+        result = await self.api.call(method, params)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"ok": True, "result": result}))
+
+
+class FakeBotApi:
+    def __init__(self):
+        self.port = None
+        self.loop = None
+        self.updates = []
+        self.replies = {}  # текст ответа -> время получения
+        self.calls = {}
+        self._new_updates = None
+        self._server = None
+        self._closing = False
+        self._thread = None
+
+    def start(self, port=0):
+        """Запускает сервер в фоновом потоке и ждёт готовности"""
+        ready = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._listen(port))
+            ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self._thread = threading.Thread(target=serve, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    async def _listen(self, port):
+        self._new_updates = asyncio.Event()
+        app = Application([(r"/bot([^/]+)/(\w+)", _MethodHandler, {"api": self})])
+        sockets = bind_sockets(port, address="127.0.0.1")
+        self._server = HTTPServer(app)
+        self._server.add_sockets(sockets)
+        self.port = sockets[0].getsockname()[1]
+
+    async def _close(self):
+        # Будим висящие long polling запросы, чтобы они завершились пустым ответом
+        self._closing = True
+        self._new_updates.set()
+        await asyncio.sleep(0.05)
+        self._server.stop()
+        await self._server.close_all_connections()
+
+    async def stop(self):
+        await self.run(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    async def run(self, coroutine):
+        """Выполняет корутину в потоке заглушки (например, отправку апдейтов на webhook)"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.loop))
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    # --- Управление из бенчмарка ---
+    def push_update(self, update):
+        self.loop.call_soon_threadsafe(self._push_update, update)
+
+    def _push_update(self, update):
+        self.updates.append(update)
+        self._new_updates.set()
+
+    async def wait_replies(self, count, timeout=60):
+        deadline = time.monotonic() + timeout
+        while len(self.replies) < count and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return len(self.replies) >= count
+
+    # --- Методы Bot API ---
+    async def call(self, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return BOT_USER
+        if method in ("setWebhook", "deleteWebhook"):
+            return True
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "sendMessage":
+            return self._send_message(params)
+        return True
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        # Подтверждённые апдейты больше не отдаём
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._closing:
+            return []
+        limit = int(params.get("limit") or 100)
+        return self.updates[:limit]
+
+    def _send_message(self, params):
+        text = params.get("text", "")
+        self.replies.setdefault(text, time.perf_counter())
+        chat_id = int(params["chat_id"])
+        return {
+            "message_id": len(self.replies),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
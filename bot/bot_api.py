@@ -0,0 +1,159 @@
+import os
+
+import httpx
+from telegram.error import NetworkError, TimedOut
+from telegram.request import BaseRequest
+
+from metrics import observe_api_call
+
+# Пул для обычных вызовов: ответы на кнопки, сообщения, правки
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", "64"))
+# Отдельный пул для отправки и скачивания файлов
+BOT_API_MEDIA_POOL_SIZE = int(os.getenv("BOT_API_MEDIA_POOL_SIZE", "8"))
+# Сколько секунд держать простаивающее соединение открытым
+BOT_API_KEEPALIVE = float(os.getenv("BOT_API_KEEPALIVE", "30"))
+# Таймауты, секунды. Ожидание свободного соединения в пуле короткое:
+# если пул занят, лучше быстро получить ошибку, чем висеть
+BOT_API_CONNECT_TIMEOUT = float(os.getenv("BOT_API_CONNECT_TIMEOUT", "5"))
+BOT_API_READ_TIMEOUT = float(os.getenv("BOT_API_READ_TIMEOUT", "5"))
+BOT_API_POOL_TIMEOUT = float(os.getenv("BOT_API_POOL_TIMEOUT", "1"))
+BOT_API_MEDIA_TIMEOUT = float(os.getenv("BOT_API_MEDIA_TIMEOUT", "120"))
+BOT_API_MEDIA_POOL_TIMEOUT = float(os.getenv("BOT_API_MEDIA_POOL_TIMEOUT", "30"))
+
+
+class ConnectionPool(BaseRequest):
+    """Пул соединений httpx к Bot API со своими лимитами и таймаутами.
+
+    Клиент httpx создаётся здесь же (а не внутри HTTPXRequest из PTB), чтобы
+    задать срок keep-alive и скачивать файлы потоком через тот же пул.
+    Ошибки httpx переводятся в исключения PTB, как это делает HTTPXRequest.
+    """
+
+    def __init__(self, size, read_timeout, write_timeout, pool_timeout, keepalive=BOT_API_KEEPALIVE):
+        self.limits = httpx.Limits(
+            max_connections=size, max_keepalive_connections=size, keepalive_expiry=keepalive
+        )
+        self.timeout = httpx.Timeout(
+            connect=BOT_API_CONNECT_TIMEOUT, read=read_timeout, write=write_timeout, pool=pool_timeout
+        )
+        self.client = self._build_client()
+
+    def _build_client(self):
+        return httpx.AsyncClient(
+            limits=self.limits, timeout=self.timeout, headers={"User-Agent": self.USER_AGENT}
+        )
+
+    @property
+    def read_timeout(self):
+        return self.timeout.read
+
+    async def initialize(self):
+        if self.client.is_closed:
+            self.client = self._build_client()
+
+    async def shutdown(self):
+        if not self.client.is_closed:
+            await self.client.aclose()
+
+    def _timeout(self, read_timeout, write_timeout, connect_timeout, pool_timeout):
+        def pick(value, default):
+            return default if value is BaseRequest.DEFAULT_NONE else value
+        return httpx.Timeout(
+            connect=pick(connect_timeout, self.timeout.connect),
+            read=pick(read_timeout, self.timeout.read),
+            write=pick(write_timeout, self.timeout.write),
+            pool=pick(pool_timeout, self.timeout.pool),
+        )
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        return await observe_api_call(url, self._request(
+            url, method, request_data,
+            self._timeout(read_timeout, write_timeout, connect_timeout, pool_timeout),
+        ))
+
+    async def _request(self, url, method, request_data, timeout):
+        try:
+            response = await self.client.request(
+                method=method,
+                url=url,
+                timeout=timeout,
+                files=request_data.multipart_data if request_data else None,
+                data=request_data.json_parameters if request_data else None,
+            )
+        except httpx.PoolTimeout as e:
+            raise TimedOut("Pool timeout: все соединения пула заняты, запрос не отправлен") from e
+        except httpx.TimeoutException as e:
+            raise TimedOut from e
+        except httpx.HTTPError as e:
+            raise NetworkError(f"httpx.{e.__class__.__name__}: {e}") from e
+        return response.status_code, response.content
+
+    def stream(self, url):
+        """Потоковое скачивание (async with pool.stream(url) as response)"""
+        return self.client.stream("GET", url)
+
+
+class RoutingRequest(BaseRequest):
+    """Два пула соединений к Bot API: для обычных вызовов и для файлов.
+
+    Загрузка файла лабораторной может занимать соединение десятки секунд;
+    в общем пуле несколько таких загрузок оставили бы ответы на кнопки
+    без соединения (pool timeout). Запросы с файлами (multipart) и
+    скачивание по /file/bot... идут в свой небольшой пул с длинными
+    таймаутами, всё остальное — в основной.
+    """
+
+    def __init__(self, pool_size=BOT_API_POOL_SIZE, media_pool_size=BOT_API_MEDIA_POOL_SIZE):
+        self.api = ConnectionPool(
+            pool_size,
+            read_timeout=BOT_API_READ_TIMEOUT,
+            write_timeout=BOT_API_READ_TIMEOUT,
+            pool_timeout=BOT_API_POOL_TIMEOUT,
+        )
+        self.media = ConnectionPool(
+            media_pool_size,
+            read_timeout=BOT_API_MEDIA_TIMEOUT,
+            write_timeout=BOT_API_MEDIA_TIMEOUT,
+            pool_timeout=BOT_API_MEDIA_POOL_TIMEOUT,
+        )
+        self.requests = {"api": 0, "media": 0}
+
+    @property
+    def read_timeout(self):
+        return self.api.read_timeout
+
+    async def initialize(self):
+        await self.api.initialize()
+        await self.media.initialize()
+
+    async def shutdown(self):
+        await self.api.shutdown()
+        await self.media.shutdown()
+
+    def _pool(self, url, request_data):
+        if "/file/bot" in url or (request_data is not None and request_data.contains_files):
+            return "media"
+        return "api"
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        pool = self._pool(url, request_data)
+        self.requests[pool] += 1
+        return await getattr(self, pool).do_request(url, method, request_data, **kwargs)
+
+    def stream(self, url):
+        """Потоковое скачивание файла через пул для файлов (async with ... as response)"""
+        self.requests["media"] += 1
+        return self.media.stream(url)
+
+    def stats(self):
+        return {
+            "api_pool_size": self.api.limits.max_connections,
+            "media_pool_size": self.media.limits.max_connections,
+            "api_requests_total": self.requests["api"],
+            "media_requests_total": self.requests["media"],
+        }
+
+
+api_request = RoutingRequest()
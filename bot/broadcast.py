@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import select, update
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError, TimedOut
+
+from coordination import coordinator
+from db import AsyncSessionLocal
+from models import Broadcast, Subscription, User
+from ratelimit import TokenBucket
+
+log = logging.getLogger(__name__)
+# Записи по отдельным получателям — шумные, для них настроена выборка (LOG_SAMPLING)
+send_log = logging.getLogger(f"{__name__}.send")
+
+# --- Настройки рассылки ---
+# Доля рассылки в общем лимите бота (BOT_API_RATE): остаток — на ответы пользователям.
+# Лимит на один чат и повторы после flood control — в BotApiRateLimiter
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # сообщений/сек (лимит Telegram ~30)
+BROADCAST_SENDERS = int(os.getenv("BROADCAST_SENDERS", "8"))  # параллельных отправителей
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "500"))  # получателей между контрольными точками
+BROADCAST_RETRIES = 3
+PROGRESS_INTERVAL = 5  # секунд между обновлениями прогресса
+
+
+class Broadcaster:
+    """Рассылки через таблицу broadcasts.
+
+    Получатели читаются серверным курсором пачками по users.id; после каждой
+    пачки курсор сохраняется в БД, поэтому после рестарта рассылка
+    продолжается с места остановки (повторно может уйти не больше одной пачки).
+    """
+
+    def __init__(self):
+        self.bot = None
+        self.global_bucket = TokenBucket(BROADCAST_RATE)
+        self._senders = asyncio.Semaphore(BROADCAST_SENDERS)
+        self._tasks = {}
+
+    def bind(self, bot):
+        self.bot = bot
+
+    async def enqueue(self, text, admin_chat_id=None, subject_id=None):
+        """Записывает рассылку в outbox; отправляет её реплика-лидер.
+
+        subject_id — разослать только подписчикам предмета.
+
+        Лимит Telegram общий на токен бота, поэтому рассылки идут из одного
+        экземпляра. Другие реплики только сообщают лидеру о новой рассылке.
+        """
+        async with AsyncSessionLocal() as session:
+            broadcast = Broadcast(text=text, admin_chat_id=admin_chat_id, subject_id=subject_id)
+            session.add(broadcast)
+            await session.flush()
+            await coordinator.publish(session, "broadcast", id=broadcast.id)
+            await session.commit()
+        if coordinator.is_leader:
+            self.start(broadcast.id)
+        return broadcast.id
+
+    def start(self, broadcast_id):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(broadcast_id, None))
+
+    async def resume_pending(self):
+        """Продолжает рассылки, прерванные рестартом"""
+        async with AsyncSessionLocal() as session:
+            ids = (await session.scalars(
+                select(Broadcast.id).where(Broadcast.status != "done").order_by(Broadcast.id)
+            )).all()
+        for broadcast_id in ids:
+            log.info("Возобновляем рассылку #%s", broadcast_id)
+            self.start(broadcast_id)
+
+    def stats(self):
+        return {"active": len(self._tasks)}
+
+    async def shutdown(self):
+        # Прогресс уже сохранён в БД — задачи можно просто отменить
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- Выполнение рассылки ---
+    async def _run(self, broadcast_id):
+        async with AsyncSessionLocal() as session:
+            broadcast = await session.get(Broadcast, broadcast_id)
+            if broadcast is None or broadcast.status == "done":
+                return
+            broadcast.status = "running"
+            await session.commit()
+
+        cursor = broadcast.last_user_id or 0
+        sent = broadcast.sent_count or 0
+        failed = broadcast.failed_count or 0
+        progress = _Progress(self.bot, broadcast.admin_chat_id, broadcast_id)
+        await progress.report(sent, failed)
+
+        try:
+            async for batch in self._recipients(cursor, broadcast.subject_id):
+                results = await asyncio.gather(
+                    *(self._send(tg_id, broadcast.text) for _, tg_id in batch)
+                )
+                sent += sum(results)
+                failed += len(results) - sum(results)
+                cursor = batch[-1][0]
+                await self._checkpoint(broadcast_id, cursor, sent, failed)
+                await progress.report(sent, failed)
+
+            await self._checkpoint(broadcast_id, cursor, sent, failed, done=True)
+            await progress.report(sent, failed, done=True)
+        except asyncio.CancelledError:
+            log.info("Рассылка #%s остановлена на users.id=%s", broadcast_id, cursor)
+            raise
+        except Exception as e:
+            log.exception("Ошибка в рассылке #%s: %s", broadcast_id, e)
+
+    async def _recipients(self, after_id, subject_id=None):
+        """Пачки (users.id, tg_id) через серверный курсор.
+
+        Для рассылки по предмету — подписчики: range scan по первичному ключу
+        subscriptions (subject_id, user_id) в порядке users.id, поэтому
+        курсор контрольных точек тот же.
+        """
+        if subject_id is None:
+            query = select(User.id, User.tg_id).where(User.id > after_id).order_by(User.id)
+        else:
+            query = (
+                select(User.id, User.tg_id)
+                .join(Subscription, Subscription.user_id == User.id)
+                .where(Subscription.subject_id == subject_id, Subscription.user_id > after_id)
+                .order_by(Subscription.user_id)
+            )
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(query.execution_options(yield_per=BROADCAST_BATCH))
+            async for partition in result.partitions(BROADCAST_BATCH):
+                yield partition
+
+    async def _checkpoint(self, broadcast_id, cursor, sent, failed, done=False):
+        values = {"last_user_id": cursor, "sent_count": sent, "failed_count": failed}
+        if done:
+            values.update(status="done", finished_at=datetime.utcnow())
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(**values))
+            await session.commit()
+
+    async def _send(self, chat_id, text):
+        async with self._senders:
+            error = None
+            for attempt in range(BROADCAST_RETRIES):
+                await self.global_bucket.acquire()
+                try:
+                    await self.bot.send_message(chat_id, text)
+                    return True
+                except RetryAfter as e:
+                    # Flood control не прошёл и после повторов ограничителя бота:
+                    # притормаживаем всю рассылку, а не только этот чат
+                    self.global_bucket.pause(e.retry_after)
+                    error = e
+                except Forbidden:
+                    # Пользователь заблокировал бота — повторять бессмысленно
+                    send_log.info("Пользователь %s заблокировал бота", chat_id)
+                    return False
+                except BadRequest as e:
+                    # Чат не найден, слишком длинный текст и т.п. — повтор не поможет
+                    send_log.warning("Не удалось отправить сообщение пользователю %s: %s", chat_id, e)
+                    return False
+                except TimedOut as e:
+                    # Сообщение могло уже дойти — повтор дал бы дубль
+                    send_log.warning("Таймаут отправки пользователю %s, не повторяем: %s", chat_id, e)
+                    return False
+                except NetworkError as e:
+                    error = e
+                    await asyncio.sleep(2 ** attempt)
+                except TelegramError as e:
+                    send_log.warning("Не удалось отправить сообщение пользователю %s: %s", chat_id, e)
+                    return False
+            send_log.warning(
+                "Не удалось отправить сообщение пользователю %s за %d попыток: %s", chat_id, BROADCAST_RETRIES, error
+            )
+            return False
+
+
+class _Progress:
+    """Сообщение админу с прогрессом рассылки (не чаще PROGRESS_INTERVAL)"""
+
+    def __init__(self, bot, chat_id, broadcast_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.broadcast_id = broadcast_id
+        self.message = None
+        self.last_update = 0.0
+
+    async def report(self, sent, failed, done=False):
+        if not self.chat_id:
+            return
+        now = time.monotonic()
+        if not done and self.message and now - self.last_update < PROGRESS_INTERVAL:
+            return
+        self.last_update = now
+
+        if done:
+            text = f"✅ Рассылка #{self.broadcast_id} завершена.\nОтправлено: {sent}, ошибок: {failed}"
+        else:
+            text = f"📤 Рассылка #{self.broadcast_id}...\nОтправлено: {sent}, ошибок: {failed}"
+
+        try:
+            if self.message is None:
+                self.message = await self.bot.send_message(self.chat_id, text)
+            else:
+                await self.message.edit_text(text)
+        except TelegramError as e:
+            log.warning("Не удалось обновить прогресс рассылки #%s: %s", self.broadcast_id, e)
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import uuid
+import zipfile
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from db import AsyncSessionLocal
+from models import LabBundle
+from storage import UPLOAD_DIR, STAGING_DIR, DOWNLOAD_CHUNK
+
+MB = 1024 * 1024
+# Архивы лежат по хэшу набора файлов: bundles/<hash>.zip
+BUNDLES_DIR = os.path.join(UPLOAD_DIR, "bundles")
+# Бот не может отправить файл больше 50 МБ
+BUNDLE_MAX_SIZE = int(os.getenv("BUNDLE_MAX_MB", "50")) * MB
+# Сколько замков на все лабораторные: архивы разных лабораторных с одним
+# замком собираются по очереди, зато словарь замков не растёт
+BUNDLE_LOCKS = int(os.getenv("BUNDLE_LOCKS", "64"))
+# Уже сжатые форматы кладём в архив как есть
+STORED_EXTENSIONS = {'.zip', '.tar.gz', '.gz', '.7z', '.rar', '.jpg', '.jpeg', '.png', '.docx', '.xlsx'}
+
+
+class BundleTooLarge(Exception):
+    pass
+
+
+def _arcnames(files):
+    """Имена внутри архива; одинаковые имена получают номер: report (2).pdf"""
+    seen = {}
+    for lab_file in files:
+        name = os.path.basename(lab_file.file_name or "") or f"file_{lab_file.id}"
+        count = seen.get(name.lower(), 0) + 1
+        seen[name.lower()] = count
+        if count > 1:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem} ({count}){extension}"
+        yield name, lab_file
+
+
+def file_set_hash(files):
+    """Хэш набора файлов: меняется при добавлении, удалении или замене любого файла"""
+    digest = hashlib.sha256()
+    for name, lab_file in _arcnames(sorted(files, key=lambda f: f.id)):
+        content = lab_file.content_hash or f"{lab_file.file_path}:{lab_file.file_size}"
+        digest.update(f"{name}\0{content}\n".encode())
+    return digest.hexdigest()
+
+
+def build_zip(entries, path):
+    """Собирает архив потоково: в памяти не больше одного куска исходного файла.
+
+    entries — (имя в архиве, путь к файлу, дата). Синхронная, вызывается
+    через asyncio.to_thread.
+    """
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = os.path.join(STAGING_DIR, f"{uuid.uuid4()}.zip.part")
+    try:
+        with zipfile.ZipFile(tmp_path, "w") as archive:
+            for name, source, date_time in entries:
+                info = zipfile.ZipInfo(name, date_time)
+                info.compress_type = (
+                    zipfile.ZIP_STORED if name.lower().endswith(tuple(STORED_EXTENSIONS))
+                    else zipfile.ZIP_DEFLATED
+                )
+                with open(source, "rb") as src, archive.open(info, "w") as dst:
+                    shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+def _zip_date(uploaded_at):
+    # ZIP не хранит даты раньше 1980 года
+    if uploaded_at is None or uploaded_at.year < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    return uploaded_at.timetuple()[:6]
+
+
+class BundleCache:
+    """ZIP со всеми файлами лабораторной, собранный один раз.
+
+    Запись в lab_bundles действительна, пока совпадает хэш набора файлов.
+    После первой отправки хранится file_id архива в Telegram, и повторное
+    скачивание — один запрос sendDocument без загрузки байтов.
+    """
+
+    def __init__(self):
+        # Замок по lab_id % BUNDLE_LOCKS: один архив не собирается дважды одновременно
+        self._locks = [asyncio.Lock() for _ in range(BUNDLE_LOCKS)]
+        self.hits = 0
+        self.builds = 0
+
+    async def get(self, lab_id, files, local=False):
+        """Актуальный LabBundle для набора файлов; при необходимости собирает архив.
+
+        local=True — нужен сам zip на диске (file_id отвергнут Telegram, а
+        архив уже удалил сборщик мусора): недостающий архив собирается заново.
+        """
+        set_hash = file_set_hash(files)
+        async with self._locks[lab_id % len(self._locks)]:
+            async with AsyncSessionLocal() as session:
+                bundle = await session.get(LabBundle, lab_id)
+            fresh = bundle is not None and bundle.file_set_hash == set_hash
+            if fresh and (os.path.exists(bundle.path) or (bundle.tg_file_id and not local)):
+                self.hits += 1
+                return bundle
+
+            if sum(f.file_size or 0 for f in files) > BUNDLE_MAX_SIZE:
+                raise BundleTooLarge()
+            entries = []
+            for name, lab_file in _arcnames(files):
+                if not lab_file.file_path or not os.path.exists(lab_file.file_path):
+                    raise FileNotFoundError(lab_file.file_name)
+                entries.append((name, lab_file.file_path, _zip_date(lab_file.uploaded_at)))
+
+            path = os.path.join(BUNDLES_DIR, f"{set_hash}.zip")
+            if os.path.exists(path):
+                size = os.path.getsize(path)
+            else:
+                size = await asyncio.to_thread(build_zip, entries, path)
+                self.builds += 1
+            if size > BUNDLE_MAX_SIZE:
+                raise BundleTooLarge()
+
+            stale_path = bundle.path if bundle and bundle.path != path else None
+            async with AsyncSessionLocal() as session:
+                stmt = insert(LabBundle).values(
+                    lab_id=lab_id, file_set_hash=set_hash, path=path, size=size, tg_file_id=None
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[LabBundle.lab_id],
+                    set_={
+                        "file_set_hash": stmt.excluded.file_set_hash,
+                        "path": stmt.excluded.path,
+                        "size": stmt.excluded.size,
+                        "tg_file_id": None,
+                        "created_at": func.now(),
+                    }
+                ).returning(LabBundle)
+                bundle = (await session.execute(stmt)).scalar_one()
+                await session.commit()
+                if stale_path:
+                    await self._remove_unused(session, stale_path)
+            return bundle
+
+    async def remember_file_id(self, lab_id, set_hash, tg_file_id):
+        """Сохраняет file_id отправленного архива, если набор файлов не успел измениться"""
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(LabBundle)
+                .where(LabBundle.lab_id == lab_id, LabBundle.file_set_hash == set_hash)
+                .values(tg_file_id=tg_file_id)
+            )
+            await session.commit()
+
+    async def _remove_unused(self, session, path):
+        # Одинаковый набор файлов у двух лабораторных даёт один и тот же архив
+        used = await session.scalar(select(func.count()).where(LabBundle.path == path))
+        if not used and os.path.exists(path):
+            os.remove(path)
+
+    def stats(self):
+        return {"hits": self.hits, "builds": self.builds}
+
+
+bundles = BundleCache()
@@ -0,0 +1,388 @@
+import asyncio
+import html
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import cached_property
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from db import AsyncSessionLocal
+from models import Subject, Lab
+from deadlines import format_deadline
+
+# Лимит длины одного сообщения Telegram (4096) с запасом на эмодзи
+MESSAGE_LIMIT = 4000
+# Кнопок-строк на одной странице списка
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "10"))
+# Сколько разных страниц держим в кэше
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "512"))
+
+
+# --- Снимок каталога (неизменяемые копии строк БД) ---
+@dataclass(frozen=True)
+class LabView:
+    id: int
+    subject_id: int
+    title: str
+    desc: str
+    deadline: object  # datetime с часовым поясом или None
+    deadline_text: str
+
+    @property
+    def deadline_label(self):
+        return format_deadline(self.deadline, self.deadline_text)
+
+
+@dataclass(frozen=True)
+class SubjectView:
+    id: int
+    name: str
+    labs: tuple
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    subjects: tuple
+    subjects_by_id: dict
+    labs_by_id: dict
+    # Отрендеренные клавиатуры и тексты этой версии каталога
+    rendered: dict = field(default_factory=dict)
+
+    @property
+    def labs(self):
+        return tuple(lab for subject in self.subjects for lab in subject.labs)
+
+    def render(self, name, builder):
+        """Клавиатура или текст строится один раз на версию каталога"""
+        value = self.rendered.get(name)
+        if value is None:
+            value = builder(self)
+            self.rendered[name] = value
+        return value
+
+
+async def load_snapshot(version):
+    """Загружает все предметы с лабораторными одним запросом (JOIN)"""
+    async with AsyncSessionLocal() as session:
+        subjects = (await session.scalars(
+            select(Subject).options(joinedload(Subject.labs)).order_by(Subject.id)
+        )).unique().all()
+
+    subject_views = []
+    labs_by_id = {}
+    for subject in subjects:
+        labs = tuple(
+            LabView(lab.id, lab.subject_id, lab.title, lab.desc, lab.deadline, lab.deadline_text)
+            for lab in sorted(subject.labs, key=lambda lab: lab.id)
+        )
+        for lab in labs:
+            labs_by_id[lab.id] = lab
+        subject_views.append(SubjectView(subject.id, subject.name, labs))
+
+    return CatalogSnapshot(
+        version=version,
+        subjects=tuple(subject_views),
+        subjects_by_id={s.id: s for s in subject_views},
+        labs_by_id=labs_by_id,
+    )
+
+
+# --- Постраничные списки (keyset-пагинация) ---
+@dataclass(frozen=True)
+class PagedList:
+    source: str    # "subjects" или "labs"
+    header: str    # {subject} подставляется для списка лабораторных предмета
+    empty: str
+    buttons: object  # (id, подпись) -> ряд кнопок
+    footer: tuple = ()  # ((текст, callback_data), ...)
+
+
+def _open_button(prefix):
+    return lambda row_id, label: [InlineKeyboardButton(label, callback_data=f"{prefix}:{row_id}")]
+
+
+def _edit_delete_buttons(kind):
+    return lambda row_id, label: [
+        InlineKeyboardButton(f"✏️ {label}", callback_data=f"edit_{kind}:{row_id}"),
+        InlineKeyboardButton("🗑️", callback_data=f"delete_{kind}:{row_id}")
+    ]
+
+
+BACK_TO_ADMIN = (("⬅️ Назад", "back_to_admin"),)
+
+# Ключ — однобуквенный код списка в callback_data "pg:<код><область>:<курсор>"
+PAGED_LISTS = {
+    "s": PagedList("subjects", "Ваши предметы:", "Пока предметов нет.", _open_button("subject")),
+    "a": PagedList("subjects", "Выберите предмет:", "Нет предметов для добавления лабораторной.",
+                   _open_button("lab_subj")),
+    "m": PagedList("subjects", "Управление предметами:\n\nВыберите предмет для редактирования или удаления:",
+                   "Нет предметов для управления.", _edit_delete_buttons("subject"), BACK_TO_ADMIN),
+    "L": PagedList("labs", "Управление лабораторными:\n\nВыберите лабораторную для редактирования или удаления:",
+                   "Нет лабораторных для управления.", _edit_delete_buttons("lab"), BACK_TO_ADMIN),
+    "l": PagedList("labs", "📚 {subject}\n\nВыберите лабораторную:", "📚 {subject}\n\nПока нет лабораторных работ.",
+                   _open_button("lab"), (("⬅️ Назад к предметам", "back_to_subjects"),)),
+}
+
+_LIST_RE = re.compile(r"^([a-zA-Z])(\d*)$")
+_CURSOR_RE = re.compile(r"^(?:[<>]\d+)?$")
+
+
+def page_list(value):
+    """Тип аргумента маршрута: "l12" -> ("l", 12), "s" -> ("s", 0)"""
+    match = _LIST_RE.match(value)
+    if not match or match.group(1) not in PAGED_LISTS:
+        raise ValueError(f"неизвестный список {value!r}")
+    return match.group(1), int(match.group(2) or 0)
+
+
+def page_cursor(value):
+    """Тип аргумента маршрута: "" — первая страница, ">id" — после id, "<id" — до id"""
+    if not _CURSOR_RE.match(value):
+        raise ValueError(f"некорректный курсор {value!r}")
+    return value
+
+
+def page_callback(kind, scope=0, cursor=""):
+    return f"pg:{kind}{scope or ''}:{cursor}"
+
+
+@dataclass(frozen=True)
+class Page:
+    kind: str
+    scope: int
+    rows: tuple  # ((id, подпись), ...)
+    prev_cursor: str  # None — предыдущей страницы нет
+    next_cursor: str
+    found: bool = True  # False — предмет для списка его лабораторных удалён
+    subject: str = None
+
+    @property
+    def text(self):
+        spec = PAGED_LISTS[self.kind]
+        template = spec.header if self.rows else spec.empty
+        return template.format(subject=self.subject)
+
+    # Страница живёт в кэше до смены версии каталога — кнопки строятся один раз
+    @cached_property
+    def keyboard(self):
+        spec = PAGED_LISTS[self.kind]
+        keyboard = [spec.buttons(row_id, label) for row_id, label in self.rows]
+        nav = []
+        if self.prev_cursor:
+            nav.append(InlineKeyboardButton("⬅️", callback_data=page_callback(self.kind, self.scope, self.prev_cursor)))
+        if self.next_cursor:
+            nav.append(InlineKeyboardButton("➡️", callback_data=page_callback(self.kind, self.scope, self.next_cursor)))
+        if nav:
+            keyboard.append(nav)
+        keyboard.extend([InlineKeyboardButton(text, callback_data=data)] for text, data in spec.footer)
+        return InlineKeyboardMarkup(keyboard) if keyboard else None
+
+
+def _page_query(kind, scope):
+    if PAGED_LISTS[kind].source == "subjects":
+        return select(Subject.id, Subject.name), Subject.id
+    query = select(Lab.id, Lab.title)
+    if kind == "l":
+        query = query.where(Lab.subject_id == scope)
+    return query, Lab.id
+
+
+async def load_page(kind, scope=0, cursor="", size=PAGE_SIZE):
+    """Одна страница по индексу первичного ключа: WHERE id > курсор LIMIT size + 1.
+
+    Лишняя строка только показывает, есть ли следующая страница, — без
+    OFFSET и COUNT(*), поэтому цена запроса не растёт с номером страницы.
+    """
+    backward = cursor.startswith("<")
+    key = int(cursor[1:]) if cursor else 0
+    query, id_column = _page_query(kind, scope)
+    if backward:
+        query = query.where(id_column < key).order_by(id_column.desc())
+    else:
+        query = query.where(id_column > key).order_by(id_column)
+
+    async with AsyncSessionLocal() as session:
+        rows = [tuple(row) for row in (await session.execute(query.limit(size + 1))).all()]
+        subject = None
+        if kind == "l":
+            subject = await session.scalar(select(Subject.name).where(Subject.id == scope))
+            if subject is None:
+                return Page(kind, scope, (), None, None, found=False)
+
+    more = len(rows) > size
+    rows = rows[:size]
+    if not rows and cursor:
+        # Строки с обеих сторон курсора удалили — начинаем список сначала
+        return await load_page(kind, scope, "", size)
+    if backward:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = bool(key), more
+
+    return Page(
+        kind, scope, tuple(rows),
+        prev_cursor=f"<{rows[0][0]}" if rows and has_prev else None,
+        next_cursor=f">{rows[-1][0]}" if rows and has_next else None,
+        subject=subject,
+    )
+
+
+# --- Read-through кэш ---
+class CatalogCache:
+    """Кэш дерева предметов/лабораторных.
+
+    Админские изменения вызывают invalidate(), которая повышает версию;
+    следующий запрос перечитывает каталог из БД. Страницы списков
+    кэшируются отдельно и читаются по одной, а не всем каталогом.
+    """
+
+    def __init__(self, loader=load_snapshot, page_loader=load_page):
+        self._loader = loader
+        self._page_loader = page_loader
+        self._snapshot = None
+        # (версия, список, область, курсор) -> Page
+        self._pages = OrderedDict()
+        self.page_hits = 0
+        self.page_misses = 0
+        self._lock = asyncio.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self):
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+        return None
+
+    async def get(self):
+        snapshot = self._fresh()
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+
+        # Одна загрузка на всех: остальные ждут на блокировке
+        async with self._lock:
+            snapshot = self._fresh()
+            if snapshot is not None:
+                self.hits += 1
+                return snapshot
+
+            self.misses += 1
+            version = self.version
+            snapshot = await self._loader(version)
+            # Если во время загрузки каталог изменился — снимок уже устарел
+            if version == self.version:
+                self._snapshot = snapshot
+            return snapshot
+
+    async def page(self, kind, scope=0, cursor=""):
+        """Страница списка; каждая страница читается из БД один раз на версию"""
+        key = (self.version, kind, scope, cursor)
+        page = self._pages.get(key)
+        if page is not None:
+            self.page_hits += 1
+            self._pages.move_to_end(key)
+            return page
+
+        self.page_misses += 1
+        page = await self._page_loader(kind, scope, cursor)
+        if key[0] == self.version:
+            self._pages[key] = page
+            while len(self._pages) > PAGE_CACHE_SIZE:
+                self._pages.popitem(last=False)
+        return page
+
+    def invalidate(self):
+        self.version += 1
+        # Страницы старых версий больше не понадобятся
+        self._pages.clear()
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "page_hits": self.page_hits,
+            "page_misses": self.page_misses,
+            "pages_cached": len(self._pages),
+        }
+
+
+catalog = CatalogCache()
+
+
+# --- Сводка «Актуально» ---
+# Предельная длина названия в сводке (после экранирования): любая строка
+# сводки заведомо помещается в одно сообщение
+DIGEST_ENTRY_LIMIT = MESSAGE_LIMIT // 4
+
+
+def escape_limited(text, limit=DIGEST_ENTRY_LIMIT):
+    """html.escape(text), обрезанный по целым символам: тег или &amp; не режется"""
+    escaped = html.escape(text)
+    if len(escaped) <= limit:
+        return escaped
+    parts = []
+    size = 1  # «…»
+    for char in text:
+        char = html.escape(char)
+        if size + len(char) > limit:
+            break
+        parts.append(char)
+        size += len(char)
+    return "".join(parts) + "…"
+
+
+def digest_pages(snapshot):
+    """Текст сводки, разбитый на страницы не длиннее лимита сообщения"""
+    header = "📚 <b>АКТУАЛЬНЫЕ ЛАБОРАТОРНЫЕ</b>\n\n"
+    blocks = []
+    for subject in snapshot.subjects:
+        if not subject.labs:
+            continue
+        lines = [f"<b>📖 {escape_limited(subject.name)}</b>\n"]
+        for lab in subject.labs:
+            # Форматируем дедлайн (если есть)
+            deadline_text = f" | ⏳ {escape_limited(lab.deadline_label)}" if lab.deadline_label else ""
+            lines.append(f"   • {escape_limited(lab.title)}{deadline_text}\n")
+        lines.append("\n")
+        blocks.append(lines)
+
+    pages = []
+    page = header
+    for lines in blocks:
+        block = "".join(lines)
+        # Предмет целиком переносится на новую страницу, если не помещается
+        if len(page) + len(block) > MESSAGE_LIMIT and page != header:
+            pages.append(page)
+            page = ""
+        if len(page) + len(block) <= MESSAGE_LIMIT:
+            page += block
+            continue
+        # Очень длинный предмет режем между строками — разметка строки не рвётся
+        for line in lines:
+            if len(page) + len(line) > MESSAGE_LIMIT and page:
+                pages.append(page)
+                page = ""
+            page += line
+    pages.append(page)
+    return tuple(pages)
+
+
+def digest_keyboard(page, total):
+    if total <= 1:
+        return None
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️", callback_data=f"digest:{page - 1}"))
+    buttons.append(InlineKeyboardButton(f"{page + 1}/{total}", callback_data=f"digest:{page}"))
+    if page < total - 1:
+        buttons.append(InlineKeyboardButton("➡️", callback_data=f"digest:{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text
+
+from bundles import BUNDLES_DIR
+from db import AsyncSessionLocal
+from models import FileBlob, LabBundle, LabFile
+from storage import UPLOAD_DIR, OBJECTS_DIR, STAGING_DIR
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Как часто лидер собирает мусор и через сколько после старта — первый раз
+GC_INTERVAL = float(os.getenv("GC_INTERVAL_HOURS", "6")) * 3600
+GC_FIRST_RUN = float(os.getenv("GC_FIRST_RUN", "300"))
+# Сколько хранится файл, на который ничего не ссылается: брошенная загрузка,
+# незавершённый диалог добавления лабораторной, файл удалённой лабораторной
+GC_UPLOAD_TTL = timedelta(hours=float(os.getenv("GC_UPLOAD_TTL_HOURS", "24")))
+# Строк БД / файлов за один запрос
+GC_BATCH = int(os.getenv("GC_BATCH", "500"))
+
+# Содержимое без ссылок. NOT EXISTS страхует от неверного ref_count, SKIP LOCKED —
+# от строки, на которую прямо сейчас ссылается вставляемый lab_files
+DELETE_BLOBS_SQL = text("""
+    DELETE FROM file_blobs WHERE sha256 IN (
+        SELECT b.sha256 FROM file_blobs b
+        WHERE b.ref_count <= 0 AND b.used_at < :cutoff
+          AND NOT EXISTS (SELECT 1 FROM lab_files f WHERE f.content_hash = b.sha256)
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING path, size
+""")
+
+# Разделы отчёта: (ключ, подпись)
+SECTIONS = (
+    ("blobs", "содержимое без ссылок"),
+    ("staging", "брошенные загрузки"),
+    ("bundles", "устаревшие архивы"),
+    ("orphans", "файлы без записи в БД"),
+)
+
+
+@dataclass
+class GCReport:
+    files: dict = field(default_factory=lambda: dict.fromkeys(dict(SECTIONS), 0))
+    bytes: dict = field(default_factory=lambda: dict.fromkeys(dict(SECTIONS), 0))
+    missing: int = 0  # строки lab_files, файла которых нет на диске
+    elapsed: float = 0.0
+
+    @property
+    def reclaimed(self):
+        return sum(self.bytes.values())
+
+    @property
+    def removed(self):
+        return sum(self.files.values())
+
+    def add(self, section, removed):
+        for size in removed:
+            self.files[section] += 1
+            self.bytes[section] += size
+
+    def text(self):
+        lines = [f"🧹 Сборка мусора за {self.elapsed:.1f} с: освобождено {self.reclaimed / MB:.1f} МБ"]
+        for key, label in SECTIONS:
+            if self.files[key]:
+                lines.append(f"• {label}: {self.files[key]} ({self.bytes[key] / MB:.1f} МБ)")
+        if self.missing:
+            lines.append(f"⚠️ Файлов лабораторных нет на диске: {self.missing}")
+        return "\n".join(lines)
+
+
+# --- Файловая система (в отдельном потоке) ---
+def _remove(paths):
+    """Удаляет файлы; возвращает размеры удалённых"""
+    removed = []
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed.append(size)
+    return removed
+
+
+def _old_files(directory, cutoff, recursive=False):
+    """Файлы каталога, не менявшиеся с cutoff (timestamp)"""
+    if not os.path.isdir(directory):
+        return []
+    if recursive:
+        candidates = (os.path.join(root, name) for root, _, names in os.walk(directory) for name in names)
+    else:
+        candidates = (entry.path for entry in os.scandir(directory) if entry.is_file(follow_symlinks=False))
+    old = []
+    for path in candidates:
+        try:
+            if os.path.getmtime(path) < cutoff:
+                old.append(path)
+        except FileNotFoundError:
+            pass
+    return old
+
+
+def _missing(paths):
+    return [path for path in paths if not path or not os.path.exists(path)]
+
+
+def _batches(items, size=GC_BATCH):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class StorageGC:
+    """Сборка мусора в хранилище файлов (UPLOAD_DIR).
+
+    Работает только у реплики-лидера, раз в GC_INTERVAL. Удаляет содержимое,
+    на которое не ссылается ни один lab_files (ref_count ведёт триггер),
+    брошенные временные файлы staging/, архивы без записи в lab_bundles и
+    файлы на диске без строки в БД. Строки lab_files сверяются с диском
+    пачками: пропавшие файлы только попадают в отчёт. Всё, что младше
+    GC_UPLOAD_TTL, не трогается — это может быть загрузка в процессе.
+    """
+
+    def __init__(self):
+        self.job_queue = None
+        self._job = None
+        self._lock = asyncio.Lock()
+        self.runs = 0
+        self.reclaimed_bytes = 0
+        self.removed_files = 0
+        self.missing_files = 0
+        self.last_duration = 0.0
+
+    def bind(self, job_queue):
+        self.job_queue = job_queue
+
+    def start(self):
+        if self.job_queue is None or self._job is not None:
+            return
+        self._job = self.job_queue.run_repeating(
+            self._tick, interval=GC_INTERVAL, first=GC_FIRST_RUN, name="storage_gc"
+        )
+
+    def stop(self):
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+    async def _tick(self, context):
+        try:
+            await self.run()
+        except Exception as e:
+            log.exception("Ошибка сборки мусора: %s", e)
+
+    async def run(self):
+        """Один проход; параллельный вызов ждёт окончания текущего"""
+        async with self._lock:
+            started = time.perf_counter()
+            report = GCReport()
+            cutoff = datetime.utcnow() - GC_UPLOAD_TTL
+            cutoff_ts = time.time() - GC_UPLOAD_TTL.total_seconds()
+
+            await self._collect_blobs(report, cutoff)
+            report.add("staging", await asyncio.to_thread(
+                lambda: _remove(_old_files(STAGING_DIR, cutoff_ts))
+            ))
+            await self._collect_unreferenced(report, "bundles", BUNDLES_DIR, LabBundle.path, cutoff_ts)
+            await self._collect_unreferenced(report, "orphans", OBJECTS_DIR, FileBlob.path, cutoff_ts, recursive=True)
+            # Файлы из времён до хранилища по хэшу лежат прямо в UPLOAD_DIR
+            await self._collect_unreferenced(report, "orphans", UPLOAD_DIR, LabFile.file_path, cutoff_ts)
+            await self._count_missing(report)
+
+            report.elapsed = time.perf_counter() - started
+            self.runs += 1
+            self.reclaimed_bytes += report.reclaimed
+            self.removed_files += report.removed
+            self.missing_files = report.missing
+            self.last_duration = report.elapsed
+            log.info(
+                "Сборка мусора: удалено файлов %d, освобождено %d байт за %.2f с",
+                report.removed, report.reclaimed, report.elapsed,
+                extra={"gc_" + key: report.bytes[key] for key, _ in SECTIONS}
+            )
+            if report.missing:
+                log.warning("Файлов лабораторных нет на диске: %d", report.missing)
+            return report
+
+    async def _collect_blobs(self, report, cutoff):
+        # Строки удаляются пачками в отдельных транзакциях, файлы — после commit
+        while True:
+            async with AsyncSessionLocal() as session:
+                rows = (await session.execute(DELETE_BLOBS_SQL, {"cutoff": cutoff, "limit": GC_BATCH})).all()
+                await session.commit()
+            report.add("blobs", await asyncio.to_thread(_remove, [path for path, _ in rows if path]))
+            if len(rows) < GC_BATCH:
+                return
+
+    async def _collect_unreferenced(self, report, section, directory, column, cutoff_ts, recursive=False):
+        """Старые файлы каталога, путь которых не встречается в column"""
+        paths = await asyncio.to_thread(_old_files, directory, cutoff_ts, recursive)
+        for batch in _batches(paths):
+            async with AsyncSessionLocal() as session:
+                used = set((await session.scalars(select(column).where(column.in_(batch)))).all())
+            report.add(section, await asyncio.to_thread(_remove, [path for path in batch if path not in used]))
+
+    async def _count_missing(self, report):
+        # Keyset-проход по lab_files: WHERE id > последний LIMIT пачка
+        after = 0
+        while True:
+            async with AsyncSessionLocal() as session:
+                rows = (await session.execute(
+                    select(LabFile.id, LabFile.file_path)
+                    .where(LabFile.id > after)
+                    .order_by(LabFile.id)
+                    .limit(GC_BATCH)
+                )).all()
+            if not rows:
+                return
+            report.missing += len(await asyncio.to_thread(_missing, [path for _, path in rows]))
+            after = rows[-1][0]
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "reclaimed_bytes_total": self.reclaimed_bytes,
+            "removed_files_total": self.removed_files,
+            "missing_files": self.missing_files,
+            "last_run_seconds": self.last_duration,
+        }
+
+
+storage_gc = StorageGC()
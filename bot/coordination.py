@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import uuid
+
+import asyncpg
+from sqlalchemy import text
+
+from db import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME
+
+log = logging.getLogger(__name__)
+
+# Канал Postgres, через который реплики бота сообщают друг другу об изменениях
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "bot_events")
+# Ключ advisory lock лидера: фоновые задачи в одном экземпляре работают только у него
+LEADER_LOCK_ID = 7_321_002
+# Как часто не-лидер пробует стать лидером и проверяется соединение, секунд
+LEADER_RETRY = float(os.getenv("LEADER_RETRY", "10"))
+# Уникальный id процесса: свои же события при получении пропускаются
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+
+class Coordinator:
+    """Согласование нескольких реплик бота через Postgres.
+
+    События: publish() делает pg_notify в транзакции изменения, поэтому
+    другие реплики узнают о нём только после commit (и не узнают при
+    rollback). Каждая реплика слушает канал на отдельном соединении и
+    вызывает обработчики темы; свои события пропускаются — локально
+    изменения уже применены.
+
+    Лидерство: session-level advisory lock на том же соединении. Пока
+    соединение живо, лидер один; упала реплика — Postgres сам снимает
+    блокировку, и лидером становится другая. Задачи, которые должны
+    работать в одном экземпляре (напоминания, рассылки), регистрируются
+    через leader_job.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._resync = []
+        self._leader_jobs = []
+        self._conn = None
+        self._query_lock = asyncio.Lock()
+        self._task = None
+        self._lost = asyncio.Event()
+        self.is_leader = False
+        self.received = 0
+        self.reconnects = 0
+
+    # --- Регистрация ---
+    def subscribe(self, topic, handler):
+        """handler(data) вызывается на событие темы от другой реплики"""
+        self._subscribers.setdefault(topic, []).append(handler)
+
+    def on_resync(self, handler):
+        """handler() после (пере)подключения: пропущенные события неизвестны — сбросить всё"""
+        self._resync.append(handler)
+
+    def leader_job(self, start, stop):
+        """start() — реплика стала лидером, stop() — перестала (потеряно соединение)"""
+        self._leader_jobs.append((start, stop))
+
+    # --- Публикация ---
+    @staticmethod
+    async def publish(session, topic, **data):
+        """pg_notify в текущей транзакции session — уходит вместе с commit"""
+        payload = json.dumps({"origin": INSTANCE_ID, "topic": topic, "data": data})
+        await session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": EVENTS_CHANNEL, "payload": payload}
+        )
+
+    # --- Блокировки на соединении координации ---
+    async def try_lock(self, *key):
+        """pg_try_advisory_lock; держится до unlock или разрыва соединения"""
+        return bool(await self._query(f"SELECT pg_try_advisory_lock({_key_args(key)})", *key))
+
+    async def unlock(self, *key):
+        await self._query(f"SELECT pg_advisory_unlock({_key_args(key)})", *key)
+
+    async def _query(self, sql, *args):
+        conn = self._conn
+        if conn is None or conn.is_closed():
+            return None
+        # Одно соединение asyncpg выполняет запросы по одному
+        async with self._query_lock:
+            try:
+                return await conn.fetchval(sql, *args)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                # Соединению больше не доверяем: вместе с ним могли пропасть и блокировки
+                log.warning("Запрос координации не выполнен: %s", e)
+                self._lost.set()
+                return None
+
+    # --- Жизненный цикл ---
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._demote()
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+
+    async def _run(self):
+        attempt = 0
+        while True:
+            try:
+                await self._connect()
+                attempt = 0
+                await self._maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Соединение координации потеряно: %s", e)
+            await self._demote()
+            if self._conn is not None and not self._conn.is_closed():
+                self._conn.terminate()
+            self._conn = None
+            self.reconnects += 1
+            delay = random.uniform(0, min(LEADER_RETRY, 0.5 * 2 ** attempt))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _connect(self):
+        self._lost = asyncio.Event()
+        self._conn = await asyncpg.connect(
+            user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, database=DB_NAME,
+            command_timeout=LEADER_RETRY
+        )
+        self._conn.add_termination_listener(lambda conn: self._lost.set())
+        await self._conn.add_listener(EVENTS_CHANNEL, self._on_notify)
+        log.info("Координация реплик: слушаем %s (экземпляр %s)", EVENTS_CHANNEL, INSTANCE_ID)
+        # Пока соединения не было, события могли потеряться
+        for handler in self._resync:
+            _call(handler)
+
+    async def _maintain(self):
+        while not self._lost.is_set():
+            if not self.is_leader:
+                if await self.try_lock(LEADER_LOCK_ID):
+                    await self._promote()
+            else:
+                # Проверка соединения: блокировка жива, пока живо оно
+                await self._query("SELECT 1")
+            try:
+                await asyncio.wait_for(self._lost.wait(), LEADER_RETRY)
+            except asyncio.TimeoutError:
+                pass
+        raise ConnectionError("соединение закрыто сервером")
+
+    async def _promote(self):
+        self.is_leader = True
+        log.info("Экземпляр %s стал лидером: фоновые задачи работают здесь", INSTANCE_ID)
+        for start, _ in self._leader_jobs:
+            await _call_async(start)
+
+    async def _demote(self):
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        log.info("Экземпляр %s больше не лидер", INSTANCE_ID)
+        for _, stop in self._leader_jobs:
+            await _call_async(stop)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if event.get("origin") == INSTANCE_ID:
+            return
+        self.received += 1
+        for handler in self._subscribers.get(event.get("topic"), ()):
+            _call(handler, event.get("data") or {})
+
+    def stats(self):
+        return {
+            "leader": int(self.is_leader),
+            "connected": int(self._conn is not None and not self._conn.is_closed()),
+            "events_received": self.received,
+            "reconnects": self.reconnects,
+        }
+
+
+def _key_args(key):
+    # Один bigint или пара int: pg_try_advisory_lock($1) / ($1, $2)
+    return ", ".join(f"${i + 1}" for i in range(len(key)))
+
+
+def _call(handler, *args):
+    """Вызов обработчика события; корутина запускается фоновой задачей"""
+    try:
+        result = handler(*args)
+        if asyncio.iscoroutine(result):
+            asyncio.create_task(result)
+    except Exception as e:
+        log.exception("Ошибка в обработчике события координации: %s", e)
+
+
+async def _call_async(handler):
+    try:
+        result = handler()
+        if asyncio.iscoroutine(result):
+            await result
+    except Exception as e:
+        log.exception("Ошибка в задаче лидера: %s", e)
+
+
+coordinator = Coordinator()
@@ -1,8 +1,17 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import asyncio
+import logging
 import os
+import random
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
 from dotenv import load_dotenv
 
+log = logging.getLogger(__name__)
+
 load_dotenv()
 
 DB_USER = os.getenv("DB_USER", "bot_user")
@@ -11,10 +20,48 @@ DB_HOST = os.getenv("DB_HOST", "db")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "bot_db")
 
-DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+# Асинхронный движок — через него ходят все хендлеры бота,
+# чтобы медленный запрос не блокировал event loop
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+)
+# expire_on_commit=False: объекты остаются доступны после commit без повторной загрузки
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 # Объявляем Base только здесь
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+
+# --- Ожидание готовности БД при старте ---
+DB_WAIT_TIMEOUT = float(os.getenv("DB_WAIT_TIMEOUT", "60"))
+
+
+async def wait_for_database(timeout=DB_WAIT_TIMEOUT, base_delay=0.1, max_delay=5.0):
+    """Ждёт, пока БД начнёт принимать соединения.
+
+    Проверка — SELECT 1. Паузы растут экспоненциально со случайным
+    разбросом (full jitter), чтобы перезапущенные контейнеры не ломились
+    в БД одновременно. Если БД уже поднята, ожидания нет совсем.
+    """
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        try:
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return attempt + 1
+        except (OSError, asyncio.TimeoutError, DBAPIError) as e:
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if time.monotonic() + delay > deadline:
+                raise RuntimeError(f"БД недоступна дольше {timeout:.0f} с: {e}") from e
+            attempt += 1
+            log.info("БД недоступна (%s), повтор через %.2f с", e.__class__.__name__, delay)
+            await asyncio.sleep(delay)
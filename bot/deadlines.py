@@ -0,0 +1,64 @@
+import os
+import re
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Часовой пояс, в котором админы вводят дедлайны
+BOT_TIMEZONE = ZoneInfo(os.getenv("BOT_TIMEZONE", "Europe/Moscow"))
+
+# Строка целиком — дата, перед ней можно «до», после — точку:
+# иначе из «лаба 3.2, сдать 20.12» взялось бы 3 февраля
+_PREFIX = r"\s*(?:до\s+)?"
+_SUFFIX = r"\.?\s*"
+_TIME = r"(?:[ T]+(\d{1,2})[:.](\d{2}))?"
+# 15.10, 15.10.2024, 15/10/24 23:59, «до 15.10.2024 18:00»; год — 2 или 4 цифры
+_DMY_RE = re.compile(_PREFIX + r"(\d{1,2})[./](\d{1,2})(?:[./](\d{4}|\d{2}))?" + _TIME + _SUFFIX, re.IGNORECASE)
+# 2024-10-15, 2024-10-15 23:59, 2024-10-15T23:59
+_ISO_RE = re.compile(_PREFIX + r"(\d{4})-(\d{1,2})-(\d{1,2})" + _TIME + _SUFFIX, re.IGNORECASE)
+
+
+def parse_deadline(text, now=None):
+    """Дата дедлайна из введённой строки; None, если это не дата.
+
+    Без времени дедлайн — конец дня (23:59). Без года — ближайшая такая
+    дата: «15.01», введённое в декабре, — это январь следующего года.
+    """
+    if not text:
+        return None
+    now = now or datetime.now(BOT_TIMEZONE)
+
+    match = _ISO_RE.fullmatch(text)
+    if match:
+        year, month, day, hour, minute = match.groups()
+    else:
+        match = _DMY_RE.fullmatch(text)
+        if not match:
+            return None
+        day, month, year, hour, minute = match.groups()
+        if year is not None and len(year) == 2:
+            year = 2000 + int(year)
+
+    if hour is None:
+        hour, minute = 23, 59
+    if year is not None:
+        return _make(year, month, day, hour, minute)
+    # Дата в этом году уже прошла — следующий год (29.02 — ближайший високосный)
+    for year in range(now.year, now.year + 5):
+        deadline = _make(year, month, day, hour, minute)
+        if deadline is not None and deadline >= now:
+            return deadline
+    return None
+
+
+def _make(year, month, day, hour, minute):
+    try:
+        return datetime(int(year), int(month), int(day), int(hour), int(minute), tzinfo=BOT_TIMEZONE)
+    except ValueError:
+        return None
+
+
+def format_deadline(deadline, deadline_text=None):
+    """Дедлайн для показа; для старых нераспознанных значений — исходный текст"""
+    if deadline:
+        return deadline.astimezone(BOT_TIMEZONE).strftime("%d.%m.%Y %H:%M")
+    return deadline_text
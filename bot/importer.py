@@ -0,0 +1,323 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+
+from catalog import MESSAGE_LIMIT
+from coordination import coordinator
+from db import AsyncSessionLocal
+from deadlines import parse_deadline
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Предел размера файла и числа строк одного импорта
+IMPORT_MAX_SIZE = int(os.getenv("IMPORT_MAX_MB", "5")) * MB
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "20000"))
+# Сколько ошибок и строк каждого раздела отчёта показываем
+REPORT_ERRORS = 15
+REPORT_ITEMS = 10
+
+IMPORT_EXTENSIONS = (".csv", ".json", ".jsonl", ".ndjson")
+
+# Заголовки колонок (CSV) и ключи (JSON), по-английски или по-русски
+COLUMN_ALIASES = {
+    "subject": "subject", "предмет": "subject",
+    "title": "title", "название": "title", "лабораторная": "title",
+    "desc": "desc", "description": "desc", "описание": "desc",
+    "deadline": "deadline", "дедлайн": "deadline", "срок": "deadline",
+}
+REQUIRED_COLUMNS = ("subject", "title")
+# «Дедлайна нет» — как в диалоге добавления лабораторной
+NO_DEADLINE = ("", "-", "нет")
+
+
+class CatalogImportError(Exception):
+    """Файл нельзя прочитать целиком: формат, размер, нет обязательных колонок"""
+
+
+# --- Чтение и проверка файла (в отдельном потоке) ---
+@dataclass
+class ParsedFile:
+    rows: list = field(default_factory=list)  # (строка, предмет, название, описание, дедлайн)
+    columns: set = field(default_factory=set)
+    errors: list = field(default_factory=list)  # (строка, текст ошибки)
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        # Excel с русской локалью сохраняет CSV через «;»
+        sample = file.read(4096)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(file, dialect=dialect)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def _read_jsonl(path):
+    with open(path, encoding="utf-8-sig") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, e
+
+
+def _read_json(path):
+    """Массив строк [{"subject", "title", ...}] или {"subjects": [{"name", "labs": [...]}]}"""
+    with open(path, encoding="utf-8-sig") as file:
+        try:
+            document = json.load(file)
+        except ValueError as e:
+            raise CatalogImportError(f"некорректный JSON: {e}") from e
+
+    if isinstance(document, dict) and isinstance(document.get("subjects"), list):
+        number = 0
+        for subject in document["subjects"]:
+            labs = subject.get("labs") if isinstance(subject, dict) else None
+            for lab in labs if isinstance(labs, list) else [None]:
+                number += 1
+                yield number, {**lab, "subject": subject.get("name")} if isinstance(lab, dict) else lab
+    elif isinstance(document, list):
+        yield from enumerate(document, 1)
+    else:
+        raise CatalogImportError("ожидается массив строк или объект {\"subjects\": [...]}")
+
+
+def _records(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return _read_csv(path)
+    if extension in (".jsonl", ".ndjson"):
+        return _read_jsonl(path)
+    return _read_json(path)
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def parse_file(path):
+    """Читает файл построчно и проверяет каждую строку; в памяти — только проверенные строки"""
+    parsed = ParsedFile()
+    seen = {}
+    try:
+        for number, record in _records(path):
+            if not isinstance(record, dict):
+                problem = record if isinstance(record, ValueError) else "ожидается объект с полями"
+                parsed.errors.append((number, str(problem)))
+                continue
+            row = {}
+            for key, value in record.items():
+                column = COLUMN_ALIASES.get(_cell(key).lower())
+                if column:
+                    row[column] = _cell(value)
+                    parsed.columns.add(column)
+            subject, title = row.get("subject"), row.get("title")
+            if not subject or not title:
+                parsed.errors.append((number, "не указаны предмет или название"))
+                continue
+            deadline = None
+            if row.get("deadline", "").lower() not in NO_DEADLINE:
+                deadline = parse_deadline(row["deadline"])
+                if deadline is None:
+                    parsed.errors.append((number, f"не удалось распознать дедлайн «{row['deadline']}»"))
+                    continue
+            first = seen.setdefault((subject, title), number)
+            if first != number:
+                parsed.errors.append((number, f"повтор строки {first}: {subject} — {title}"))
+                continue
+
+            parsed.rows.append((number, subject, title, row.get("desc") or None, deadline))
+            if len(parsed.rows) > IMPORT_MAX_ROWS:
+                raise CatalogImportError(f"больше {IMPORT_MAX_ROWS} строк")
+    except UnicodeDecodeError as e:
+        raise CatalogImportError("файл не в кодировке UTF-8") from e
+    except csv.Error as e:
+        raise CatalogImportError(f"некорректный CSV: {e}") from e
+
+    if not set(REQUIRED_COLUMNS) <= parsed.columns:
+        raise CatalogImportError("нужны колонки subject (предмет) и title (название)")
+    if not parsed.rows and not parsed.errors:
+        raise CatalogImportError("в файле нет строк")
+    return parsed
+
+
+# --- Загрузка в БД ---
+# Строки файла сначала копируются (COPY) во временную таблицу, дальше всё
+# делают несколько запросов над множествами строк — не по запросу на строку.
+CREATE_STAGING_SQL = text("""
+    CREATE TEMP TABLE import_labs (
+        line integer,
+        subject text,
+        title text,
+        "desc" text,
+        deadline timestamptz,
+        subject_id integer
+    ) ON COMMIT DROP
+""")
+
+INSERT_SUBJECTS_SQL = text("""
+    INSERT INTO subjects (name)
+    SELECT DISTINCT subject FROM import_labs ORDER BY subject
+    ON CONFLICT (name) DO NOTHING
+    RETURNING name
+""")
+
+MATCH_SUBJECTS_SQL = text("""
+    UPDATE import_labs i SET subject_id = s.id
+    FROM subjects s
+    WHERE s.name = i.subject
+""")
+
+# Лабораторная совпадает по (предмет, название). Меняются только колонки,
+# которые есть в файле; новый дедлайн сбрасывает этап напоминаний.
+UPDATE_LABS_SQL = text("""
+    WITH changes AS (
+        SELECT l.id, i.line, i.subject, i.title, i."desc", i.deadline,
+               (:has_desc AND l."desc" IS DISTINCT FROM i."desc") AS desc_changed,
+               (:has_deadline AND (l.deadline IS DISTINCT FROM i.deadline
+                                   OR l.deadline_text IS NOT NULL)) AS deadline_changed
+        FROM import_labs i
+        JOIN labs l ON l.subject_id = i.subject_id AND l.title = i.title
+    ), updated AS (
+        UPDATE labs l SET
+            "desc" = CASE WHEN c.desc_changed THEN c."desc" ELSE l."desc" END,
+            deadline = CASE WHEN c.deadline_changed THEN c.deadline ELSE l.deadline END,
+            deadline_text = CASE WHEN c.deadline_changed THEN NULL ELSE l.deadline_text END,
+            reminder_stage = CASE WHEN c.deadline_changed THEN 0 ELSE l.reminder_stage END
+        FROM changes c
+        WHERE l.id = c.id AND (c.desc_changed OR c.deadline_changed)
+    )
+    SELECT subject, title, desc_changed, deadline_changed FROM changes ORDER BY line
+""")
+
+INSERT_LABS_SQL = text("""
+    INSERT INTO labs (subject_id, title, "desc", deadline, reminder_stage)
+    SELECT i.subject_id, i.title, i."desc", i.deadline, 0
+    FROM import_labs i
+    WHERE NOT EXISTS (
+        SELECT 1 FROM labs l WHERE l.subject_id = i.subject_id AND l.title = i.title
+    )
+    ORDER BY i.line
+    RETURNING subject_id, title
+""")
+
+
+@dataclass
+class ImportReport:
+    rows: int
+    dry_run: bool
+    new_subjects: list = field(default_factory=list)
+    new_labs: list = field(default_factory=list)  # (предмет, название)
+    changed_labs: list = field(default_factory=list)  # (предмет, название, что изменилось)
+    unchanged: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def has_changes(self):
+        return bool(self.new_subjects or self.new_labs or self.changed_labs)
+
+    def text(self):
+        if self.dry_run:
+            lines = [f"📥 Проверка файла: строк — {self.rows}. Пока ничего не сохранено.\n"]
+        else:
+            lines = [f"✅ Импорт выполнен за {self.elapsed:.1f} с, строк — {self.rows}.\n"]
+        lines.append(f"➕ Новых предметов: {len(self.new_subjects)}")
+        lines.append(f"➕ Новых лабораторных: {len(self.new_labs)}")
+        lines.append(f"✏️ Изменённых лабораторных: {len(self.changed_labs)}")
+        lines.append(f"▫️ Без изменений: {self.unchanged}")
+
+        _section(lines, "Новые предметы:", self.new_subjects)
+        _section(lines, "Новые лабораторные:", [f"{subject} — {title}" for subject, title in self.new_labs])
+        _section(lines, "Изменения:", [
+            f"{subject} — {title}: {', '.join(fields)}" for subject, title, fields in self.changed_labs
+        ])
+        return "\n".join(lines)[:MESSAGE_LIMIT]
+
+
+def _section(lines, header, items):
+    if not items:
+        return
+    lines.append(f"\n{header}")
+    lines.extend(f"• {item}" for item in items[:REPORT_ITEMS])
+    if len(items) > REPORT_ITEMS:
+        lines.append(f"…и ещё {len(items) - REPORT_ITEMS}")
+
+
+def errors_text(errors):
+    lines = [f"❌ В файле ошибки ({len(errors)}), ничего не сохранено:"]
+    lines.extend(f"строка {number}: {problem}" for number, problem in errors[:REPORT_ERRORS])
+    if len(errors) > REPORT_ERRORS:
+        lines.append(f"…и ещё {len(errors) - REPORT_ERRORS}")
+    lines.append("\nИсправьте файл и отправьте его снова или /cancel.")
+    return "\n".join(lines)[:MESSAGE_LIMIT]
+
+
+async def import_catalog(parsed, dry_run=True):
+    """Загружает проверенные строки одной транзакцией.
+
+    Пробный прогон (dry_run) выполняет те же запросы и откатывает
+    транзакцию — отчёт показывает ровно то, что сделает настоящий импорт.
+    """
+    started = time.perf_counter()
+    report = ImportReport(rows=len(parsed.rows), dry_run=dry_run)
+    params = {"has_desc": "desc" in parsed.columns, "has_deadline": "deadline" in parsed.columns}
+
+    async with AsyncSessionLocal() as session:
+        await session.execute(CREATE_STAGING_SQL)
+        connection = await session.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            "import_labs", records=parsed.rows, columns=["line", "subject", "title", "desc", "deadline"]
+        )
+        # Статистика для планировщика: без неё временная таблица считается пустой
+        await session.execute(text("ANALYZE import_labs"))
+
+        report.new_subjects = list((await session.scalars(INSERT_SUBJECTS_SQL)).all())
+        await session.execute(MATCH_SUBJECTS_SQL)
+        for subject, title, desc_changed, deadline_changed in (await session.execute(UPDATE_LABS_SQL, params)).all():
+            fields = [name for name, changed in (("описание", desc_changed), ("дедлайн", deadline_changed)) if changed]
+            if fields:
+                report.changed_labs.append((subject, title, fields))
+            else:
+                report.unchanged += 1
+        added = (await session.execute(INSERT_LABS_SQL)).all()
+        names = dict((await session.execute(
+            text("SELECT DISTINCT subject_id, subject FROM import_labs")
+        )).all())
+        report.new_labs = [(names[subject_id], title) for subject_id, title in added]
+
+        if dry_run or not report.has_changes:
+            await session.rollback()
+        else:
+            await coordinator.publish(session, "catalog", deadlines=True)
+            await session.commit()
+
+    report.elapsed = time.perf_counter() - started
+    log.info(
+        "Импорт каталога%s: строк %d, новых предметов %d, лабораторных %d, изменено %d за %.2f с",
+        " (проверка)" if dry_run else "", report.rows, len(report.new_subjects),
+        len(report.new_labs), len(report.changed_labs), report.elapsed
+    )
+    return report
+
+
+async def read_import_file(path):
+    """Разбор файла — в потоке, чтобы большой файл не останавливал event loop"""
+    if os.path.getsize(path) > IMPORT_MAX_SIZE:
+        raise CatalogImportError(f"файл больше {IMPORT_MAX_SIZE // MB} МБ")
+    return await asyncio.to_thread(parse_file, path)
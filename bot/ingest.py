@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import os
+import time
+
+from storage import store_telegram_file, touch_blobs, FileTooLarge
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Параллельных скачиваний на весь бот
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+# Лимит getFile в Bot API — 20 МБ
+UPLOAD_MAX_FILE_SIZE = int(os.getenv("UPLOAD_MAX_FILE_MB", "20")) * MB
+UPLOAD_MAX_LAB_SIZE = int(os.getenv("UPLOAD_MAX_LAB_MB", "200")) * MB
+# Сколько ждать остальные файлы альбома после последнего пришедшего
+ALBUM_SETTLE = float(os.getenv("ALBUM_SETTLE", "1.0"))
+
+SUPPORTED_EXTENSIONS = [
+    '.txt', '.pdf', '.docx', '.xlsx', '.xls', '.zip', '.py', '.pcap', '.tar', '.jpg', '.jpeg', '.png'
+]
+
+
+def media_item(message):
+    """Файл из сообщения в виде словаря для user_data['lab_files'] (без хэша и пути)"""
+    if message.document:
+        document = message.document
+        return {
+            'file_id': document.file_id,
+            'file_unique_id': document.file_unique_id,
+            'file_kind': 'document',
+            'file_name': document.file_name or "file",
+            'file_size': document.file_size,
+            'message_id': message.message_id,
+        }
+    if message.photo:
+        # Для фото берем самое большое изображение
+        photo = message.photo[-1]
+        return {
+            'file_id': photo.file_id,
+            'file_unique_id': photo.file_unique_id,
+            'file_kind': 'photo',
+            'file_name': 'photo.jpg',
+            'file_size': photo.file_size,
+            'message_id': message.message_id,
+        }
+    return None
+
+
+class _Batch:
+    """Один альбом (или одиночный файл) — одно итоговое сообщение"""
+
+    def __init__(self, chat_id, is_album):
+        self.chat_id = chat_id
+        self.is_album = is_album
+        self.tasks = []
+        self.results = []  # (имя файла, ошибка или None)
+        self.last_added = time.monotonic()
+
+
+class Ingestor:
+    """Фоновое скачивание файлов лабораторной.
+
+    Хендлер только ставит файл в очередь и сразу возвращается, поэтому файлы
+    альбома качаются параллельно (не больше UPLOAD_WORKERS на весь бот).
+    Готовые файлы попадают в user_data['lab_files'] в порядке сообщений;
+    об альбоме админ получает одно итоговое сообщение.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS):
+        self._slots = asyncio.Semaphore(workers)
+        self._batches = {}
+        # user_id -> задачи скачивания и отчётов
+        self._pending = {}
+        # user_id -> заявленный размер файлов, которые ещё качаются
+        self._reserved = {}
+
+    def submit(self, context, message, item):
+        user_id = message.from_user.id
+        group_key = (user_id, message.media_group_id or f"single:{message.message_id}")
+        batch = self._batches.get(group_key)
+        if batch is None:
+            batch = self._batches[group_key] = _Batch(message.chat_id, bool(message.media_group_id))
+            self._track(user_id, self._report(context.bot, group_key, batch))
+        batch.last_added = time.monotonic()
+
+        error = self._check(context.user_data, user_id, item)
+        if error:
+            batch.results.append((item['file_name'], error))
+            return
+        self._reserved[user_id] = self._reserved.get(user_id, 0) + (item['file_size'] or 0)
+        batch.tasks.append(self._track(user_id, self._ingest(context, user_id, batch, item)))
+
+    def pending(self, user_id):
+        return len(self._pending.get(user_id, ()))
+
+    async def wait(self, user_id):
+        """Дожидается всех скачиваний и отчётов пользователя (для /done)"""
+        while self._pending.get(user_id):
+            await asyncio.gather(*self._pending[user_id], return_exceptions=True)
+
+    async def refresh(self, bot, lab_files):
+        """Подтверждает файлы перед сохранением лабораторной.
+
+        Пока лабораторная не сохранена, ссылок на файлы нет, и сборщик мусора
+        удаляет их через GC_UPLOAD_TTL после загрузки, а диалог переживает
+        рестарт и может закончиться позже. Сохранившимся файлам обновляется
+        used_at (один запрос), удалённые скачиваются из Telegram заново.
+        """
+        stored = await touch_blobs([item['content_hash'] for item in lab_files if item.get('content_hash')])
+        refreshed = []
+        for item in lab_files:
+            if item.get('content_hash') in stored:
+                refreshed.append(item)
+                continue
+            log.info("Файл %s удалён до сохранения лабораторной, скачиваю заново", item['file_name'])
+            async with self._slots:
+                content_hash, file_path, file_size = await store_telegram_file(
+                    bot, item['file_id'], item.get('file_unique_id'), max_size=UPLOAD_MAX_FILE_SIZE
+                )
+            refreshed.append({**item, 'file_size': file_size, 'content_hash': content_hash, 'file_path': file_path})
+        return refreshed
+
+    def cancel(self, user_id):
+        """Отменяет незаконченные скачивания (для /cancel)"""
+        for task in self._pending.pop(user_id, set()):
+            task.cancel()
+        self._reserved.pop(user_id, None)
+        for key in [key for key in self._batches if key[0] == user_id]:
+            del self._batches[key]
+
+    # --- Внутреннее ---
+    def _track(self, user_id, coroutine):
+        task = asyncio.create_task(coroutine)
+        tasks = self._pending.setdefault(user_id, set())
+        tasks.add(task)
+
+        def done(t):
+            tasks.discard(t)
+            if not tasks and self._pending.get(user_id) is tasks:
+                del self._pending[user_id]
+        task.add_done_callback(done)
+        return task
+
+    def _release(self, user_id, size):
+        # После cancel() резерва уже нет — отменённая загрузка не уводит его в минус
+        if user_id not in self._reserved:
+            return
+        self._reserved[user_id] -= size
+        if self._reserved[user_id] <= 0:
+            del self._reserved[user_id]
+
+    def _check(self, user_data, user_id, item):
+        extension = os.path.splitext(item['file_name'])[1].lower()
+        if item['file_kind'] == 'document' and extension not in SUPPORTED_EXTENSIONS:
+            return f"формат {extension or 'без расширения'} не поддерживается"
+        if item['file_size'] and item['file_size'] > UPLOAD_MAX_FILE_SIZE:
+            return f"больше {UPLOAD_MAX_FILE_SIZE // MB} МБ"
+        total = sum(f.get('file_size') or 0 for f in user_data.get('lab_files', []))
+        total += self._reserved.get(user_id, 0) + (item['file_size'] or 0)
+        if total > UPLOAD_MAX_LAB_SIZE:
+            return f"превышен лимит {UPLOAD_MAX_LAB_SIZE // MB} МБ на лабораторную"
+        return None
+
+    async def _ingest(self, context, user_id, batch, item):
+        error = None
+        try:
+            async with self._slots:
+                content_hash, file_path, file_size = await store_telegram_file(
+                    context.bot, item['file_id'], item['file_unique_id'], max_size=UPLOAD_MAX_FILE_SIZE
+                )
+        except FileTooLarge:
+            error = f"больше {UPLOAD_MAX_FILE_SIZE // MB} МБ"
+        except Exception as e:
+            log.exception("Ошибка при скачивании файла %s: %s", item['file_name'], e)
+            error = "ошибка загрузки"
+        finally:
+            self._release(user_id, item['file_size'] or 0)
+
+        batch.results.append((item['file_name'], error))
+        if error:
+            return
+
+        lab_files = context.user_data.setdefault('lab_files', [])
+        lab_files.append({**item, 'file_size': file_size, 'content_hash': content_hash, 'file_path': file_path})
+        # Файлы сохраняются в порядке сообщений, а не в порядке окончания загрузки
+        lab_files.sort(key=lambda f: f.get('message_id') or 0)
+        # Изменение user_data вне хендлера — просим PTB сохранить его
+        context.application.mark_data_for_update_persistence(user_ids=[user_id])
+        log.info("Файл сохранен: %s (%s байт)", file_path, file_size)
+
+    async def _report(self, bot, group_key, batch):
+        # Ждём, пока альбом перестанет пополняться и все файлы докачаются
+        settle = ALBUM_SETTLE if batch.is_album else 0
+        while True:
+            await asyncio.sleep(max(0.0, batch.last_added + settle - time.monotonic()))
+            if batch.tasks:
+                await asyncio.gather(*batch.tasks, return_exceptions=True)
+            if time.monotonic() >= batch.last_added + settle and all(t.done() for t in batch.tasks):
+                break
+        if self._batches.get(group_key) is batch:
+            del self._batches[group_key]
+        await bot.send_message(batch.chat_id, summary_text(batch))
+
+
+def summary_text(batch):
+    ok = [name for name, error in batch.results if error is None]
+    failed = [(name, error) for name, error in batch.results if error]
+    if not batch.is_album and len(batch.results) == 1:
+        name, error = batch.results[0]
+        if error is None:
+            return f"✅ Файл '{name}' загружен на сервер!"
+        if error.startswith("формат"):
+            return f"❌ Файл '{name}': {error}.\n📋 Поддерживаемые форматы: {', '.join(SUPPORTED_EXTENSIONS)}"
+        return f"❌ Файл '{name}': {error}"
+
+    lines = [f"📎 Альбом: загружено {len(ok)} из {len(batch.results)}"]
+    lines += [f"✅ {name}" for name in ok]
+    lines += [f"❌ {name} — {error}" for name, error in failed]
+    if any(error.startswith("формат") for _, error in failed):
+        lines.append(f"📋 Поддерживаемые форматы: {', '.join(SUPPORTED_EXTENSIONS)}")
+    return "\n".join(lines)
+
+
+ingestor = Ingestor()
@@ -0,0 +1,186 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Уровень корневого логгера и уровни отдельных логгеров: "httpx=WARNING,broadcast=DEBUG"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING,apscheduler=WARNING")
+# Доля записей ниже ERROR, которые пишутся для шумных логгеров: "broadcast.send=0.01"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "broadcast.send=0.05")
+# json — для сбора логов, text — для чтения глазами
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Записей в очереди к потоку вывода; сверх этого записи отбрасываются
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Поля апдейта, которые попадают в каждую запись (update_id, user_id, handler...)
+_context = contextvars.ContextVar("log_context", default={})
+
+# Стандартные атрибуты LogRecord — всё остальное пришло через extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "context"}
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """Поля добавляются ко всем записям внутри блока, в том числе в задачах, созданных в нём"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def update_fields(update):
+    """Поля контекста для апдейта PTB"""
+    fields = {}
+    if getattr(update, "update_id", None) is not None:
+        fields["update_id"] = update.update_id
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        fields["user_id"] = user.id
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        fields["chat_id"] = chat.id
+    return fields
+
+
+def _parse_pairs(value, convert):
+    pairs = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, raw = item.partition("=")
+        try:
+            pairs[name.strip()] = convert(raw.strip())
+        except ValueError:
+            print(f"Некорректная настройка логов {item!r}", file=sys.stderr)
+    return pairs
+
+
+# --- Обработчик на стороне event loop ---
+class AsyncQueueHandler(QueueHandler):
+    """Кладёт запись в ограниченную очередь и сразу возвращается.
+
+    Вывод делает QueueListener в отдельном потоке, поэтому запись лога не
+    ждёт stdout. Переполненная очередь не блокирует: запись отбрасывается
+    и учитывается в dropped. Выборка (sampling) для шумных логгеров тоже
+    делается здесь — до постановки в очередь.
+    """
+
+    def __init__(self, log_queue, sampling=None):
+        super().__init__(log_queue)
+        self.sampling = sampling or {}
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def _sample_rate(self, name):
+        # Настройка логгера действует и на дочерние: broadcast -> broadcast.send
+        while name:
+            rate = self.sampling.get(name)
+            if rate is not None:
+                return rate
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def emit(self, record):
+        if record.levelno < logging.ERROR:
+            rate = self._sample_rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def enqueue(self, record):
+        self.queue.put_nowait(record)
+
+    def prepare(self, record):
+        # Форматирование — в потоке вывода; здесь только фиксируем текст
+        # (аргументы могут измениться) и контекст апдейта (contextvar)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.context = _context.get()
+        return record
+
+
+# --- Форматирование (в потоке вывода) ---
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", None) or {})
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            text += " " + " ".join(f"{key}={value}" for key, value in context.items())
+        return text
+
+
+# --- Настройка ---
+class LogPipeline:
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+
+    def setup(self):
+        """Направляет весь logging через очередь; вызывается один раз при старте"""
+        if self.listener is not None:
+            return
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        self.handler = AsyncQueueHandler(log_queue, _parse_pairs(LOG_SAMPLING, float))
+        self.listener = QueueListener(log_queue, output, respect_handler_level=False)
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(self.handler)
+        root.setLevel(LOG_LEVEL.upper())
+        for name, level in _parse_pairs(LOG_LEVELS, str.upper).items():
+            logging.getLogger(name).setLevel(level)
+        self.listener.start()
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток вывода"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def stats(self):
+        if self.handler is None:
+            return {}
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped_total": self.handler.dropped,
+            "sampled_out_total": self.handler.sampled_out,
+        }
+
+
+log_pipeline = LogPipeline()
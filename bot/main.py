@@ -1,77 +1,74 @@
+import functools
+import html
+import logging
 import os
-import uuid
 import time
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup
+import uuid
+from datetime import datetime
+from telegram import (
+    Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup,
+    InlineQueryResultArticle, InputTextMessageContent
+)
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ConversationHandler, filters, ContextTypes
+    ConversationHandler, InlineQueryHandler, filters, ContextTypes
 )
 from dotenv import load_dotenv
 
-from db import SessionLocal, engine, Base
-from models import User, Subject, Lab, LabFile
+from sqlalchemy import delete, update as sql_update
+from sqlalchemy.orm import joinedload
+
+from db import AsyncSessionLocal, async_engine, wait_for_database
+from models import Subject, Lab, LabFile
+from catalog import (
+    catalog, page_list, page_cursor, digest_pages, digest_keyboard
+)
+from bot_api import api_request
+from broadcast import broadcaster
+from coordination import coordinator
+from migrations import apply_migrations
+from storage import UPLOAD_DIR, FileTooLarge, download_to_staging
+from ingest import ingestor, media_item
+from cleanup import storage_gc
+from bundles import bundles, BundleTooLarge, BUNDLE_MAX_SIZE
+from importer import (
+    import_catalog, read_import_file, errors_text, CatalogImportError, IMPORT_EXTENSIONS, IMPORT_MAX_SIZE
+)
+from search import lab_search, normalize_query, INLINE_PAGE_SIZE
+from deadlines import parse_deadline, format_deadline
+from reminders import reminders
+from updates import PerChatUpdateProcessor
+from users import roles
+from subscriptions import subscriptions
+from views import views
+from persistence import PostgresPersistence
+from ratelimit import api_limiter
+from router import router, choice
+from logs import log_pipeline, update_fields
+from metrics import (
+    registry, metrics_server, instrument_application, instrument_engine, InstrumentedRequest
+)
 
 # --- Настройка ---
 load_dotenv()
+log = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 
-# Директория для файлов
-UPLOAD_DIR = "/app/lab_files"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-# --- Принудительное создание таблиц с проверкой ---
-def initialize_database():
-    print("🔄 Инициализация базы данных...")
-    
-    max_retries = 10  # Увеличим количество попыток
-    for attempt in range(max_retries):
-        try:
-            print(f"⏳ Попытка {attempt + 1}/{max_retries} создания таблиц...")
-            
-            # Импортируем все модели чтобы они зарегистрировались в Base
-            from models import User, Subject, Lab, LabFile
-            
-            # Создаем все таблицы
-            Base.metadata.create_all(bind=engine)
-            
-            # Проверяем созданные таблицы
-            from sqlalchemy import inspect
-            inspector = inspect(engine)
-            tables = inspector.get_table_names()
-            
-            expected_tables = ['users', 'subjects', 'labs', 'lab_files']
-            missing_tables = [table for table in expected_tables if table not in tables]
-            
-            if missing_tables:
-                print(f"⚠️  Отсутствуют таблицы: {missing_tables}")
-                if attempt < max_retries - 1:
-                    print("⏳ Ждем 5 секунд перед повторной попыткой...")
-                    time.sleep(5)
-                    continue
-                else:
-                    print("❌ Не удалось создать все таблицы")
-                    return False
-            else:
-                print(f"✅ Все таблицы успешно созданы: {tables}")
-                return True
-            
-        except Exception as e:
-            print(f"❌ Ошибка при создании таблиц (попытка {attempt + 1}): {e}")
-            if attempt < max_retries - 1:
-                print("⏳ Ждем 5 секунд перед повторной попыткой...")
-                time.sleep(5)
-            else:
-                print("❌ Не удалось создать таблицы после всех попыток")
-                return False
-
-# Инициализируем базу данных
-print("🚀 Запуск инициализации БД...")
-if not initialize_database():
-    print("❌ Критическая ошибка: не удалось создать таблицы в БД")
-    exit(1)
-
-print("✅ База данных готова к работе!")
+# Получение апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # внешний адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# Telegram присылает его в заголовке — чужие запросы на webhook отбрасываются.
+# Общий для всех реплик: setWebhook с другим секретом отключил бы остальные
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько апдейтов обрабатывается одновременно (внутри одного чата — по очереди)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "16"))
+# Сколько секунд Telegram может отдавать закэшированный ответ на inline-запрос
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
 
 # --- Состояния для диалогов ---
 ASK_SUBJECT = 1
@@ -83,6 +80,14 @@ ASK_LAB_DEADLINE = 6
 ASK_LAB_FILES = 7
 ASK_EDIT_LAB = 8
 ASK_EDIT_SUBJECT = 9
+ASK_IMPORT_FILE = 10
+ASK_IMPORT_CONFIRM = 11
+
+DEADLINE_PROMPT = (
+    "Введите дедлайн лабораторной в формате ДД.ММ.ГГГГ или ДД.ММ.ГГГГ ЧЧ:ММ.\n"
+    "Если дедлайна нет, отправьте «-»."
+)
+NO_DEADLINE = ("-", "нет")
 
 # --- Главное меню ---
 def get_main_keyboard(is_admin=False):
@@ -95,192 +100,191 @@ def get_main_keyboard(is_admin=False):
     return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
 
 # --- Админ панель ---
+@functools.cache
 def get_admin_keyboard():
     keyboard = [
         [InlineKeyboardButton("Оповестить", callback_data="notify")],
         [InlineKeyboardButton("Добавить предмет", callback_data="add_subject")],
         [InlineKeyboardButton("Добавить лабораторную", callback_data="add_lab")],
         [InlineKeyboardButton("Управление предметами", callback_data="manage_subjects")],
-        [InlineKeyboardButton("Управление лабораторными", callback_data="manage_labs")]
+        [InlineKeyboardButton("Управление лабораторными", callback_data="manage_labs")],
+        [InlineKeyboardButton("Импорт из файла", callback_data="import")]
     ]
     return InlineKeyboardMarkup(keyboard)
 
 # --- Старт ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
     tg_id = update.effective_user.id
-    user = session.query(User).filter_by(tg_id=tg_id).first()
-
-    if not user:
-        user = User(tg_id=tg_id, is_admin=(tg_id == ADMIN_ID))
-        session.add(user)
-        session.commit()
-    else:
-        user.is_admin = (tg_id == ADMIN_ID)
-        session.commit()
+    is_admin = tg_id == ADMIN_ID
+    # INSERT ... ON CONFLICT: регистрация и обновление роли за один запрос
+    await roles.register(tg_id, is_admin)
 
-    keyboard = get_main_keyboard(user.is_admin)
+    # Ссылка из inline-поиска: t.me/<бот>?start=lab_<id>
+    if context.args and context.args[0].startswith("lab_") and context.args[0][4:].isdigit():
+        snapshot = await catalog.get()
+        lab = snapshot.labs_by_id.get(int(context.args[0][4:]))
+        if lab:
+            text, keyboard = cached_lab_card(snapshot, lab)
+            await update.message.reply_text(text, reply_markup=keyboard, parse_mode='HTML')
+            return
+    
+    keyboard = get_main_keyboard(is_admin)
     text = "Добро пожаловать!"
     
-    if user.is_admin:
+    if is_admin:
         text += "\nВы админ, используйте админские кнопки ниже."
         await update.message.reply_text(text, reply_markup=keyboard)
         await update.message.reply_text("Админ панель:", reply_markup=get_admin_keyboard())
     else:
         await update.message.reply_text(text, reply_markup=keyboard)
-    
-    session.close()
 
 # --- Админ панель ---
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
-    tg_id = update.effective_user.id
-    user = session.query(User).filter_by(tg_id=tg_id).first()
-    
-    if user and user.is_admin:
+    if await roles.is_admin(update.effective_user.id):
         await update.message.reply_text("Админ панель:", reply_markup=get_admin_keyboard())
     else:
         await update.message.reply_text("У вас нет доступа к админ панели.")
-    
-    session.close()
 
 # --- Мои предметы ---
 async def my_subjects(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
-    subjects = session.query(Subject).all()
-    if not subjects:
-        await update.message.reply_text("Пока предметов нет.")
-    else:
-        keyboard = [[InlineKeyboardButton(s.name, callback_data=f"subject:{s.id}")] for s in subjects]
-        await update.message.reply_text("Ваши предметы:", reply_markup=InlineKeyboardMarkup(keyboard))
-    session.close()
+    page = await catalog.page("s")
+    await update.message.reply_text(page.text, reply_markup=page.keyboard)
 
 # --- Кнопки Inline для админа и предметов ---
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    data = query.data
+    # Маршруты объявлены декоратором @router.route у каждого хендлера
+    await router.dispatch(update, context)
 
-    if data.startswith("subject:"):
-        await show_subject_details(query, context)
-        
-    elif data.startswith("lab:"):
-        await show_lab_details(query, context)
+# --- Показать детали предмета ---
+async def subject_keyboard(page, tg_id):
+    """Кнопки страницы предмета из кэша плюс кнопки этого пользователя (подписка)"""
+    rows = list(page.keyboard.inline_keyboard)
+    personal = []
+    if await subscriptions.is_subscribed(tg_id, page.scope):
+        personal.append([InlineKeyboardButton("🔕 Отписаться от новостей", callback_data=f"sub:{page.scope}")])
+    else:
+        personal.append([InlineKeyboardButton("🔔 Подписаться на новости", callback_data=f"sub:{page.scope}")])
+    if await roles.is_admin(tg_id):
+        personal.append([InlineKeyboardButton("📢 Оповестить подписчиков", callback_data=f"notify_subject:{page.scope}")])
+    # Перед последней строкой — «Назад к предметам»
+    rows[-1:-1] = personal
+    return InlineKeyboardMarkup(rows)
 
-    elif data.startswith("lab_files:"):
-        await show_lab_files(query, context)
-        
-    elif data.startswith("download_file:"):  # Добавьте этот обработчик
-        await download_lab_file(query, context)
-        
-    elif data.startswith("delete_lab:"):
-        await delete_lab(query, context)
-        
-    elif data.startswith("edit_lab:"):
-        await edit_lab_start(query, context)
-        
-    elif data.startswith("delete_subject:"):
-        await delete_subject(query, context)
-        
-    elif data.startswith("edit_subject:"):
-        await edit_subject_start(query, context)
-        
-    elif data == "back_to_subjects":  # Добавьте эту строку
-        await handle_back_buttons(query, context)
-            
-    elif data == "back_to_admin":     # И эту тоже для consistency
-        await handle_back_buttons(query, context)
-
-    elif data == "add_subject":
-        await add_subject_start(update, context)
-    elif data == "notify":
-        await notify_start(update, context)
-    elif data == "add_lab":
-        await add_lab_start(update, context)
-    elif data == "manage_subjects":
-        await manage_subjects(query, context)
-    elif data == "manage_labs":
-        await manage_labs(query, context)
+@router.route("subject", int)
+async def show_subject_details(query, context, sid):
+    # Первая страница лабораторных предмета, дальше листает show_page
+    page = await catalog.page("l", sid)
+    if page.found:
+        await views.edit(query, page.text, reply_markup=await subject_keyboard(page, query.from_user.id))
 
-# --- Показать детали предмета ---
-async def show_subject_details(query, context):
-    session = SessionLocal()
-    sid = int(query.data.split(":")[1])
-    subject = session.query(Subject).get(sid)
-    
-    if subject:
-        # Создаем кнопки для каждой лабораторной
-        keyboard = []
-        for lab in subject.labs:
-            keyboard.append([InlineKeyboardButton(lab.title, callback_data=f"lab:{lab.id}")])
-        
-        # Добавляем админские кнопки если пользователь админ
-        tg_id = query.from_user.id
-        user = session.query(User).filter_by(tg_id=tg_id).first()
-        
-        # if user and user.is_admin:
-        #     keyboard.append([
-        #         InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_subject:{subject.id}"),
-        #         InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_subject:{subject.id}")
-        #     ])
-        
-        keyboard.append([InlineKeyboardButton("⬅️ Назад к предметам", callback_data="back_to_subjects")])
-        
-        if not subject.labs:
-            await query.edit_message_text(
-                f"📚 {subject.name}\n\nПока нет лабораторных работ.",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        else:
-            await query.edit_message_text(
-                f"📚 {subject.name}\n\nВыберите лабораторную:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-    session.close()
+# --- Листание постраничных списков ---
+@router.route("pg", page_list, page_cursor)
+async def show_page(query, context, list_key, cursor):
+    kind, scope = list_key
+    page = await catalog.page(kind, scope, cursor)
+    if page.found:
+        keyboard = await subject_keyboard(page, query.from_user.id) if kind == "l" else page.keyboard
+        await views.edit(query, page.text, reply_markup=keyboard)
+
+# --- Подписка на предмет ---
+@router.route("sub", int, answer=False)
+async def toggle_subscription(query, context, sid):
+    tg_id = query.from_user.id
+    subscribed = await subscriptions.toggle(tg_id, sid)
+    await query.answer("🔔 Вы подписаны на новости предмета" if subscribed else "🔕 Вы отписались от новостей предмета")
+    page = await catalog.page("l", sid)
+    if page.found:
+        await views.edit(query, page.text, reply_markup=await subject_keyboard(page, tg_id))
 
 # --- Показать детали лабораторной ---
-async def show_lab_details(query, context):
-    session = SessionLocal()
-    lid = int(query.data.split(":")[1])
-    lab = session.query(Lab).get(lid)
+def lab_card(lab, subject):
+    """Текст и кнопки карточки лабораторной"""
+    # Формируем сообщение с информацией о лабе
+    text = f"📌 <b>{html.escape(lab.title)}</b>\n\n"
+    text += f"📝 <b>Описание:</b>\n{html.escape(lab.desc or 'Нет описания')}\n\n"
+    text += f"⏳ <b>Дедлайн:</b> {lab.deadline_label or 'не установлен'}\n\n"
+    text += f"📚 <b>Предмет:</b> {html.escape(subject.name)}"
+    
+    # Создаем кнопки
+    keyboard = []
+    
+    # if user and user.is_admin:
+    #     keyboard.extend([
+    #         [InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_lab:{lab.id}")],
+    #         [InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_lab:{lab.id}")]
+    #     ])
+    
+    keyboard.extend([
+        [InlineKeyboardButton("📎 Файлы лабораторной", callback_data=f"lab_files:{lab.id}")],
+        [InlineKeyboardButton("⬅️ Назад к предмету", callback_data=f"subject:{subject.id}")]
+    ])
+    return text, InlineKeyboardMarkup(keyboard)
+
+def cached_lab_card(snapshot, lab):
+    """Карточка строится один раз на версию каталога"""
+    return snapshot.render(("lab", lab.id), lambda snapshot: lab_card(lab, snapshot.subjects_by_id[lab.subject_id]))
+
+@router.route("lab", int)
+async def show_lab_details(query, context, lid):
+    snapshot = await catalog.get()
+    lab = snapshot.labs_by_id.get(lid)
     
     if lab:
-        # Формируем сообщение с информацией о лабе
-        text = f"📌 <b>{lab.title}</b>\n\n"
-        text += f"📝 <b>Описание:</b>\n{lab.desc or 'Нет описания'}\n\n"
-        text += f"⏳ <b>Дедлайн:</b> {lab.deadline or 'не установлен'}\n\n"
-        text += f"📚 <b>Предмет:</b> {lab.subject.name}"
-        
-        # Создаем кнопки
-        keyboard = []
-        
-        # Добавляем админские кнопки если пользователь админ
-        tg_id = query.from_user.id
-        user = session.query(User).filter_by(tg_id=tg_id).first()
-        
-        # if user and user.is_admin:
-        #     keyboard.extend([
-        #         [InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_lab:{lab.id}")],
-        #         [InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_lab:{lab.id}")]
-        #     ])
-        
-        keyboard.extend([
-            [InlineKeyboardButton("📎 Файлы лабораторной", callback_data=f"lab_files:{lab.id}")],
-            [InlineKeyboardButton("⬅️ Назад к предмету", callback_data=f"subject:{lab.subject.id}")]
-        ])
-        
-        await query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='HTML'
-        )
-    session.close()
+        text, keyboard = cached_lab_card(snapshot, lab)
+        await views.edit(query, text, reply_markup=keyboard, parse_mode='HTML')
+
+# --- Поиск ---
+async def find_labs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = " ".join(context.args)
+    if not normalize_query(query):
+        await update.message.reply_text("🔎 Использование: /find <название, предмет или слово из описания>")
+        return
+    
+    # Листание результатов берёт запрос отсюда — в callback_data он не помещается
+    context.user_data['find_query'] = query
+    page = await lab_search.search(query)
+    await update.message.reply_text(page.text(query), reply_markup=page.keyboard)
+
+@router.route("find", int, choice("w", "f"))
+async def find_page(query, context, offset, mode):
+    search_query = context.user_data.get('find_query')
+    if not search_query:
+        await query.message.reply_text("🔎 Поиск устарел, повторите /find")
+        return
+    page = await lab_search.search(search_query, offset, fuzzy=mode == "f")
+    await views.edit(query, page.text(search_query), reply_markup=page.keyboard)
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inline_query = update.inline_query
+    # offset: "" — первая страница, иначе "<w|f><номер первого результата>"
+    fuzzy = inline_query.offset.startswith("f")
+    offset = int(inline_query.offset[1:]) if inline_query.offset[1:].isdigit() else 0
+    page = await lab_search.search(inline_query.query, offset, size=INLINE_PAGE_SIZE, fuzzy=fuzzy)
+    
+    results = []
+    for hit in page.hits:
+        text = f"📌 <b>{html.escape(hit.title)}</b>\n"
+        text += f"📚 {html.escape(hit.subject)}\n"
+        text += f"⏳ Дедлайн: {hit.deadline_label or 'не установлен'}"
+        results.append(InlineQueryResultArticle(
+            id=str(hit.lab_id),
+            title=hit.title,
+            description=f"📚 {hit.subject} · ⏳ {hit.deadline_label or 'без дедлайна'}",
+            input_message_content=InputTextMessageContent(text, parse_mode='HTML'),
+            # Кнопки callback в чужом чате не работают — открываем карточку в боте
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "Открыть в боте", url=f"https://t.me/{context.bot.username}?start=lab_{hit.lab_id}"
+            )]]),
+        ))
+    
+    next_offset = f"{'f' if page.fuzzy else 'w'}{page.next_offset}" if page.has_more else ""
+    await inline_query.answer(results, next_offset=next_offset, cache_time=INLINE_CACHE_TIME)
 
 # --- Показать файлы лабораторной ---
-async def show_lab_files(query, context):
-    session = SessionLocal()
-    lid = int(query.data.split(":")[1])
-    lab = session.get(Lab, lid)
+@router.route("lab_files", int)
+async def show_lab_files(query, context, lid):
+    async with AsyncSessionLocal() as session:
+        lab = await session.get(Lab, lid, options=[joinedload(Lab.files)])
     
     if lab and lab.files:
         text = f"📁 Файлы лабораторной '{lab.title}':\n\n"
@@ -307,207 +311,309 @@ async def show_lab_files(query, context):
                 callback_data=f"download_file:{lab_file.id}"
             )])
         
+        if len(lab.files) > 1:
+            keyboard.append([InlineKeyboardButton("📦 Скачать всё (ZIP)", callback_data=f"lab_zip:{lab.id}")])
         keyboard.append([InlineKeyboardButton("⬅️ Назад к лабораторной", callback_data=f"lab:{lab.id}")])
         
         await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
     else:
         await query.message.reply_text("📭 Для этой лабораторной пока нет файлов.")
-    
-    session.close()
 
 # --- Функции для работы с файлами ---
-async def download_file_to_server(file_id, file_name, context):
-    """Скачивает файл из Telegram и сохраняет на сервер"""
-    try:
-        print(f"🔄 Начинаем загрузку файла: {file_name}")
-        
-        # Получаем файл от Telegram
-        file = await context.bot.get_file(file_id)
-        
-        # Генерируем уникальное имя файла
-        file_extension = os.path.splitext(file_name)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Скачиваем файл на сервер
-        await file.download_to_drive(file_path)
-        
-        # Проверяем, что файл создался
-        if os.path.exists(file_path):
-            file_size = os.path.getsize(file_path)
-            print(f"✅ Файл сохранен: {file_path} ({file_size} байт)")
-            return unique_filename, file_path
-        else:
-            print(f"❌ Файл не был создан: {file_path}")
-            return None, None
-        
-    except Exception as e:
-        print(f"❌ Ошибка при скачивании файла {file_name}: {e}")
-        return None, None
+# Как отправлять файл в зависимости от расширения
+def get_media_kind(file_name):
+    file_name_lower = file_name.lower()
+    if file_name_lower.endswith(('.jpg', '.jpeg', '.png', '.gif')):
+        return "photo"
+    if file_name_lower.endswith(('.mp4', '.avi', '.mov', '.mkv')):
+        return "video"
+    return "document"
+
+async def reply_media(message, kind, media, file_name):
+    """Отправляет файл нужным методом; media — file_id или открытый файл"""
+    if kind == "photo":
+        return await message.reply_photo(photo=media, caption=f"📸 {file_name}")
+    if kind == "video":
+        return await message.reply_video(video=media, caption=f"🎥 {file_name}")
+    return await message.reply_document(document=media, caption=f"📄 {file_name}")
+
+def get_sent_file_id(message, kind):
+    """file_id, который Telegram присвоил отправленному файлу"""
+    if kind == "photo" and message.photo:
+        return message.photo[-1].file_id
+    if kind == "video" and message.video:
+        return message.video.file_id
+    if message.document:
+        return message.document.file_id
+    return None
 
-async def send_file_from_server(update, file_path, file_name):
-    """Отправляет файл пользователю с сервера"""
+async def save_tg_file_id(lab_file_id, tg_file_id, kind):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            sql_update(LabFile)
+            .where(LabFile.id == lab_file_id)
+            .values(tg_file_id=tg_file_id, tg_file_kind=kind)
+        )
+        await session.commit()
+
+async def send_file_from_server(update, lab_file):
+    """Отправляет файл пользователю: по сохранённому file_id, а если его нет — с сервера"""
+    file_name = lab_file.file_name
+    
+    # Telegram уже хранит этот файл — байты заново не загружаем
+    if lab_file.tg_file_id:
+        try:
+            await reply_media(update.message, lab_file.tg_file_kind, lab_file.tg_file_id, file_name)
+            return True
+        except BadRequest as e:
+            log.warning("file_id для %s недействителен, отправляем с сервера: %s", file_name, e)
+            await save_tg_file_id(lab_file.id, None, None)
+    
     try:
         # Проверяем существование файла
-        if not os.path.exists(file_path):
+        if not os.path.exists(lab_file.file_path):
             await update.message.reply_text(f"❌ Файл {file_name} не найден на сервере")
             return False
         
         # Открываем и отправляем файл
-        with open(file_path, 'rb') as file:
-            file_name_lower = file_name.lower()
-            
-            if file_name_lower.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                await update.message.reply_photo(photo=file, caption=f"📸 {file_name}")
-            elif file_name_lower.endswith(('.mp4', '.avi', '.mov', '.mkv')):
-                await update.message.reply_video(video=file, caption=f"🎥 {file_name}")
-            else:
-                await update.message.reply_document(document=file, caption=f"📄 {file_name}")
+        kind = get_media_kind(file_name)
+        with open(lab_file.file_path, 'rb') as file:
+            message = await reply_media(update.message, kind, file, file_name)
+        
+        # Запоминаем file_id для следующих скачиваний
+        tg_file_id = get_sent_file_id(message, kind)
+        if tg_file_id:
+            await save_tg_file_id(lab_file.id, tg_file_id, kind)
         
-        print(f"✅ Файл отправлен: {file_name}")
+        log.info("Файл отправлен: %s", file_name)
         return True
         
     except Exception as e:
-        print(f"❌ Ошибка при отправке файла {file_name}: {e}")
+        log.exception("Ошибка при отправке файла %s: %s", file_name, e)
         await update.message.reply_text(f"❌ Ошибка при отправке файла {file_name}")
         return False
 
+# --- Скачать все файлы лабораторной одним архивом ---
+@router.route("lab_zip", int, answer=False)
+async def download_lab_zip(query, context, lid):
+    async with AsyncSessionLocal() as session:
+        lab = await session.get(Lab, lid, options=[joinedload(Lab.files)])
+    
+    if not lab or not lab.files:
+        await query.answer("📭 Для этой лабораторной пока нет файлов.")
+        return
+    
+    await query.answer("📦 Готовлю архив...")
+    bundle = await load_lab_bundle(query, lab)
+    if bundle is None:
+        return
+    
+    file_name = f"{lab.title}.zip"
+    caption = f"📦 {lab.title}: файлов — {len(lab.files)}"
+    
+    # Архив уже есть в Telegram — отправляем по file_id
+    if bundle.tg_file_id:
+        try:
+            await query.message.reply_document(document=bundle.tg_file_id, caption=caption)
+            return
+        except BadRequest as e:
+            log.warning("file_id архива %s недействителен, отправляем с сервера: %s", file_name, e)
+        # Пока архив был доступен по file_id, zip на диске мог удалить сборщик мусора
+        if not os.path.exists(bundle.path):
+            bundle = await load_lab_bundle(query, lab, local=True)
+            if bundle is None:
+                return
+    
+    try:
+        with open(bundle.path, 'rb') as file:
+            message = await query.message.reply_document(document=file, filename=file_name, caption=caption)
+        if message.document:
+            await bundles.remember_file_id(lab.id, bundle.file_set_hash, message.document.file_id)
+        log.info("Архив отправлен: %s (%s байт)", file_name, bundle.size)
+    except Exception as e:
+        log.exception("Ошибка при отправке архива %s: %s", file_name, e)
+        await query.message.reply_text(f"❌ Ошибка при отправке архива {file_name}")
+
+async def load_lab_bundle(query, lab, local=False):
+    """LabBundle лабораторной или None, если архив собрать нельзя (пользователю уже ответили)"""
+    try:
+        return await bundles.get(lab.id, lab.files, local=local)
+    except BundleTooLarge:
+        await query.message.reply_text(
+            f"❌ Архив больше {BUNDLE_MAX_SIZE // (1024 * 1024)} МБ — скачайте файлы по одному."
+        )
+    except FileNotFoundError as e:
+        await query.message.reply_text(f"❌ Файл {e} не найден на сервере")
+    return None
+
 # --- Управление предметами ---
+@router.route("manage_subjects", admin=True)
 async def manage_subjects(query, context):
-    session = SessionLocal()
-    subjects = session.query(Subject).all()
+    page = await catalog.page("m")
     
-    if not subjects:
-        await query.message.reply_text("Нет предметов для управления.")
+    if not page.rows:
+        await query.message.reply_text(page.text)
     else:
-        keyboard = []
-        for subject in subjects:
-            keyboard.append([
-                InlineKeyboardButton(f"✏️ {subject.name}", callback_data=f"edit_subject:{subject.id}"),
-                InlineKeyboardButton(f"🗑️", callback_data=f"delete_subject:{subject.id}")
-            ])
-        
-        keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin")])
-        
-        await query.edit_message_text(
-            "Управление предметами:\n\nВыберите предмет для редактирования или удаления:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    session.close()
+        await views.edit(query, page.text, reply_markup=page.keyboard)
 
 # --- Управление лабораторными ---
+@router.route("manage_labs", admin=True)
 async def manage_labs(query, context):
-    session = SessionLocal()
-    labs = session.query(Lab).all()
+    page = await catalog.page("L")
     
-    if not labs:
-        await query.message.reply_text("Нет лабораторных для управления.")
+    if not page.rows:
+        await query.message.reply_text(page.text)
     else:
-        keyboard = []
-        for lab in labs:
-            keyboard.append([
-                InlineKeyboardButton(f"✏️ {lab.title}", callback_data=f"edit_lab:{lab.id}"),
-                InlineKeyboardButton(f"🗑️", callback_data=f"delete_lab:{lab.id}")
-            ])
-        
-        keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin")])
-        
-        await query.edit_message_text(
-            "Управление лабораторными:\n\nВыберите лабораторную для редактирования или удаления:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    session.close()
+        await views.edit(query, page.text, reply_markup=page.keyboard)
 
 # --- Удалить лабораторную ---
-async def delete_lab(query, context):
-    session = SessionLocal()
-    lid = int(query.data.split(":")[1])
-    lab = session.query(Lab).get(lid)
+@router.route("delete_lab", int, admin=True)
+async def delete_lab(query, context, lid):
+    async with AsyncSessionLocal() as session:
+        # Файлы и архив лабораторной удаляет БД (ON DELETE CASCADE); содержимое
+        # без ссылок потом удалит с диска сборщик мусора
+        lab = (await session.execute(
+            delete(Lab).where(Lab.id == lid).returning(Lab.title, Lab.subject_id)
+        )).first()
+        
+        if lab:
+            lab_title, subject_id = lab
+            await coordinator.publish(session, "catalog", deadlines=True)
+            await session.commit()
+            catalog.invalidate()
+            reminders.reschedule()
+            # Проверяем, что предмет ещё существует
+            subject = await session.get(Subject, subject_id)
     
     if lab:
-        lab_title = lab.title
-        subject_id = lab.subject_id
-        session.delete(lab)
-        session.commit()
         await query.message.reply_text(f"Лабораторная '{lab_title}' удалена!")
         
         # Возвращаемся к предмету
-        subject = session.query(Subject).get(subject_id)
         if subject:
-            await show_subject_details(query, context)
+            await show_subject_details(query, context, subject_id)
     else:
         await query.message.reply_text("Лабораторная не найдена.")
-    
-    session.close()
 
 # --- Удалить предмет ---
-async def delete_subject(query, context):
-    session = SessionLocal()
-    sid = int(query.data.split(":")[1])
-    subject = session.query(Subject).get(sid)
+@router.route("delete_subject", int, admin=True)
+async def delete_subject(query, context, sid):
+    async with AsyncSessionLocal() as session:
+        # Лабораторные, их файлы и подписки удаляются каскадом одним запросом
+        subject_name = await session.scalar(
+            delete(Subject).where(Subject.id == sid).returning(Subject.name)
+        )
+        
+        if subject_name is not None:
+            await coordinator.publish(session, "catalog", deadlines=True)
+            await session.commit()
+            catalog.invalidate()
+            reminders.reschedule()
     
-    if subject:
-        subject_name = subject.name
-        # Удаляем все лабораторные этого предмета
-        for lab in subject.labs:
-            session.delete(lab)
-        session.delete(subject)
-        session.commit()
+    if subject_name is not None:
         await query.message.reply_text(f"Предмет '{subject_name}' и все связанные лабораторные удалены!")
         
         # Возвращаемся к списку предметов
         await manage_subjects(query, context)
     else:
         await query.message.reply_text("Предмет не найден.")
-    
-    session.close()
 
 # --- Начать редактирование лабораторной ---
-async def edit_lab_start(query, context):
-    session = SessionLocal()
-    lid = int(query.data.split(":")[1])
-    lab = session.query(Lab).get(lid)
+@router.route("edit_lab", int, admin=True)
+async def edit_lab_start(query, context, lid):
+    async with AsyncSessionLocal() as session:
+        lab = await session.get(Lab, lid)
     
     if lab:
-        context.user_data['edit_lab_id'] = lid
         keyboard = [
-            [InlineKeyboardButton("📝 Название", callback_data="edit_lab_title")],
-            [InlineKeyboardButton("📄 Описание", callback_data="edit_lab_desc")],
-            [InlineKeyboardButton("⏳ Дедлайн", callback_data="edit_lab_deadline")],
+            [InlineKeyboardButton("📝 Название", callback_data=f"edit_lab_field:{lid}:title")],
+            [InlineKeyboardButton("📄 Описание", callback_data=f"edit_lab_field:{lid}:desc")],
+            [InlineKeyboardButton("⏳ Дедлайн", callback_data=f"edit_lab_field:{lid}:deadline")],
             [InlineKeyboardButton("⬅️ Назад", callback_data=f"lab:{lid}")]
         ]
         
-        await query.edit_message_text(
+        await views.edit(
+            query,
             f"Редактирование лабораторной: {lab.title}\n\nЧто вы хотите изменить?",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-    session.close()
+
+# --- Редактирование поля лабораторной ---
+EDIT_LAB_FIELDS = {"title": "название", "desc": "описание", "deadline": "дедлайн"}
+
+@router.route("edit_lab_field", int, choice(*EDIT_LAB_FIELDS), admin=True)
+async def edit_lab_field_start(query, context, lid, field):
+    context.user_data['edit_lab_id'] = lid
+    context.user_data['edit_lab_field'] = field
+    if field == "deadline":
+        await query.message.reply_text(DEADLINE_PROMPT)
+    else:
+        await query.message.reply_text(f"Введите новое {EDIT_LAB_FIELDS[field]} лабораторной:")
     return ASK_EDIT_LAB
 
+async def edit_lab_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lab_id = context.user_data.get('edit_lab_id')
+    field = context.user_data.get('edit_lab_field')
+    value = update.message.text.strip()
+    
+    if field == "deadline":
+        ok, deadline = read_deadline(value)
+        if not ok:
+            await update.message.reply_text(f"❌ Не удалось распознать дату.\n{DEADLINE_PROMPT}")
+            return ASK_EDIT_LAB
+    elif not value:
+        await update.message.reply_text("Значение не может быть пустым.")
+        return ASK_EDIT_LAB
+    
+    async with AsyncSessionLocal() as session:
+        lab = await session.get(Lab, lab_id) if lab_id else None
+        if lab:
+            if field == "deadline":
+                lab.deadline = deadline
+                lab.deadline_text = None
+                # Новый дедлайн — напоминания начинаются заново
+                lab.reminder_stage = 0
+            else:
+                setattr(lab, field, value)
+            await coordinator.publish(session, "catalog", deadlines=field == "deadline")
+            await session.commit()
+    
+    if lab:
+        catalog.invalidate()
+        if field == "deadline":
+            reminders.reschedule()
+        await update.message.reply_text(f"✅ Лабораторная '{lab.title}' обновлена!")
+    else:
+        await update.message.reply_text("Лабораторная не найдена.")
+    
+    context.user_data.clear()
+    return ConversationHandler.END
+
 # --- Начать редактирование предмета ---
-async def edit_subject_start(query, context):
-    session = SessionLocal()
-    sid = int(query.data.split(":")[1])
-    subject = session.query(Subject).get(sid)
+@router.route("edit_subject", int, admin=True)
+async def edit_subject_start(query, context, sid):
+    async with AsyncSessionLocal() as session:
+        subject = await session.get(Subject, sid)
     
     if subject:
         context.user_data['edit_subject_id'] = sid
         await query.message.reply_text(f"Введите новое название для предмета '{subject.name}':")
         return ASK_EDIT_SUBJECT
-    session.close()
 
 # --- Сохранить изменения предмета ---
 async def edit_subject_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
     subject_id = context.user_data.get('edit_subject_id')
     new_name = update.message.text.strip()
     
     if subject_id and new_name:
-        subject = session.query(Subject).get(subject_id)
+        async with AsyncSessionLocal() as session:
+            subject = await session.get(Subject, subject_id)
+            if subject:
+                old_name = subject.name
+                subject.name = new_name
+                await coordinator.publish(session, "catalog")
+                await session.commit()
+                catalog.invalidate()
         if subject:
-            old_name = subject.name
-            subject.name = new_name
-            session.commit()
             await update.message.reply_text(f"Предмет '{old_name}' переименован в '{new_name}'!")
         else:
             await update.message.reply_text("Предмет не найден.")
@@ -515,27 +621,38 @@ async def edit_subject_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Название предмета не может быть пустым.")
     
     context.user_data.clear()
-    session.close()
     return ConversationHandler.END
 
+# --- Листание сводки «Актуально» ---
+@router.route("digest", int)
+async def show_digest_page(query, context, page):
+    snapshot = await catalog.get()
+    pages = snapshot.render("digest", digest_pages)
+    # Каталог мог измениться и страниц стало меньше
+    page = min(page, len(pages) - 1)
+    
+    await views.edit(
+        query,
+        pages[page],
+        reply_markup=digest_keyboard(page, len(pages)),
+        parse_mode='HTML'
+    )
+
 # --- Обработка кнопок назад ---
+@router.route("back_to_subjects")
+@router.route("back_to_admin", admin=True)
 async def handle_back_buttons(query, context):
     data = query.data
     
     if data == "back_to_subjects":
-        session = SessionLocal()
-        subjects = session.query(Subject).all()
-        if not subjects:
-            await query.edit_message_text("Пока предметов нет.")
-        else:
-            keyboard = [[InlineKeyboardButton(s.name, callback_data=f"subject:{s.id}")] for s in subjects]
-            await query.edit_message_text("Ваши предметы:", reply_markup=InlineKeyboardMarkup(keyboard))
-        session.close()
+        page = await catalog.page("s")
+        await views.edit(query, page.text, reply_markup=page.keyboard)
         
     elif data == "back_to_admin":
-        await query.edit_message_text("Админ панель:", reply_markup=get_admin_keyboard())
+        await views.edit(query, "Админ панель:", reply_markup=get_admin_keyboard())
 
 # --- Админ: Добавить предмет ---
+@router.route("add_subject", pass_update=True, admin=True)
 async def add_subject_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     if query:
@@ -545,20 +662,23 @@ async def add_subject_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ASK_SUBJECT
 
 async def add_subject_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
     name = update.message.text.strip()
     if name:
-        new_subj = Subject(name=name)
-        session.add(new_subj)
-        session.commit()
+        async with AsyncSessionLocal() as session:
+            new_subj = Subject(name=name)
+            session.add(new_subj)
+            await coordinator.publish(session, "catalog")
+            await session.commit()
+        catalog.invalidate()
         await update.message.reply_text(f"Предмет '{name}' добавлен!")
     else:
         await update.message.reply_text("Название предмета не может быть пустым.")
-    session.close()
     return ConversationHandler.END
 
 # --- Админ: Оповестить ---
+@router.route("notify", pass_update=True, admin=True)
 async def notify_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop('notify_subject_id', None)
     query = update.callback_query
     if query:
         await query.message.reply_text("Введите сообщение для рассылки всем пользователям:")
@@ -566,52 +686,48 @@ async def notify_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Введите сообщение для рассылки всем пользователям:")
     return ASK_NOTIFY
 
+@router.route("notify_subject", int, pass_update=True, admin=True)
+async def notify_subject_start(update: Update, context: ContextTypes.DEFAULT_TYPE, sid):
+    snapshot = await catalog.get()
+    subject = snapshot.subjects_by_id.get(sid)
+    if subject is None:
+        await update.callback_query.message.reply_text("Предмет не найден.")
+        return ConversationHandler.END
+    
+    context.user_data['notify_subject_id'] = sid
+    subscribers = await subscriptions.count(sid)
+    await update.callback_query.message.reply_text(
+        f"Введите сообщение для подписчиков предмета «{subject.name}» (👥 {subscribers}):"
+    )
+    return ASK_NOTIFY
+
 async def notify_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
     text = update.message.text
-    users = session.query(User).all()
-    sent_count = 0
-    
-    for u in users:
-        try:
-            await context.bot.send_message(u.tg_id, f"📢 Оповещение от админа:\n{text}")
-            sent_count += 1
-        except Exception as e:
-            print(f"Не удалось отправить сообщение пользователю {u.tg_id}: {e}")
-    
-    await update.message.reply_text(f"Сообщение отправлено {sent_count} пользователям.")
-    session.close()
+    subject_id = context.user_data.pop('notify_subject_id', None)
+    # Рассылка идёт в фоне, диалог админа сразу свободен
+    broadcast_id = await broadcaster.enqueue(
+        f"📢 Оповещение от админа:\n{text}",
+        admin_chat_id=update.effective_chat.id,
+        subject_id=subject_id
+    )
+    await update.message.reply_text(f"Рассылка #{broadcast_id} запущена, прогресс появится ниже.")
     return ConversationHandler.END
 
 # --- Админ: Добавить лабораторную ---
+@router.route("add_lab", pass_update=True, admin=True)
 async def add_lab_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
-    subjects = session.query(Subject).all()
-    if not subjects:
-        query = update.callback_query
-        if query:
-            await query.message.reply_text("Нет предметов для добавления лабораторной.")
-        else:
-            await update.message.reply_text("Нет предметов для добавления лабораторной.")
-        session.close()
+    page = await catalog.page("a")
+    message = update.callback_query.message if update.callback_query else update.message
+    if not page.rows:
+        await message.reply_text(page.text)
         return ConversationHandler.END
     
-    keyboard = [[InlineKeyboardButton(s.name, callback_data=f"lab_subj:{s.id}")] for s in subjects]
-    
-    query = update.callback_query
-    if query:
-        await query.message.reply_text("Выберите предмет:", reply_markup=InlineKeyboardMarkup(keyboard))
-    else:
-        await update.message.reply_text("Выберите предмет:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await message.reply_text(page.text, reply_markup=page.keyboard)
     
-    session.close()
     return ASK_LAB_SUBJECT
 
-async def add_lab_subject(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    subject_id = int(query.data.split(":")[1])
+@router.route("lab_subj", int, admin=True)
+async def add_lab_subject(query, context, subject_id):
     context.user_data['lab_subject_id'] = subject_id
     
     await query.message.reply_text("Введите название лабораторной:")
@@ -624,11 +740,24 @@ async def add_lab_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def add_lab_desc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['lab_desc'] = update.message.text
-    await update.message.reply_text("Введите дедлайн лабораторной:")
+    await update.message.reply_text(DEADLINE_PROMPT)
     return ASK_LAB_DEADLINE
 
+def read_deadline(text):
+    """(True, дедлайн или None) — если ввод понятен, иначе (False, None)"""
+    if text.lower() in NO_DEADLINE:
+        return True, None
+    deadline = parse_deadline(text)
+    return deadline is not None, deadline
+
 async def add_lab_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['lab_deadline'] = update.message.text
+    ok, deadline = read_deadline(update.message.text.strip())
+    if not ok:
+        await update.message.reply_text(f"❌ Не удалось распознать дату.\n{DEADLINE_PROMPT}")
+        return ASK_LAB_DEADLINE
+    
+    # В user_data храним строку ISO — так её можно сериализовать
+    context.user_data['lab_deadline'] = deadline.isoformat() if deadline else None
     await update.message.reply_text(
         "Теперь пришлите файлы для лабораторной (если есть). "
         "Можно присылать несколько файлов.\n"
@@ -638,110 +767,59 @@ async def add_lab_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ASK_LAB_FILES
 
 async def add_lab_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if 'lab_files' not in context.user_data:
-        context.user_data['lab_files'] = []
-    
-    # Поддерживаемые типы файлов
-    supported_extensions = ['.txt', '.pdf', '.docx', '.xlsx', '.xls', '.zip', '.py', '.pcap', '.tar', '.jpg', '.jpeg', '.png']
-    
-    if update.message.document:
-        file = update.message.document
-        file_extension = os.path.splitext(file.file_name)[1].lower()
-        
-        # Проверяем поддержку типа файла
-        if file_extension not in supported_extensions:
-            await update.message.reply_text(
-                f"❌ Формат файла {file_extension} не поддерживается.\n"
-                f"📋 Поддерживаемые форматы: {', '.join(supported_extensions)}"
-            )
-            return ASK_LAB_FILES
-        
-        # Скачиваем файл на сервер
-        unique_filename, file_path = await download_file_to_server(
-            file.file_id, 
-            file.file_name, 
-            context
-        )
-        
-        if unique_filename and file_path:
-            context.user_data['lab_files'].append({
-                'file_id': file.file_id,
-                'file_name': file.file_name,
-                'file_size': file.file_size,
-                'unique_filename': unique_filename,
-                'file_path': file_path
-            })
-            await update.message.reply_text(f"✅ Файл '{file.file_name}' загружен на сервер!")
-        else:
-            await update.message.reply_text(f"❌ Ошибка при загрузке файла '{file.file_name}'")
-    
-    elif update.message.photo:
-        # Для фото берем самое большое изображение
-        photo = update.message.photo[-1]
-        unique_filename, file_path = await download_file_to_server(
-            photo.file_id, 
-            "photo.jpg", 
-            context
-        )
-        
-        if unique_filename and file_path:
-            context.user_data['lab_files'].append({
-                'file_id': photo.file_id,
-                'file_name': 'photo.jpg',
-                'file_size': photo.file_size,
-                'unique_filename': unique_filename,
-                'file_path': file_path
-            })
-            await update.message.reply_text("✅ Фото загружено на сервер!")
-        else:
-            await update.message.reply_text("❌ Ошибка при загрузке фото")
-    
+    item = media_item(update.message)
+    if item:
+        # Скачивание идёт в фоне: файлы альбома качаются параллельно,
+        # а диалог сразу готов принять следующий файл
+        ingestor.submit(context, update.message, item)
     return ASK_LAB_FILES
 
 #Актуальные лабы
 async def actual_labs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает все предметы и доступные лабораторные в компактном виде"""
-    session = SessionLocal()
-    
     try:
-        subjects = session.query(Subject).all()
+        snapshot = await catalog.get()
         
-        if not subjects:
+        if not snapshot.subjects:
             await update.message.reply_text("📭 Пока нет предметов и лабораторных работ.")
             return
         
-        message = "📚 <b>АКТУАЛЬНЫЕ ЛАБОРАТОРНЫЕ</b>\n\n"
-        
-        for subject in subjects:
-            if subject.labs:
-                message += f"<b>📖 {subject.name}</b>\n"
-                
-                for lab in subject.labs:
-                    # Форматируем дедлайн (если есть)
-                    deadline_text = f" | ⏳ {lab.deadline}" if lab.deadline else ""
-                    message += f"   • {lab.title}{deadline_text}\n"
-                
-                message += "\n"
-        
-        await update.message.reply_text(message, parse_mode='HTML')
+        # Сводка рендерится один раз на версию каталога
+        pages = snapshot.render("digest", digest_pages)
+        await update.message.reply_text(
+            pages[0],
+            reply_markup=digest_keyboard(0, len(pages)),
+            parse_mode='HTML'
+        )
         
     except Exception as e:
         await update.message.reply_text("❌ Произошла ошибка при получении данных")
-        print(f"Ошибка в actual_labs: {e}")
-    
-    finally:
-        session.close()
+        log.exception("Ошибка в actual_labs: %s", e)
 
 async def add_lab_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
+    user_id = update.effective_user.id
+    if ingestor.pending(user_id):
+        await update.message.reply_text("⏳ Дожидаюсь окончания загрузки файлов...")
+        await ingestor.wait(user_id)
     
     subject_id = context.user_data.get('lab_subject_id')
     title = context.user_data.get('lab_title')
     desc = context.user_data.get('lab_desc')
     deadline = context.user_data.get('lab_deadline')
+    deadline = datetime.fromisoformat(deadline) if deadline else None
     files_data = context.user_data.get('lab_files', [])
     
     if subject_id and title:
+        saved = False
+        try:
+            files_data = await ingestor.refresh(context.bot, files_data)
+        except Exception as e:
+            log.exception("Ошибка при сохранении файлов лабораторной: %s", e)
+            await update.message.reply_text(f"❌ Не удалось сохранить файлы лабораторной: {e}")
+            context.user_data.clear()
+            return ConversationHandler.END
+
+        session = AsyncSessionLocal()
         try:
             # Создаем лабораторную
             new_lab = Lab(
@@ -751,7 +829,7 @@ async def add_lab_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 subject_id=subject_id
             )
             session.add(new_lab)
-            session.flush()  # Получаем ID новой лабораторной
+            await session.flush()  # Получаем ID новой лабораторной
             
             # Сохраняем информацию о файлах в БД
             for file_info in files_data:
@@ -759,74 +837,323 @@ async def add_lab_finish(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     lab_id=new_lab.id,
                     file_name=file_info['file_name'],
                     file_path=file_info['file_path'],
-                    file_size=file_info['file_size']
+                    file_size=file_info['file_size'],
+                    content_hash=file_info.get('content_hash'),
+                    # file_id от загрузки админа — первое скачивание уже без отправки байтов
+                    tg_file_id=file_info.get('file_id'),
+                    tg_file_kind=file_info.get('file_kind')
                 )
                 session.add(lab_file)
-            
-            session.commit()
-            
+            # Счётчики ссылок file_blobs.ref_count увеличивает триггер на lab_files
+
+            # Имя предмета — до commit, пока идёт транзакция
+            subject_name = (await session.get(Subject, subject_id)).name
+            await coordinator.publish(session, "catalog", deadlines=True)
+            await session.commit()
+            saved = True
+        except Exception as e:
+            await session.rollback()
+            await update.message.reply_text(f"❌ Ошибка при добавлении лабораторной в БД: {e}")
+            log.exception("Ошибка БД: %s", e)
+        finally:
+            await session.close()
+
+        # Лабораторная уже сохранена: ошибки ниже к БД отношения не имеют
+        if saved:
+            catalog.invalidate()
+            reminders.reschedule()
+            try:
+                # Новость о лабораторной — только подписчикам предмета
+                await broadcaster.enqueue(
+                    f"🆕 Новая лабораторная по предмету «{subject_name}»: {title}\n"
+                    f"⏳ Дедлайн: {format_deadline(deadline) or 'не установлен'}",
+                    subject_id=subject_id
+                )
+            except Exception as e:
+                log.exception("Не удалось поставить в очередь новость о лабораторной: %s", e)
+
             text = f"✅ Лабораторная '{title}' добавлена!\n\n"
             text += f"📝 Описание: {desc or 'нет'}\n"
-            text += f"⏳ Дедлайн: {deadline or 'не установлен'}\n"
+            text += f"⏳ Дедлайн: {format_deadline(deadline) or 'не установлен'}\n"
             text += f"📎 Файлов: {len(files_data)}"
-            
+
             await update.message.reply_text(text)
-            
+
             # Отправляем подтверждение загрузки файлов
             if files_data:
                 files_list = "\n".join([f"• {f['file_name']}" for f in files_data])
                 await update.message.reply_text(f"📁 Загруженные файлы:\n{files_list}")
-            
-        except Exception as e:
-            session.rollback()
-            await update.message.reply_text(f"❌ Ошибка при добавлении лабораторной в БД: {e}")
-            print(f"❌ Ошибка БД: {e}")
     else:
         await update.message.reply_text("❌ Ошибка: не указаны название или предмет лабораторной.")
     
     context.user_data.clear()
-    session.close()
     return ConversationHandler.END
 
-async def download_lab_file(query, context):
-    session = SessionLocal()
-    file_id = int(query.data.split(":")[1])
-    lab_file = session.get(LabFile, file_id)
+@router.route("download_file", int, answer=False)
+async def download_lab_file(query, context, file_id):
+    async with AsyncSessionLocal() as session:
+        lab_file = await session.get(LabFile, file_id)
     
     if lab_file and lab_file.file_path:
         try:
             # Отправляем файл пользователю
-            success = await send_file_from_server(query, lab_file.file_path, lab_file.file_name)
+            success = await send_file_from_server(query, lab_file)
             if success:
                 await query.answer(f"✅ Файл {lab_file.file_name} отправлен!")
             else:
                 await query.answer("❌ Ошибка при отправке файла")
         except Exception as e:
             await query.answer("❌ Ошибка при загрузке файла")
-            print(f"❌ Ошибка: {e}")
+            log.exception("Ошибка при скачивании файла %s: %s", file_id, e)
     else:
         await query.answer("❌ Файл не найден")
-    
-    session.close()
 
 async def add_lab_skip_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ingestor.cancel(update.effective_user.id)
     context.user_data['lab_files'] = []
     return await add_lab_finish(update, context)
 
+# --- Админ: сборка мусора в хранилище файлов ---
+async def collect_garbage(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await roles.is_admin(update.effective_user.id):
+        await update.message.reply_text("У вас нет доступа к админ панели.")
+        return
+    await update.message.reply_text("🧹 Ищу ненужные файлы…")
+    report = await storage_gc.run()
+    await update.message.reply_text(report.text())
+
+# --- Админ: импорт каталога из файла ---
+IMPORT_HELP = (
+    "Отправьте файл CSV, JSON или JSONL с лабораторными.\n\n"
+    "Колонки: subject (предмет), title (название), desc (описание), deadline (дедлайн); "
+    "обязательны первые две. Лабораторная с тем же предметом и названием обновляется, "
+    "остальные добавляются. Сначала бот покажет, что изменится, — без сохранения.\n\n"
+    "Пример CSV:\n"
+    "subject;title;desc;deadline\n"
+    "Сети;Лабораторная 1;Настройка VLAN;15.10.2024 23:59"
+)
+
+def discard_import(user_data):
+    path = user_data.pop('import_path', None)
+    if path and os.path.exists(path):
+        os.remove(path)
+
+@router.route("import", pass_update=True, admin=True)
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await roles.is_admin(update.effective_user.id):
+        return ConversationHandler.END
+    await update.effective_message.reply_text(IMPORT_HELP)
+    return ASK_IMPORT_FILE
+
+async def import_receive(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    extension = os.path.splitext(document.file_name or "")[1].lower()
+    if extension not in IMPORT_EXTENSIONS:
+        await update.message.reply_text(f"Нужен файл {', '.join(IMPORT_EXTENSIONS)}. Отправьте другой или /cancel.")
+        return ASK_IMPORT_FILE
+    
+    discard_import(context.user_data)
+    try:
+        path = await download_to_staging(
+            context.bot, document.file_id, f"import-{uuid.uuid4().hex}{extension}", IMPORT_MAX_SIZE
+        )
+        keep = False
+        try:
+            parsed = await read_import_file(path)
+            if parsed.errors:
+                await update.message.reply_text(errors_text(parsed.errors))
+                return ASK_IMPORT_FILE
+            # Пробный прогон: те же запросы, но транзакция откатывается
+            report = await import_catalog(parsed, dry_run=True)
+            if not report.has_changes:
+                await update.message.reply_text(report.text() + "\n\nКаталог уже совпадает с файлом.")
+                return ConversationHandler.END
+            keep = True
+        finally:
+            if not keep:
+                os.remove(path)
+    except (CatalogImportError, FileTooLarge) as e:
+        await update.message.reply_text(f"❌ Не удалось прочитать файл: {e}\nОтправьте другой или /cancel.")
+        return ASK_IMPORT_FILE
+    
+    context.user_data['import_path'] = path
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Импортировать", callback_data="import_apply"),
+        InlineKeyboardButton("❌ Отмена", callback_data="import_cancel")
+    ]])
+    await update.message.reply_text(report.text(), reply_markup=keyboard)
+    return ASK_IMPORT_CONFIRM
+
+@router.route("import_apply", answer=False, admin=True)
+async def import_apply(query, context):
+    path = context.user_data.get('import_path')
+    if not path or not os.path.exists(path):
+        await query.answer("Импорт устарел — отправьте файл заново через /import", show_alert=True)
+        return ConversationHandler.END
+    
+    await query.answer("⏳ Импортирую…")
+    try:
+        report = await import_catalog(await read_import_file(path), dry_run=False)
+    except Exception as e:
+        log.exception("Ошибка импорта каталога: %s", e)
+        await query.message.reply_text(f"❌ Ошибка импорта, ничего не сохранено: {e}")
+        return ConversationHandler.END
+    finally:
+        discard_import(context.user_data)
+    
+    catalog.invalidate()
+    reminders.reschedule()
+    await views.edit(query, report.text())
+    return ConversationHandler.END
+
+@router.route("import_cancel", admin=True)
+async def import_cancel(query, context):
+    discard_import(context.user_data)
+    await views.edit(query, "Импорт отменён, каталог не изменился.")
+    return ConversationHandler.END
+
 # --- Отмена ---
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ingestor.cancel(update.effective_user.id)
+    discard_import(context.user_data)
     context.user_data.clear()
     await update.message.reply_text("Операция отменена.")
     return ConversationHandler.END
 
+# --- Подготовка БД при старте ---
+async def prepare_database():
+    started = time.monotonic()
+    attempts = await wait_for_database()
+    async with async_engine.begin() as conn:
+        applied = await conn.run_sync(apply_migrations)
+    if applied:
+        log.info("Применены миграции схемы: %s", applied)
+    log.info("База данных готова за %.2f с (попыток подключения: %s)", time.monotonic() - started, attempts)
+
+# --- Метрики кэшей и фоновых задач ---
+@registry.gauges
+def bot_gauges():
+    values = {}
+    for prefix, stats in (
+        ("bot_catalog", catalog.stats()),
+        ("bot_role_cache", roles.stats()),
+        ("bot_subscription_cache", subscriptions.stats()),
+        ("bot_views", views.stats()),
+        ("bot_storage_gc", storage_gc.stats()),
+        ("bot_api", api_request.stats()),
+        ("bot_api_limiter", api_limiter.stats()),
+        ("bot_broadcasts", broadcaster.stats()),
+        ("bot_lab_bundles", bundles.stats()),
+        ("bot_search", lab_search.stats()),
+        ("bot_coordination", coordinator.stats()),
+        ("bot_log", log_pipeline.stats()),
+    ):
+        values.update({f"{prefix}_{key}": value for key, value in stats.items()})
+    return values
+
+# --- Согласование реплик ---
+# Изменения с других реплик приходят через coordinator (LISTEN/NOTIFY)
+def on_catalog_changed(data):
+    catalog.invalidate()
+    if data.get("deadlines"):
+        reminders.reschedule()
+
+def on_role_changed(data):
+    roles.forget(data.get("tg_id"))
+
+def on_subscription_changed(data):
+    subscriptions.forget(data.get("tg_id"))
+
+def on_broadcast_enqueued(data):
+    if coordinator.is_leader:
+        broadcaster.start(data["id"])
+
+def on_resync():
+    # Пропущенные события неизвестны — сбрасываем все кэши
+    catalog.invalidate()
+    roles.forget()
+    subscriptions.forget()
+
+async def start_leader_jobs():
+    await broadcaster.resume_pending()
+    reminders.start()
+    storage_gc.start()
+
+async def stop_leader_jobs():
+    reminders.stop()
+    storage_gc.stop()
+    # Прогресс рассылок в БД — их продолжит новый лидер
+    await broadcaster.shutdown()
+
+coordinator.subscribe("catalog", on_catalog_changed)
+coordinator.subscribe("role", on_role_changed)
+coordinator.subscribe("subscription", on_subscription_changed)
+coordinator.subscribe("broadcast", on_broadcast_enqueued)
+coordinator.on_resync(on_resync)
+coordinator.leader_job(start_leader_jobs, stop_leader_jobs)
+
+# --- Запуск фоновых задач ---
+async def on_startup(app: Application):
+    # Всё тяжёлое — здесь, а не при импорте модуля
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # БД к этому моменту уже готова: её подготовила персистентность при загрузке
+    await metrics_server.start()
+    broadcaster.bind(app.bot)
+    reminders.bind(app.job_queue)
+    storage_gc.bind(app.job_queue)
+    # Рассылки, напоминания и сборка мусора запустятся, когда реплика станет лидером
+    await coordinator.start()
+
+async def on_stop(app: Application):
+    await coordinator.stop()
+    await broadcaster.shutdown()
+    await metrics_server.stop()
+
+# --- Закрытие пула соединений при остановке ---
+async def close_database(app: Application):
+    await async_engine.dispose()
+
+# --- Ошибки в хендлерах ---
+async def on_error(update, context: ContextTypes.DEFAULT_TYPE):
+    fields = update_fields(update) if isinstance(update, Update) else {}
+    log.error("Ошибка при обработке апдейта: %s", context.error, exc_info=context.error, extra=fields)
+
 # --- MAIN ---
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook: задайте WEBHOOK_SECRET, одинаковый для всех реплик")
+    # Логи пишет отдельный поток — хендлеры не ждут вывода
+    log_pipeline.setup()
+    # Шаги диалогов и user_data переживают рестарт
+    persistence = PostgresPersistence(prepare=prepare_database)
+
+    @registry.gauges
+    def persistence_gauges():
+        return {f"bot_persistence_{key}": value for key, value in persistence.stats().items()}
+
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .persistence(persistence)
+        # Запросы к Bot API замеряются; файлы идут через отдельный пул соединений,
+        # отправка сообщений — через ограничитель с повторами после flood control
+        .request(api_request)
+        .get_updates_request(InstrumentedRequest())
+        .rate_limiter(api_limiter)
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(close_database)
+        .build()
+    )
 
     # Основные хендлеры
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("admin", admin_panel))
     app.add_handler(CommandHandler("cancel", cancel))
+    app.add_handler(CommandHandler("find", find_labs))
+    app.add_handler(CommandHandler("gc", collect_garbage))
+    app.add_handler(InlineQueryHandler(inline_search))
     
     app.add_handler(MessageHandler(filters.Regex("^Мои предметы$"), my_subjects))
     app.add_handler(MessageHandler(filters.Regex("^Админ панель$"), admin_panel))
@@ -834,27 +1161,31 @@ def main():
 
     # ConversationHandler для добавления предмета
     conv_add_subject = ConversationHandler(
-        entry_points=[CallbackQueryHandler(add_subject_start, pattern="^add_subject$")],
+        entry_points=[router.handler("add_subject")],
         states={
             ASK_SUBJECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_subject_save)]
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="add_subject",
+        persistent=True
     )
 
     # ConversationHandler для оповещения
     conv_notify = ConversationHandler(
-        entry_points=[CallbackQueryHandler(notify_start, pattern="^notify$")],
+        entry_points=[router.handler("notify"), router.handler("notify_subject")],
         states={
             ASK_NOTIFY: [MessageHandler(filters.TEXT & ~filters.COMMAND, notify_send)]
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="notify",
+        persistent=True
     )
 
     # ConversationHandler для добавления лабораторной
     conv_add_lab = ConversationHandler(
-        entry_points=[CallbackQueryHandler(add_lab_start, pattern="^add_lab$")],
+        entry_points=[router.handler("add_lab")],
         states={
-            ASK_LAB_SUBJECT: [CallbackQueryHandler(add_lab_subject, pattern="^lab_subj:")],
+            ASK_LAB_SUBJECT: [router.handler("lab_subj")],
             ASK_LAB_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_lab_title)],
             ASK_LAB_DESC: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_lab_desc)],
             ASK_LAB_DEADLINE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_lab_deadline)],
@@ -864,16 +1195,41 @@ def main():
                 CommandHandler("skip", add_lab_skip_files)
             ]
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="add_lab",
+        persistent=True
     )
 
     # ConversationHandler для редактирования предмета
     conv_edit_subject = ConversationHandler(
-        entry_points=[CallbackQueryHandler(edit_subject_start, pattern="^edit_subject:")],
+        entry_points=[router.handler("edit_subject")],
         states={
             ASK_EDIT_SUBJECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_subject_save)]
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="edit_subject",
+        persistent=True
+    )
+
+    conv_edit_lab = ConversationHandler(
+        entry_points=[router.handler("edit_lab_field")],
+        states={
+            ASK_EDIT_LAB: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_lab_save)]
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="edit_lab",
+        persistent=True
+    )
+
+    conv_import = ConversationHandler(
+        entry_points=[CommandHandler("import", import_start), router.handler("import")],
+        states={
+            ASK_IMPORT_FILE: [MessageHandler(filters.Document.ALL, import_receive)],
+            ASK_IMPORT_CONFIRM: [router.handler("import_apply"), router.handler("import_cancel")]
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="import",
+        persistent=True
     )
 
     # Добавляем ConversationHandlers
@@ -881,11 +1237,33 @@ def main():
     app.add_handler(conv_notify)
     app.add_handler(conv_add_lab)
     app.add_handler(conv_edit_subject)
+    app.add_handler(conv_edit_lab)
+    app.add_handler(conv_import)
     
     # Обычный обработчик кнопок (должен быть последним)
     app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_error_handler(on_error)
 
-    app.run_polling()
+    # Задержки, ошибки и SQL-запросы по каждому хендлеру и маршруту кнопок
+    instrument_engine(async_engine)
+    instrument_application(app, labels={button_handler: router.label, router.dispatch: router.label})
+
+    try:
+        if BOT_MODE == "webhook":
+            # Встроенный веб-сервер PTB; setWebhook вызывается при старте
+            app.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            app.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        # Дописываем то, что осталось в очереди логов
+        log_pipeline.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
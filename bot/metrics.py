@@ -0,0 +1,319 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import time
+
+from sqlalchemy import event
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+from logs import log_context, update_fields
+
+log = logging.getLogger(__name__)
+
+# Локальный HTTP-эндпоинт в формате Prometheus; 0 — выключен
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Границы корзин для числа SQL-запросов на один апдейт
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+# --- Метрики ---
+def _labels_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels_text(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # значения меток -> [счётчики корзин..., +Inf], сумма
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels_text(names, label_values + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_labels_text(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_labels_text(self.labels, label_values)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        # Функции, возвращающие {имя метрики: значение} — снимаются при каждом запросе
+        self._gauges = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def gauges(self, collect):
+        """Регистрирует источник мгновенных значений (статистика кэшей и т.п.)"""
+        self._gauges.append(collect)
+        return collect
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for collect in self._gauges:
+            try:
+                values = collect()
+            except Exception as e:
+                log.warning("Ошибка сбора метрик %s: %s", collect.__name__, e)
+                continue
+            for name, value in sorted(values.items()):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_latency = registry.histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта хендлером", ("handler",))
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("handler",))
+handler_sql_queries = registry.histogram(
+    "bot_handler_sql_queries", "SQL-запросов за один вызов хендлера", ("handler",), QUERY_BUCKETS)
+handler_sql_time = registry.histogram(
+    "bot_handler_sql_seconds", "Время в SQL за один вызов хендлера", ("handler",))
+sql_queries = registry.counter(
+    "bot_sql_queries_total", "Все SQL-запросы, включая фоновые задачи")
+sql_time = registry.counter(
+    "bot_sql_seconds_total", "Суммарное время SQL-запросов")
+api_latency = registry.histogram(
+    "bot_telegram_request_duration_seconds", "Время запроса к Bot API", ("method",))
+api_requests = registry.counter(
+    "bot_telegram_requests_total", "Запросы к Bot API по кодам ответа", ("method", "status"))
+
+
+# --- Учёт SQL на текущий апдейт ---
+class _UpdateStats:
+    __slots__ = ("queries", "sql_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+
+
+_current = contextvars.ContextVar("metrics_update_stats", default=None)
+
+
+def instrument_engine(async_engine):
+    """Считает запросы и время SQL через события движка.
+
+    Контекст апдейта (contextvar) виден и внутри greenlet SQLAlchemy,
+    поэтому запросы относятся к хендлеру, который их сделал.
+    """
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        _record_query(elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        started = exception_context.connection.info.get("metrics_started") if exception_context.connection else None
+        if started:
+            _record_query(time.perf_counter() - started.pop())
+
+
+@contextlib.contextmanager
+def track_queries():
+    """SQL-запросы внутри блока: with track_queries() as stats: ... stats.queries"""
+    stats = _UpdateStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def _record_query(elapsed):
+    sql_queries.inc()
+    sql_time.inc(amount=elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_time += elapsed
+
+
+# --- Обёртки хендлеров ---
+def instrument_callback(callback, name, label=None):
+    """Оборачивает callback хендлера: задержка, ошибки и SQL на вызов.
+
+    Заодно задаёт контекст логов: update_id, user_id и имя хендлера попадают
+    во все записи, сделанные во время обработки.
+
+    label(update) может уточнить имя — например, префикс callback_data.
+    """
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        handler = (label(update) if label else None) or name
+        with track_queries() as stats, log_context(handler=handler, **update_fields(update)):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                handler_errors.inc(handler)
+                raise
+            finally:
+                handler_latency.observe(time.perf_counter() - started, handler)
+                handler_sql_queries.observe(stats.queries, handler)
+                handler_sql_time.observe(stats.sql_time, handler)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _instrument_handler(handler, labels):
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks:
+            _instrument_handler(inner, labels)
+        for state_handlers in handler.states.values():
+            for inner in state_handlers:
+                _instrument_handler(inner, labels)
+        return
+    callback = handler.callback
+    if getattr(callback, "instrumented", False):
+        return
+    name = getattr(callback, "__name__", type(handler).__name__)
+    handler.callback = instrument_callback(callback, name, labels.get(callback))
+
+
+def instrument_application(app, labels=None):
+    """Оборачивает все зарегистрированные хендлеры, включая состояния диалогов.
+
+    labels — {callback: label(update)} для хендлеров, которым нужно имя
+    точнее, чем имя функции.
+    """
+    labels = labels or {}
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler, labels)
+
+
+# --- Запросы к Bot API ---
+async def observe_api_call(url, call):
+    """Ждёт вызов Bot API (корутину do_request) и записывает время и статус"""
+    api_method = url.rsplit("/", 1)[-1]
+    started = time.perf_counter()
+    status = "error"
+    try:
+        status, payload = await call
+        return status, payload
+    finally:
+        api_latency.observe(time.perf_counter() - started, api_method)
+        api_requests.inc(api_method, status)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет каждый вызов Bot API"""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        return await observe_api_call(url, super().do_request(url, method, request_data, **kwargs))
+
+
+# --- HTTP-эндпоинт ---
+class MetricsServer:
+    """Минимальный HTTP-сервер на asyncio: GET /metrics"""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        if not self.port:
+            return
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        log.info("Метрики: http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Заголовки запроса не нужны — дочитываем до пустой строки
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", registry.expose().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+metrics_server = MetricsServer()
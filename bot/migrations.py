@@ -0,0 +1,247 @@
+import logging
+from sqlalchemy import text
+
+# Все модели зарегистрированы в Base при импорте models
+from models import Base
+from deadlines import parse_deadline
+
+log = logging.getLogger(__name__)
+
+# Ключ advisory lock: два экземпляра бота не накатывают миграции одновременно
+MIGRATION_LOCK_ID = 7_321_001
+
+
+def create_tables(conn):
+    """Создаёт таблицы моделей, которых ещё нет (существующие не трогает)"""
+    Base.metadata.create_all(conn)
+
+
+def migrate_text_deadlines(conn):
+    """Переводит labs.deadline из текста в timestamptz, распознавая старые значения"""
+    data_type = conn.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'labs' AND column_name = 'deadline'"
+    )).scalar()
+    if data_type != "character varying":
+        return
+
+    conn.execute(text("ALTER TABLE labs RENAME COLUMN deadline TO deadline_text"))
+    conn.execute(text("ALTER TABLE labs ADD COLUMN deadline TIMESTAMP WITH TIME ZONE"))
+
+    rows = conn.execute(text("SELECT id, deadline_text FROM labs WHERE deadline_text IS NOT NULL")).all()
+    parsed = []
+    for lab_id, deadline_text in rows:
+        deadline = parse_deadline(deadline_text)
+        if deadline:
+            parsed.append({"id": lab_id, "deadline": deadline})
+    if parsed:
+        # Распознанные значения переносим, нераспознанный текст остаётся в deadline_text
+        conn.execute(
+            text("UPDATE labs SET deadline = :deadline, deadline_text = NULL WHERE id = :id"),
+            parsed
+        )
+    log.info("Дедлайны: распознано %s из %s", len(parsed), len(rows))
+
+
+# Поисковый вектор лабораторной: название (вес A), предмет (B), описание (C).
+# Имя предмета лежит в другой таблице, поэтому вектор поддерживают триггеры.
+SEARCH_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION labs_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(
+                (SELECT name FROM subjects WHERE id = NEW.subject_id), '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce(NEW."desc", '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS labs_search_vector ON labs",
+    """
+    CREATE TRIGGER labs_search_vector BEFORE INSERT OR UPDATE OF title, "desc", subject_id
+    ON labs FOR EACH ROW EXECUTE FUNCTION labs_search_vector()
+    """,
+    # Переименование предмета пересчитывает векторы его лабораторных
+    """
+    CREATE OR REPLACE FUNCTION subjects_search_vector() RETURNS trigger AS $$
+    BEGIN
+        UPDATE labs SET title = title WHERE subject_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS subjects_search_vector ON subjects",
+    """
+    CREATE TRIGGER subjects_search_vector AFTER UPDATE OF name ON subjects
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name) EXECUTE FUNCTION subjects_search_vector()
+    """,
+]
+
+
+def create_search_vector(conn):
+    """Колонка labs.search_vector, триггеры и заполнение для существующих строк"""
+    conn.exec_driver_sql("ALTER TABLE labs ADD COLUMN IF NOT EXISTS search_vector tsvector")
+    for statement in SEARCH_TRIGGERS:
+        conn.exec_driver_sql(statement)
+    conn.exec_driver_sql("UPDATE labs SET title = title")
+
+
+def enable_trigram(conn):
+    """pg_trgm для поиска с опечатками; без расширения поиск работает только по словам"""
+    available = conn.execute(text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).scalar()
+    if not available:
+        log.warning("Расширение pg_trgm недоступно — поиск с опечатками выключен")
+        return
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_labs_title_trgm ON labs USING gin (title gin_trgm_ops)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_subjects_name_trgm ON subjects USING gin (name gin_trgm_ops)"))
+
+# Удаление предмета или лабораторной — один DELETE: зависимые строки удаляет БД
+CASCADE_FOREIGN_KEYS = [
+    ("labs", "subject_id", "subjects"),
+    ("lab_files", "lab_id", "labs"),
+]
+
+
+def cascade_deletes(conn):
+    """Внешние ключи labs и lab_files с ON DELETE CASCADE.
+
+    Раньше ORM при удалении лабораторной обнулял lab_files.lab_id — такие
+    строки ни к чему не относятся и удаляются (файлы подберёт сборщик мусора).
+    """
+    deleted = conn.execute(text("DELETE FROM lab_files WHERE lab_id IS NULL")).rowcount
+    if deleted:
+        log.info("Удалено файлов без лабораторной: %s", deleted)
+    for table, column, target in CASCADE_FOREIGN_KEYS:
+        names = conn.execute(text("""
+            SELECT c.conname FROM pg_constraint c
+            JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+            WHERE c.contype = 'f' AND c.conrelid = CAST(:table AS regclass) AND a.attname = :column
+        """), {"table": table, "column": column}).scalars().all()
+        for name in names:
+            conn.exec_driver_sql(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey "
+            f"FOREIGN KEY ({column}) REFERENCES {target} (id) ON DELETE CASCADE"
+        )
+
+
+# file_blobs.ref_count — сколько lab_files ссылается на содержимое. Считает
+# БД: так счётчик верен и при каскадном удалении, которое ORM не видит.
+BLOB_REF_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION lab_files_blob_refs() RETURNS trigger AS $$
+    DECLARE
+        delta integer := CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END;
+    BEGIN
+        UPDATE file_blobs b SET ref_count = b.ref_count + delta * d.n
+        FROM (SELECT content_hash, count(*) AS n FROM changed_rows
+              WHERE content_hash IS NOT NULL GROUP BY content_hash) d
+        WHERE b.sha256 = d.content_hash;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS lab_files_blob_refs_insert ON lab_files",
+    """
+    CREATE TRIGGER lab_files_blob_refs_insert AFTER INSERT ON lab_files
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION lab_files_blob_refs()
+    """,
+    "DROP TRIGGER IF EXISTS lab_files_blob_refs_delete ON lab_files",
+    """
+    CREATE TRIGGER lab_files_blob_refs_delete AFTER DELETE ON lab_files
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION lab_files_blob_refs()
+    """,
+]
+
+
+def count_blob_refs(conn):
+    """Триггеры счётчика ссылок и пересчёт по текущим lab_files"""
+    for statement in BLOB_REF_TRIGGERS:
+        conn.exec_driver_sql(statement)
+    conn.exec_driver_sql("""
+        UPDATE file_blobs b SET ref_count = coalesce(
+            (SELECT count(*) FROM lab_files f WHERE f.content_hash = b.sha256), 0)
+    """)
+
+# Версионированные миграции: (версия, шаг). Шаг — SQL или функция от
+# соединения. Применяются только версии новее записанной в schema_version.
+# Базу, созданную до появления schema_version, шаги догоняют безопасно:
+# все они идемпотентны. Новые шаги добавляются только в конец.
+MIGRATIONS = [
+    (1, create_tables),
+    # Кэш file_id Telegram для файлов лабораторных
+    (2, "ALTER TABLE lab_files ADD COLUMN IF NOT EXISTS tg_file_id VARCHAR"),
+    (3, "ALTER TABLE lab_files ADD COLUMN IF NOT EXISTS tg_file_kind VARCHAR"),
+    # Контентно-адресуемое хранилище файлов
+    (4, "ALTER TABLE lab_files ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64) REFERENCES file_blobs (sha256)"),
+    (5, "CREATE INDEX IF NOT EXISTS ix_lab_files_content_hash ON lab_files (content_hash)"),
+    # Типизированные дедлайны и напоминания
+    (6, migrate_text_deadlines),
+    (7, "ALTER TABLE labs ADD COLUMN IF NOT EXISTS reminder_stage INTEGER DEFAULT 0"),
+    (8, "CREATE INDEX IF NOT EXISTS ix_labs_deadline ON labs (deadline)"),
+    # Таблица bot_state для персистентности диалогов
+    (9, create_tables),
+    # Кэш ZIP-архивов лабораторных
+    (10, create_tables),
+    # Полнотекстовый поиск по лабораторным
+    (11, create_search_vector),
+    (12, "CREATE INDEX IF NOT EXISTS ix_labs_search_vector ON labs USING gin (search_vector)"),
+    (13, "CREATE INDEX IF NOT EXISTS ix_labs_subject_id ON labs (subject_id)"),
+    (14, enable_trigram),
+    # Подписки на предметы и адресные рассылки
+    (15, create_tables),
+    (16, "ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS subject_id INTEGER"),
+    # Каскадное удаление и сборка мусора в хранилище файлов
+    (17, cascade_deletes),
+    (18, count_blob_refs),
+    (19, "ALTER TABLE file_blobs ADD COLUMN IF NOT EXISTS used_at TIMESTAMP"),
+    (20, "UPDATE file_blobs SET used_at = created_at WHERE used_at IS NULL"),
+    # В БД, созданной через create_tables, у столбца не было DEFAULT (шаг 7 пропускался)
+    (21, "ALTER TABLE labs ALTER COLUMN reminder_stage SET DEFAULT 0"),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Версия схемы или 0, если таблицы schema_version ещё нет"""
+    if conn.execute(text("SELECT to_regclass('schema_version')")).scalar() is None:
+        return 0
+    return conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_version")).scalar()
+
+
+def apply_migrations(conn):
+    """Накатывает недостающие миграции; возвращает список применённых версий.
+
+    Быстрый путь — два лёгких запроса без рефлексии схемы, когда всё уже
+    применено. Иначе шаги идут в одной транзакции под advisory lock.
+    """
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+
+    conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+    ))
+    # Пока ждали блокировку, миграции мог накатить другой экземпляр
+    version = current_version(conn)
+
+    applied = []
+    for step_version, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        if callable(step):
+            step(conn)
+        else:
+            conn.execute(text(step))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": step_version})
+        applied.append(step_version)
+    return applied
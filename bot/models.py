@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, DateTime, BigInteger
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, DateTime, BigInteger, Index
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 
 # Импортируем Base из db.py
@@ -17,28 +18,98 @@ class Subject(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
-    labs = relationship("Lab", back_populates="subject")
+    # Лабораторные удаляет БД (ON DELETE CASCADE), ORM их не загружает
+    labs = relationship("Lab", back_populates="subject", cascade="all", passive_deletes=True)
 
 class Lab(Base):
     __tablename__ = "labs"
     
     id = Column(Integer, primary_key=True, index=True)
-    subject_id = Column(Integer, ForeignKey("subjects.id"))
+    subject_id = Column(Integer, ForeignKey("subjects.id", ondelete="CASCADE"))
     title = Column(String, index=True)
     desc = Column(Text, nullable=True)
-    deadline = Column(String, nullable=True)
+    deadline = Column(DateTime(timezone=True), nullable=True, index=True)
+    deadline_text = Column(String, nullable=True)  # старый дедлайн, который не удалось распознать
+    # server_default — и для вставок в обход ORM (COPY импорта, сидер бенчмарка)
+    reminder_stage = Column(Integer, default=0, server_default="0")  # 0 — напоминаний не было, 1 — за 24ч, 2 — за 1ч
+    # Заполняется триггером (см. migrations.py); в ORM не загружается
+    search_vector = deferred(Column(TSVECTOR, nullable=True))
     
     subject = relationship("Subject", back_populates="labs")
-    files = relationship("LabFile", back_populates="lab")
+    files = relationship("LabFile", back_populates="lab", cascade="all", passive_deletes=True)
+
+class FileBlob(Base):
+    __tablename__ = "file_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)  # хэш содержимого — он же имя файла
+    path = Column(String)
+    size = Column(BigInteger)
+    ref_count = Column(Integer, default=0)  # сколько LabFile ссылается на это содержимое (считает триггер)
+    tg_file_unique_id = Column(String, nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Когда содержимое последний раз загружали: без ссылок оно хранится GC_UPLOAD_TTL от этого момента
+    used_at = Column(DateTime, default=datetime.utcnow)
 
 class LabFile(Base):
     __tablename__ = "lab_files"
     
     id = Column(Integer, primary_key=True, index=True)
-    lab_id = Column(Integer, ForeignKey("labs.id"))
+    lab_id = Column(Integer, ForeignKey("labs.id", ondelete="CASCADE"))
     file_name = Column(String)
     file_path = Column(String)
     file_size = Column(Integer)
+    content_hash = Column(String(64), ForeignKey("file_blobs.sha256"), nullable=True, index=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
+    # file_id, под которым файл уже лежит в Telegram, и каким методом его отправлять
+    tg_file_id = Column(String, nullable=True)
+    tg_file_kind = Column(String, nullable=True)  # document / photo / video
+    
+    lab = relationship("Lab", back_populates="files")
+
+class LabBundle(Base):
+    """Готовый ZIP со всеми файлами лабораторной"""
+    __tablename__ = "lab_bundles"
+    
+    lab_id = Column(Integer, ForeignKey("labs.id", ondelete="CASCADE"), primary_key=True)
+    file_set_hash = Column(String(64))  # хэш набора файлов: изменился — архив устарел
+    path = Column(String)
+    size = Column(BigInteger)
+    tg_file_id = Column(String, nullable=True)  # file_id уже отправленного архива
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Subscription(Base):
+    """Подписка пользователя на новости предмета"""
+    __tablename__ = "subscriptions"
+    # Первичный ключ (subject_id, user_id) — рассылка подписчикам идёт по нему
+    # range scan'ом; обратный индекс — для списка подписок пользователя
+    __table_args__ = (Index("ix_subscriptions_user_subject", "user_id", "subject_id"),)
+    
+    subject_id = Column(Integer, ForeignKey("subjects.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    text = Column(Text)
+    status = Column(String, default="pending", index=True)  # pending / running / done
+    admin_chat_id = Column(BigInteger, nullable=True)  # куда присылать прогресс
+    # None — всем пользователям, иначе подписчикам предмета (без FK: удаление
+    # предмета просто оставляет рассылку без получателей)
+    subject_id = Column(Integer, nullable=True)
+    last_user_id = Column(Integer, default=0)  # курсор: users.id, до которого рассылка дошла
+    sent_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class BotState(Base):
+    """Состояние PTB между рестартами: user_data и шаги диалогов"""
+    __tablename__ = "bot_state"
     
-    lab = relationship("Lab", back_populates="files")
\ No newline at end of file
+    kind = Column(String(64), primary_key=True)  # user / conv:<имя диалога>
+    key = Column(String, primary_key=True)  # id пользователя или ключ диалога в JSON
+    data = Column(JSONB, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
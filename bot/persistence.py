@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import AsyncSessionLocal
+from models import BotState
+
+log = logging.getLogger(__name__)
+
+# Как часто PTB отдаёт изменения в персистентность, секунд
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "2"))
+# Сколько копим изменения перед записью — всё накопленное уходит одним commit
+PERSISTENCE_FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "0.5"))
+
+_DELETE = object()
+
+
+class PostgresPersistence(BasePersistence):
+    """user_data и состояния ConversationHandler в таблице bot_state.
+
+    Запись отложенная: update_* только кладут значение в буфер, повторные
+    изменения одного ключа схлопываются, а фоновая задача пишет весь буфер
+    одним INSERT ... ON CONFLICT в одной транзакции. Неизменившиеся данные
+    (например, пустой user_data каждого, кто нажал кнопку) не пишутся вовсе.
+
+    PTB загружает состояние до post_init, поэтому подготовка БД (ожидание
+    и миграции) передаётся сюда как prepare и выполняется перед загрузкой.
+    """
+
+    def __init__(self, prepare=None, update_interval=PERSISTENCE_INTERVAL, flush_delay=PERSISTENCE_FLUSH_DELAY):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._prepare = prepare
+        self._flush_delay = flush_delay
+        self._loaded = None
+        # (kind, key) -> JSON последней записанной версии
+        self._stored = {}
+        # (kind, key) -> JSON или _DELETE, ещё не записанные
+        self._pending = {}
+        self._writer = None
+        self.writes = 0
+        self.rows_written = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+    # --- Загрузка ---
+    async def _load(self):
+        if self._loaded is None:
+            if self._prepare is not None:
+                await self._prepare()
+            async with AsyncSessionLocal() as session:
+                rows = (await session.execute(select(BotState.kind, BotState.key, BotState.data))).all()
+            self._loaded = {}
+            for kind, key, data in rows:
+                self._loaded.setdefault(kind, {})[key] = data
+                self._stored[(kind, key)] = _dumps(data)
+        return self._loaded
+
+    async def get_user_data(self):
+        loaded = await self._load()
+        return {int(key): data or {} for key, data in loaded.get("user", {}).items()}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        loaded = await self._load()
+        return {
+            tuple(json.loads(key)): state
+            for key, state in loaded.get(f"conv:{name}", {}).items()
+        }
+
+    # --- Изменения (в буфер) ---
+    async def update_user_data(self, user_id, data):
+        self._stage("user", str(user_id), dict(data) if data else _DELETE)
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(f"conv:{name}", json.dumps(list(key)), _DELETE if new_state is None else new_state)
+
+    async def drop_user_data(self, user_id):
+        self._stage("user", str(user_id), _DELETE)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _stage(self, kind, key, data):
+        slot = (kind, key)
+        if data is not _DELETE:
+            try:
+                encoded = _dumps(data)
+            except (TypeError, ValueError) as e:
+                log.warning("Состояние %s:%s не сериализуется в JSON и не сохранено: %s", kind, key, e)
+                return
+        else:
+            encoded = None
+        # Совпадает с уже записанным — писать нечего
+        if self._stored.get(slot) == encoded:
+            self._pending.pop(slot, None)
+            self.skipped += 1
+            return
+        if slot in self._pending:
+            self.coalesced += 1
+        # Храним JSON-снимок: хендлер может менять user_data до записи
+        self._pending[slot] = _DELETE if data is _DELETE else encoded
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_later())
+
+    # --- Запись ---
+    async def _write_later(self):
+        while self._pending:
+            await asyncio.sleep(self._flush_delay)
+            try:
+                await self._write()
+            except Exception as e:
+                log.error("Ошибка записи состояния бота, повтор через %s с: %s", self._flush_delay, e)
+
+    async def _write(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        upserts = [
+            {"kind": kind, "key": key, "data": json.loads(encoded), "updated_at": datetime.utcnow()}
+            for (kind, key), encoded in batch.items() if encoded is not _DELETE
+        ]
+        deletes = [slot for slot, encoded in batch.items() if encoded is _DELETE]
+        try:
+            async with AsyncSessionLocal() as session:
+                if upserts:
+                    stmt = insert(BotState)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[BotState.kind, BotState.key],
+                        set_={"data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at}
+                    )
+                    await session.execute(stmt, upserts)
+                if deletes:
+                    await session.execute(
+                        delete(BotState).where(tuple_(BotState.kind, BotState.key).in_(deletes))
+                    )
+                await session.commit()
+        except BaseException:
+            # Возвращаем в буфер всё, что не успели перезаписать новыми значениями
+            # (в том числе при отмене задачи во время flush)
+            for slot, encoded in batch.items():
+                self._pending.setdefault(slot, encoded)
+            raise
+
+        for slot, encoded in batch.items():
+            if encoded is _DELETE:
+                self._stored.pop(slot, None)
+            else:
+                self._stored[slot] = encoded
+        self.writes += 1
+        self.rows_written += len(batch)
+
+    async def flush(self):
+        """Вызывается PTB при остановке: дописываем буфер сразу, без задержки"""
+        writer = self._writer
+        if writer is not None and not writer.done():
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+        await self._write()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "writes": self.writes,
+            "rows_written": self.rows_written,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+        }
+
+
+def _dumps(data):
+    return json.dumps(data, sort_keys=True, ensure_ascii=False)
@@ -0,0 +1,178 @@
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+log = logging.getLogger(__name__)
+
+# Лимиты Bot API на отправку: ~30 сообщений/с на бота, ~1/с в личный чат
+# (короткие всплески допустимы), 20 в минуту в группу
+BOT_API_RATE = float(os.getenv("BOT_API_RATE", "30"))
+BOT_API_CHAT_RATE = float(os.getenv("BOT_API_CHAT_RATE", "1"))
+BOT_API_CHAT_BURST = float(os.getenv("BOT_API_CHAT_BURST", "3"))
+BOT_API_GROUP_RATE = float(os.getenv("BOT_API_GROUP_RATE", "20")) / 60
+BOT_API_GROUP_BURST = float(os.getenv("BOT_API_GROUP_BURST", "20"))
+# Сколько раз повторять запрос после RetryAfter (flood control)
+BOT_API_MAX_RETRIES = int(os.getenv("BOT_API_MAX_RETRIES", "3"))
+# Методы, которые отправляют новое сообщение в чат, — на них лимит чата
+SEND_METHODS = ("send", "copyMessage", "forwardMessage")
+
+
+class TokenBucket:
+    """Token bucket: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # Блокировка держится во время ожидания — ждущие обслуживаются по очереди
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов (например, после RetryAfter от Telegram)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+
+class PerChatLimiter:
+    """Отдельный token bucket на каждый чат"""
+
+    def __init__(self, rate, capacity=None, max_chats=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_chats = max_chats
+        self._buckets = {}
+
+    def bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_chats:
+                self._evict_idle()
+            bucket = TokenBucket(self.rate, self.capacity)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _evict_idle(self):
+        # Полные корзины ничего не помнят — их можно выбросить без потери лимита
+        for chat_id in [cid for cid, b in self._buckets.items() if b.is_idle()]:
+            del self._buckets[chat_id]
+
+    async def acquire(self, chat_id):
+        await self.bucket(chat_id).acquire()
+
+    def pause(self, chat_id, seconds):
+        self.bucket(chat_id).pause(seconds)
+
+
+class BotApiRateLimiter(BaseRateLimiter):
+    """Ограничитель запросов к Bot API для всего бота (ExtBot.rate_limiter).
+
+    Ограничиваются только запросы с chat_id: все они проходят общий token
+    bucket на бота, а отправка новых сообщений (send*, copy, forward) —
+    ещё и bucket своего чата (для групп — более строгий). Правки экранов
+    лимит чата не ждут, иначе листание меню шло бы раз в секунду. Ответы
+    на нажатия кнопок и inline-запросы chat_id не содержат и идут без ожидания.
+
+    На RetryAfter притормаживается только этот чат (весь бот — если у
+    запроса нет чата) на указанное Telegram время, и запрос повторяется (до BOT_API_MAX_RETRIES раз; rate_limit_args
+    в методе бота задаёт своё число). Сетевые ошибки не повторяются:
+    сообщение могло уже дойти, повтор дал бы дубль.
+    """
+
+    def __init__(self, rate=BOT_API_RATE, max_retries=BOT_API_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(rate)
+        self.chats = PerChatLimiter(BOT_API_CHAT_RATE, BOT_API_CHAT_BURST)
+        self.groups = PerChatLimiter(BOT_API_GROUP_RATE, BOT_API_GROUP_BURST)
+        self.limited = 0
+        self.waited = 0.0
+        self.retries = 0
+        self.gave_up = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _limiter(self, chat_id):
+        # Отрицательный id или @username — группа или канал
+        with contextlib.suppress(TypeError, ValueError):
+            chat_id = int(chat_id)
+        if isinstance(chat_id, str) or chat_id < 0:
+            return self.groups, chat_id
+        return self.chats, chat_id
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        limiter, key = self._limiter(chat_id) if chat_id is not None else (None, None)
+        per_chat = limiter is not None and endpoint.startswith(SEND_METHODS)
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        for attempt in range(max_retries + 1):
+            if chat_id is not None:
+                started = time.monotonic()
+                # Сначала свой чат, потом общий лимит: ожидание одного чата
+                # не держит общий токен
+                if per_chat:
+                    await limiter.acquire(key)
+                await self.global_bucket.acquire()
+                self.limited += 1
+                self.waited += time.monotonic() - started
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    self.gave_up += 1
+                    log.warning("%s в чат %s: flood control и после %d повторов", endpoint, chat_id, max_retries)
+                    raise
+                self.retries += 1
+                # Небольшой разброс: повторы разных запросов не приходят одновременно
+                delay = e.retry_after + random.uniform(0.1, 0.5)
+                log.info("%s в чат %s: flood control, повтор через %.1f с", endpoint, chat_id, delay)
+                # Флуд в одном чате не останавливает остальных: общий лимит
+                # притормаживаем, только если 429 не относится к чату
+                if limiter is not None:
+                    limiter.pause(key, delay)
+                else:
+                    self.global_bucket.pause(delay)
+                await asyncio.sleep(delay)
+        return None
+
+    def stats(self):
+        return {
+            "limited_total": self.limited,
+            "wait_seconds_total": self.waited,
+            "retries_total": self.retries,
+            "gave_up_total": self.gave_up,
+        }
+
+
+api_limiter = BotApiRateLimiter()
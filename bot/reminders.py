@@ -0,0 +1,120 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from broadcast import broadcaster
+from db import AsyncSessionLocal
+from deadlines import format_deadline
+from models import Lab
+
+log = logging.getLogger(__name__)
+
+# (стадия, за сколько до дедлайна, заголовок напоминания)
+REMINDER_STAGES = [
+    (1, timedelta(hours=24), "⏰ Через 24 часа дедлайн:"),
+    (2, timedelta(hours=1), "🔥 Меньше часа до дедлайна:"),
+]
+MAX_WINDOW = max(offset for _, offset, _ in REMINDER_STAGES)
+
+
+class DeadlineReminders:
+    """Напоминания о дедлайнах через JobQueue.
+
+    Всегда запланирован ровно один job — на ближайший момент, когда нужно
+    что-то отправить. Момент ищется по индексу labs.deadline, без опроса
+    всей таблицы по таймеру.
+    """
+
+    def __init__(self):
+        self.job_queue = None
+        self._job = None
+        # Напоминания шлёт только реплика-лидер (см. coordination.py)
+        self.active = False
+
+    def bind(self, job_queue):
+        self.job_queue = job_queue
+
+    def start(self):
+        self.active = True
+        self.reschedule()
+
+    def stop(self):
+        self.active = False
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+    def reschedule(self, when=None):
+        """Перепланировать проверку (по умолчанию — сейчас); вызывается после изменений дедлайнов"""
+        if self.job_queue is None or not self.active:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+        now = datetime.now(timezone.utc)
+        if when is None or when < now:
+            when = now
+        self._job = self.job_queue.run_once(self._tick, when=when, name="deadline_reminders")
+
+    async def _tick(self, context):
+        self._job = None
+        now = datetime.now(timezone.utc)
+        try:
+            await self._send_due(now)
+            next_run = await self._next_run(now)
+        except Exception as e:
+            log.exception("Ошибка в напоминаниях о дедлайнах: %s", e)
+            next_run = now + timedelta(minutes=5)
+        if next_run is not None and self._job is None and self.active:
+            self.reschedule(next_run)
+
+    async def _send_due(self, now):
+        """Отправляет все напоминания, срок которых наступил, одной рассылкой на стадию и предмет"""
+        async with AsyncSessionLocal() as session:
+            labs = (await session.scalars(
+                select(Lab)
+                .options(joinedload(Lab.subject))
+                .where(Lab.deadline > now, Lab.deadline <= now + MAX_WINDOW, Lab.reminder_stage < 2)
+                .order_by(Lab.deadline)
+            )).all()
+
+            due = {stage: [] for stage, _, _ in REMINDER_STAGES}
+            for lab in labs:
+                # Самая поздняя наступившая стадия; пропущенные ранние не досылаем
+                for stage, offset, _ in reversed(REMINDER_STAGES):
+                    if lab.deadline - now <= offset:
+                        if (lab.reminder_stage or 0) < stage:
+                            due[stage].append(lab)
+                            lab.reminder_stage = stage
+                        break
+            await session.commit()
+
+        for stage, _, title in REMINDER_STAGES:
+            # Напоминание получают только подписчики предмета — одна рассылка на предмет
+            by_subject = {}
+            for lab in due[stage]:
+                by_subject.setdefault(lab.subject_id, []).append(lab)
+            for subject_id, subject_labs in by_subject.items():
+                lines = [title]
+                for lab in subject_labs:
+                    lines.append(f"• {lab.subject.name}: {lab.title} ({format_deadline(lab.deadline)})")
+                await broadcaster.enqueue("\n".join(lines), subject_id=subject_id)
+
+    async def _next_run(self, now):
+        """Ближайший момент следующего напоминания (range scan по индексу дедлайна)"""
+        candidates = []
+        async with AsyncSessionLocal() as session:
+            for stage, offset, _ in REMINDER_STAGES:
+                deadline = await session.scalar(
+                    select(Lab.deadline)
+                    .where(Lab.deadline > now + offset, Lab.reminder_stage < stage)
+                    .order_by(Lab.deadline)
+                    .limit(1)
+                )
+                if deadline is not None:
+                    candidates.append(deadline - offset)
+        return min(candidates, default=None)
+
+
+reminders = DeadlineReminders()
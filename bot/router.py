@@ -0,0 +1,145 @@
+import logging
+import re
+import time
+
+from telegram.ext import CallbackQueryHandler
+
+from users import roles
+
+log = logging.getLogger(__name__)
+
+
+def choice(*values):
+    """Тип аргумента: одно из перечисленных значений"""
+    def parse(value):
+        if value not in values:
+            raise ValueError(f"ожидалось одно из {values}, получено {value!r}")
+        return value
+    parse.__name__ = "choice"
+    return parse
+
+
+class Route:
+    __slots__ = ("prefix", "handler", "arg_types", "pass_update", "answer", "admin",
+                 "calls", "errors", "denied", "total_time", "max_time")
+
+    def __init__(self, prefix, handler, arg_types, pass_update, answer, admin):
+        self.prefix = prefix
+        self.handler = handler
+        self.arg_types = arg_types
+        self.pass_update = pass_update
+        self.answer = answer
+        self.admin = admin
+        self.calls = 0
+        self.errors = 0
+        self.denied = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def parse_args(self, raw_args):
+        if len(raw_args) != len(self.arg_types):
+            raise ValueError(f"{self.prefix}: ожидалось {len(self.arg_types)} аргументов, получено {len(raw_args)}")
+        return [arg_type(raw) for arg_type, raw in zip(self.arg_types, raw_args)]
+
+
+class CallbackRouter:
+    """Маршрутизация callback_data вида "префикс:арг1:арг2".
+
+    Маршрут ищется по префиксу в словаре за O(1), аргументы разбираются и
+    проверяются один раз — хендлер получает уже готовые значения.
+    """
+
+    def __init__(self):
+        self._routes = {}
+
+    def route(self, prefix, *arg_types, pass_update=False, answer=True, admin=False):
+        """Декоратор: регистрирует хендлер для callback_data с данным префиксом.
+
+        Хендлер вызывается как handler(query, context, *args), а с
+        pass_update=True — как handler(update, context, *args).
+        answer=False — хендлер сам отвечает на callback query.
+        admin=True — только для админа: callback_data присылает клиент, и
+        кнопку можно подделать, поэтому роль проверяется при каждом нажатии.
+        """
+        if ":" in prefix:
+            raise ValueError(f"Префикс маршрута не может содержать ':': {prefix}")
+        if prefix in self._routes:
+            raise ValueError(f"Маршрут {prefix} уже зарегистрирован")
+
+        def decorator(handler):
+            self._routes[prefix] = Route(prefix, handler, arg_types, pass_update, answer, admin)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """(маршрут, аргументы) или (None, None), если данные не распознаны"""
+        prefix, _, rest = (data or "").partition(":")
+        route = self._routes.get(prefix)
+        if route is None:
+            return None, None
+        try:
+            return route, route.parse_args(rest.split(":") if rest else [])
+        except ValueError as e:
+            log.warning("Некорректные callback_data %r: %s", data, e)
+            return None, None
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        route, args = self.resolve(query.data)
+        if route is None:
+            await query.answer()
+            return None
+
+        if route.admin and not await roles.is_admin(query.from_user.id):
+            route.denied += 1
+            log.warning("Пользователь %s без прав нажал %r", query.from_user.id, query.data)
+            await query.answer("У вас нет доступа к админ панели.", show_alert=True)
+            return None
+
+        if route.answer:
+            await query.answer()
+        target = update if route.pass_update else query
+
+        started = time.perf_counter()
+        route.calls += 1
+        try:
+            return await route.handler(target, context, *args)
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            route.total_time += elapsed
+            route.max_time = max(route.max_time, elapsed)
+
+    def label(self, update):
+        """Имя маршрута для метрик: callback:<префикс>"""
+        query = update.callback_query
+        if query is None:
+            return None
+        prefix = (query.data or "").partition(":")[0]
+        return f"callback:{prefix if prefix in self._routes else 'unknown'}"
+
+    def pattern(self, prefix):
+        return f"^{re.escape(prefix)}(:|$)"
+
+    def handler(self, prefix):
+        """CallbackQueryHandler для одного маршрута — для ConversationHandler"""
+        if prefix not in self._routes:
+            raise KeyError(f"Маршрут {prefix} не зарегистрирован")
+        return CallbackQueryHandler(self.dispatch, pattern=self.pattern(prefix))
+
+    def stats(self):
+        return {
+            prefix: {
+                "calls": route.calls,
+                "errors": route.errors,
+                "denied": route.denied,
+                "avg_ms": route.total_time / route.calls * 1000 if route.calls else 0.0,
+                "max_ms": route.max_time * 1000,
+            }
+            for prefix, route in self._routes.items()
+        }
+
+
+router = CallbackRouter()
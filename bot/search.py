@@ -0,0 +1,188 @@
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cached_property
+
+from sqlalchemy import text
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from db import AsyncSessionLocal
+from catalog import catalog
+from deadlines import format_deadline
+
+# Результатов на странице /find и в одном ответе на inline-запрос (максимум Telegram — 50)
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "8"))
+INLINE_PAGE_SIZE = int(os.getenv("INLINE_PAGE_SIZE", "20"))
+# Сколько разных страниц результатов держим в кэше
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+# Сколько совпадений полнотекстового поиска ранжируем
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "2000"))
+# Слов в запросе учитываем не больше
+MAX_QUERY_WORDS = 8
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+# Каждое слово — префикс: «сет» находит «сети» и «сетевой», пока запрос набирается.
+# Ранжируются не больше SEARCH_MAX_CANDIDATES совпадений: короткий запрос вроде
+# «лаб» совпадает почти со всем каталогом, а ts_rank считается для каждой строки.
+FULLTEXT_SQL = text("""
+    WITH q AS (SELECT to_tsquery('russian', :tsquery) AS query),
+    matches AS MATERIALIZED (
+        SELECT l.id, l.search_vector
+        FROM labs l, q
+        WHERE l.search_vector @@ q.query
+        LIMIT :candidates
+    )
+    SELECT l.id, l.title, s.name, l.deadline, l.deadline_text
+    FROM matches m
+    CROSS JOIN q
+    JOIN labs l ON l.id = m.id
+    JOIN subjects s ON s.id = l.subject_id
+    ORDER BY ts_rank(m.search_vector, q.query) DESC, l.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+# Опечатки: похожесть запроса на слово в названии лабораторной или предмета
+TRIGRAM_SQL = text("""
+    SELECT l.id, l.title, s.name, l.deadline, l.deadline_text
+    FROM labs l
+    JOIN subjects s ON s.id = l.subject_id
+    WHERE :query <% l.title
+       OR l.subject_id = ANY(ARRAY(SELECT id FROM subjects WHERE :query <% name))
+    ORDER BY greatest(word_similarity(:query, l.title), word_similarity(:query, s.name)) DESC, l.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    lab_id: int
+    title: str
+    subject: str
+    deadline: object
+    deadline_text: str
+
+    @property
+    def deadline_label(self):
+        return format_deadline(self.deadline, self.deadline_text)
+
+
+@dataclass(frozen=True)
+class SearchPage:
+    hits: tuple
+    offset: int
+    has_more: bool
+    fuzzy: bool  # результаты найдены по похожести, а не по словам
+
+    @property
+    def next_offset(self):
+        return self.offset + len(self.hits) if self.has_more else None
+
+    def text(self, query):
+        if not self.hits:
+            return f"🔎 По запросу «{query}» ничего не найдено."
+        header = f"🔎 Результаты по запросу «{query}»"
+        if self.fuzzy:
+            header += " (похожие)"
+        return header + ":"
+
+    # Страница живёт в кэше до смены версии каталога — кнопки строятся один раз
+    @cached_property
+    def keyboard(self):
+        keyboard = [
+            [InlineKeyboardButton(f"{hit.title} · {hit.subject}", callback_data=f"lab:{hit.lab_id}")]
+            for hit in self.hits
+        ]
+        mode = "f" if self.fuzzy else "w"
+        nav = []
+        if self.offset:
+            previous = max(0, self.offset - SEARCH_PAGE_SIZE)
+            nav.append(InlineKeyboardButton("⬅️", callback_data=f"find:{previous}:{mode}"))
+        if self.has_more:
+            nav.append(InlineKeyboardButton("➡️", callback_data=f"find:{self.next_offset}:{mode}"))
+        if nav:
+            keyboard.append(nav)
+        return InlineKeyboardMarkup(keyboard) if keyboard else None
+
+
+def normalize_query(query):
+    """Слова запроса в нижнем регистре; пунктуация и операторы tsquery отбрасываются"""
+    return " ".join(_WORD_RE.findall((query or "").lower())[:MAX_QUERY_WORDS])
+
+
+def _tsquery(normalized):
+    return " & ".join(f"{word}:*" for word in normalized.split())
+
+
+class LabSearch:
+    """Поиск лабораторных по названию, описанию и предмету.
+
+    Сначала полнотекстовый поиск по labs.search_vector (GIN); если по
+    словам ничего не нашлось — поиск по триграммам с учётом опечаток.
+    Страницы результатов кэшируются до следующего изменения каталога:
+    в ключе кэша версия catalog.
+    """
+
+    def __init__(self):
+        # (версия каталога, запрос, fuzzy, offset, size) -> SearchPage
+        self._pages = OrderedDict()
+        self._version = catalog.version
+        self._trigram = None
+        self.hits = 0
+        self.misses = 0
+
+    async def search(self, query, offset=0, size=SEARCH_PAGE_SIZE, fuzzy=False):
+        """Страница результатов; fuzzy=True — продолжение выдачи по триграммам"""
+        normalized = normalize_query(query)
+        if not normalized:
+            return SearchPage((), offset, False, fuzzy)
+
+        if self._version != catalog.version:
+            # Каталог изменился — старые результаты больше не нужны
+            self._version = catalog.version
+            self._pages.clear()
+        key = (catalog.version, normalized, fuzzy, offset, size)
+        page = self._pages.get(key)
+        if page is not None:
+            self.hits += 1
+            self._pages.move_to_end(key)
+            return page
+
+        self.misses += 1
+        version = catalog.version
+        async with AsyncSessionLocal() as session:
+            if not fuzzy:
+                rows = await self._fetch(session, FULLTEXT_SQL, {"tsquery": _tsquery(normalized), "candidates": SEARCH_MAX_CANDIDATES}, offset, size)
+            if (fuzzy or (not rows and offset == 0)) and await self._has_trigram(session):
+                fuzzy = True
+                rows = await self._fetch(session, TRIGRAM_SQL, {"query": normalized}, offset, size)
+            elif fuzzy:
+                rows = []
+
+        page = SearchPage(
+            tuple(SearchHit(*row) for row in rows[:size]), offset, len(rows) > size, fuzzy
+        )
+        if version == catalog.version:
+            self._pages[key] = page
+            while len(self._pages) > SEARCH_CACHE_SIZE:
+                self._pages.popitem(last=False)
+        return page
+
+    async def _fetch(self, session, statement, params, offset, size):
+        # Лишняя строка показывает, есть ли следующая страница, — без COUNT(*)
+        result = await session.execute(statement, {**params, "limit": size + 1, "offset": offset})
+        return [tuple(row) for row in result.all()]
+
+    async def _has_trigram(self, session):
+        if self._trigram is None:
+            self._trigram = bool(await session.scalar(
+                text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            ))
+        return self._trigram
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "pages_cached": len(self._pages)}
+
+
+lab_search = LabSearch()
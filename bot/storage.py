@@ -0,0 +1,171 @@
+import hashlib
+import os
+import uuid
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from bot_api import api_request
+from db import AsyncSessionLocal
+from models import FileBlob
+
+# Директория для файлов
+UPLOAD_DIR = "/app/lab_files"
+# Файлы хранятся по SHA-256 содержимого: objects/ab/cd/abcd...
+OBJECTS_DIR = os.path.join(UPLOAD_DIR, "objects")
+STAGING_DIR = os.path.join(UPLOAD_DIR, "staging")
+# Размер куска при потоковом скачивании
+DOWNLOAD_CHUNK = 256 * 1024
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def blob_path(sha256):
+    return os.path.join(OBJECTS_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+class HashingWriter:
+    """Пишет файл кусками во временный файл и на лету считает SHA-256.
+
+    Целиком в памяти файл не держится; при превышении max_size запись
+    обрывается исключением FileTooLarge.
+    """
+
+    def __init__(self, max_size=None):
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        self.tmp_path = os.path.join(STAGING_DIR, f"{uuid.uuid4()}.part")
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = open(self.tmp_path, "wb")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise FileTooLarge(f"файл больше {self.max_size} байт")
+        self._hash.update(data)
+        self._file.write(data)
+        return len(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def commit(self, path):
+        """Атомарно переносит файл на место (rename); если такое содержимое уже есть — удаляет копию"""
+        self._file.close()
+        if os.path.exists(path):
+            os.remove(self.tmp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.tmp_path, path)
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+async def _download(file, writer):
+    if file.file_path and file.file_path.startswith(("http://", "https://")):
+        # Через пул для файлов: скачивание не занимает соединения ответов на кнопки
+        async with api_request.stream(file.file_path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK):
+                writer.write(chunk)
+    else:
+        # Локальный сервер Bot API отдаёт путь к файлу на диске
+        await file.download_to_memory(writer)
+
+
+async def find_blob_by_unique_id(file_unique_id):
+    if not file_unique_id:
+        return None
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(
+            select(FileBlob).where(FileBlob.tg_file_unique_id == file_unique_id).limit(1)
+        )
+
+
+async def register_blob(sha256, path, size, file_unique_id):
+    """Запись о содержимом; ref_count растёт, когда файл привязывают к лабораторной.
+
+    Повторная загрузка того же содержимого обновляет used_at: пока диалог
+    добавления лабораторной не закончен, ссылок на файл нет, и сборщик
+    мусора отсчитывает срок хранения от последней загрузки.
+    """
+    stmt = insert(FileBlob).values(
+        sha256=sha256, path=path, size=size, tg_file_unique_id=file_unique_id, used_at=datetime.utcnow()
+    )
+    async with AsyncSessionLocal() as session:
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[FileBlob.sha256], set_={"used_at": stmt.excluded.used_at}
+        ))
+        await session.commit()
+
+
+async def touch_blobs(hashes):
+    """Обновляет used_at у содержимого; возвращает хэши, которые ещё хранятся"""
+    if not hashes:
+        return set()
+    async with AsyncSessionLocal() as session:
+        rows = await session.scalars(
+            update(FileBlob).where(FileBlob.sha256.in_(hashes))
+            .values(used_at=datetime.utcnow()).returning(FileBlob.sha256)
+        )
+        touched = set(rows.all())
+        await session.commit()
+    return touched
+
+
+async def store_telegram_file(bot, file_id, file_unique_id, max_size=None):
+    """Сохраняет файл из Telegram в хранилище без дублей.
+
+    Возвращает (sha256, path, size). Файл скачивается потоком прямо на
+    диск; если такое содержимое уже есть, копия не сохраняется.
+    """
+    # Telegram уже сообщает, что это тот же файл — не скачиваем вовсе
+    blob = await find_blob_by_unique_id(file_unique_id)
+    if blob and os.path.exists(blob.path):
+        await register_blob(blob.sha256, blob.path, blob.size, file_unique_id)
+        return blob.sha256, blob.path, blob.size
+
+    file = await bot.get_file(file_id)
+    if max_size and file.file_size and file.file_size > max_size:
+        raise FileTooLarge(f"файл больше {max_size} байт")
+
+    writer = HashingWriter(max_size)
+    try:
+        await _download(file, writer)
+        sha256 = writer.hexdigest()
+        path = blob_path(sha256)
+        writer.commit(path)
+    except BaseException:
+        writer.discard()
+        raise
+
+    await register_blob(sha256, path, writer.size, file_unique_id)
+    return sha256, path, writer.size
+
+
+async def download_to_staging(bot, file_id, name, max_size=None):
+    """Скачивает файл из Telegram потоком в staging/<name>, минуя хранилище.
+
+    Для файлов, которые нужны только на время операции (импорт каталога);
+    удаляет их тот, кто скачал.
+    """
+    file = await bot.get_file(file_id)
+    if max_size and file.file_size and file.file_size > max_size:
+        raise FileTooLarge(f"файл больше {max_size} байт")
+
+    writer = HashingWriter(max_size)
+    path = os.path.join(STAGING_DIR, name)
+    try:
+        await _download(file, writer)
+        writer.commit(path)
+    except BaseException:
+        writer.discard()
+        raise
+    return path
@@ -0,0 +1,102 @@
+import os
+from collections import OrderedDict
+
+from sqlalchemy import and_, delete, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+
+from coordination import coordinator
+from db import AsyncSessionLocal
+from models import Subscription, User
+
+# Для скольких пользователей держим набор подписок в памяти
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "10000"))
+
+
+class SubscriptionCache:
+    """Подписки пользователей на предметы: LRU tg_id -> frozenset(subject_id).
+
+    Набор читается одним запросом по индексу (user_id, subject_id) и
+    обновляется в toggle(); другие реплики узнают об изменении через
+    событие "subscription".
+    """
+
+    def __init__(self, max_size=SUBSCRIPTION_CACHE_SIZE):
+        self.max_size = max_size
+        self._subjects = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, tg_id, subjects):
+        self._subjects[tg_id] = subjects
+        self._subjects.move_to_end(tg_id)
+        while len(self._subjects) > self.max_size:
+            self._subjects.popitem(last=False)
+
+    async def subjects(self, tg_id):
+        """id предметов, на которые подписан пользователь"""
+        subjects = self._subjects.get(tg_id)
+        if subjects is not None:
+            self.hits += 1
+            self._subjects.move_to_end(tg_id)
+            return subjects
+
+        self.misses += 1
+        async with AsyncSessionLocal() as session:
+            rows = await session.scalars(
+                select(Subscription.subject_id)
+                .join(User, User.id == Subscription.user_id)
+                .where(User.tg_id == tg_id)
+            )
+            subjects = frozenset(rows.all())
+        self._remember(tg_id, subjects)
+        return subjects
+
+    async def is_subscribed(self, tg_id, subject_id):
+        return subject_id in await self.subjects(tg_id)
+
+    async def toggle(self, tg_id, subject_id):
+        """Подписывает или отписывает; возвращает True, если теперь подписан"""
+        subjects = await self.subjects(tg_id)
+        subscribe = subject_id not in subjects
+        user_id = select(User.id).where(User.tg_id == tg_id).scalar_subquery()
+        async with AsyncSessionLocal() as session:
+            if subscribe:
+                # Подписка ссылается на users.id, а пользователь мог не нажимать /start
+                await session.execute(
+                    insert(User).values(tg_id=tg_id).on_conflict_do_nothing(index_elements=[User.tg_id])
+                )
+                await session.execute(
+                    insert(Subscription)
+                    .from_select(["subject_id", "user_id"], select(literal(subject_id), user_id))
+                    .on_conflict_do_nothing()
+                )
+            else:
+                await session.execute(
+                    delete(Subscription).where(
+                        and_(Subscription.subject_id == subject_id, Subscription.user_id == user_id)
+                    )
+                )
+            await coordinator.publish(session, "subscription", tg_id=tg_id)
+            await session.commit()
+        self._remember(tg_id, subjects | {subject_id} if subscribe else subjects - {subject_id})
+        return subscribe
+
+    async def count(self, subject_id):
+        """Число подписчиков предмета (index-only scan по первичному ключу)"""
+        async with AsyncSessionLocal() as session:
+            return await session.scalar(
+                select(func.count()).select_from(Subscription).where(Subscription.subject_id == subject_id)
+            )
+
+    def forget(self, tg_id=None):
+        """Сбрасывает подписки одного пользователя (или всех)"""
+        if tg_id is None:
+            self._subjects.clear()
+        else:
+            self._subjects.pop(tg_id, None)
+
+    def stats(self):
+        return {"size": len(self._subjects), "hits": self.hits, "misses": self.misses}
+
+
+subscriptions = SubscriptionCache()
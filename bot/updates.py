@@ -0,0 +1,61 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов с очередью внутри одного чата.
+
+    Апдейты разных чатов обрабатываются одновременно, а апдейты одного чата —
+    строго по порядку. Так шаги ConversationHandler и user_data одного
+    пользователя не гоняются друг с другом.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._waiters = {}
+
+    @staticmethod
+    def _chat_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # Очередь чата — до общего семафора: ждущие апдейты одного чата
+        # не занимают слоты concurrent_updates, и остальные чаты не стоят
+        key = self._chat_key(update)
+        if key is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            # Замок больше никому не нужен — убираем, чтобы словарь не рос
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,91 @@
+import os
+from collections import OrderedDict
+
+from sqlalchemy import literal_column, select
+from sqlalchemy.dialects.postgresql import insert
+
+from coordination import coordinator
+from db import AsyncSessionLocal
+from models import User
+
+# Сколько пользователей держим в кэше ролей
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", "10000"))
+# Метка в кэше: строки в users нет. is_admin() отвечает «не админ»,
+# а register() всё равно делает INSERT
+UNREGISTERED = object()
+
+
+class RoleCache:
+    """Ограниченный LRU-кэш tg_id -> is_admin.
+
+    Роль меняется только через register(), поэтому кэш обновляется там же,
+    а не по таймеру. Промах — один SELECT по уникальному индексу tg_id.
+    """
+
+    def __init__(self, max_size=ROLE_CACHE_SIZE):
+        self.max_size = max_size
+        self._roles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, tg_id, is_admin):
+        self._roles[tg_id] = is_admin
+        self._roles.move_to_end(tg_id)
+        while len(self._roles) > self.max_size:
+            self._roles.popitem(last=False)
+
+    async def register(self, tg_id, is_admin):
+        """Регистрирует пользователя или обновляет его роль одним запросом.
+
+        Если пользователь уже в кэше с той же ролью, запроса в БД нет вовсе.
+        Метка UNREGISTERED с ролью не совпадает — строка будет вставлена.
+        """
+        if self._roles.get(tg_id) == is_admin:
+            self.hits += 1
+            self._roles.move_to_end(tg_id)
+            return
+
+        self.misses += 1
+        stmt = insert(User).values(tg_id=tg_id, is_admin=is_admin)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.tg_id],
+            set_={"is_admin": stmt.excluded.is_admin},
+            # Строка не переписывается, если роль не изменилась
+            where=User.is_admin.is_distinct_from(stmt.excluded.is_admin)
+        ).returning(literal_column("xmax = 0"))
+        async with AsyncSessionLocal() as session:
+            # Строка вернулась — пользователь добавлен (xmax = 0) или его роль изменилась
+            inserted = (await session.execute(stmt)).scalar()
+            # Другие реплики могли закэшировать старую роль (или «не админ» для нового)
+            if inserted is False or (inserted and is_admin):
+                await coordinator.publish(session, "role", tg_id=tg_id)
+            await session.commit()
+        self._remember(tg_id, is_admin)
+
+    async def is_admin(self, tg_id):
+        is_admin = self._roles.get(tg_id)
+        if is_admin is not None:
+            self.hits += 1
+            self._roles.move_to_end(tg_id)
+            return is_admin is True
+
+        self.misses += 1
+        async with AsyncSessionLocal() as session:
+            is_admin = await session.scalar(select(User.is_admin).where(User.tg_id == tg_id))
+        # Незарегистрированный пользователь — не админ; кэшируем метку, а не False,
+        # иначе register() принял бы его за уже записанного
+        self._remember(tg_id, UNREGISTERED if is_admin is None else is_admin)
+        return bool(is_admin)
+
+    def forget(self, tg_id=None):
+        """Сбрасывает роль одного пользователя (или всех)"""
+        if tg_id is None:
+            self._roles.clear()
+        else:
+            self._roles.pop(tg_id, None)
+
+    def stats(self):
+        return {"size": len(self._roles), "hits": self.hits, "misses": self.misses}
+
+
+roles = RoleCache()
@@ -0,0 +1,89 @@
+import html
+import logging
+
+from telegram import MessageEntity
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+
+log = logging.getLogger(__name__)
+
+
+# Сущности, которые Telegram расставляет сам, а не по разметке бота
+AUTO_ENTITIES = {
+    MessageEntity.URL, MessageEntity.MENTION, MessageEntity.HASHTAG, MessageEntity.CASHTAG,
+    MessageEntity.BOT_COMMAND, MessageEntity.EMAIL, MessageEntity.PHONE_NUMBER,
+}
+
+
+def normalize(text):
+    """Текст в том виде, в каком его хранит Telegram: без &quot; и &#x27;
+    (text_html их не экранирует) и без пробелов и переводов строк по краям"""
+    return html.unescape(text).strip()
+
+
+def shown_text(message, parse_mode=None):
+    """Текст сообщения в той же разметке, в какой его отправил бы edit(); None — сравнить нельзя"""
+    if message is None or message.text is None:
+        return None
+    if parse_mode is None:
+        # Без разметки сравнимо только сообщение без оформления
+        if any(entity.type not in AUTO_ENTITIES for entity in message.entities):
+            return None
+        return message.text
+    if parse_mode == ParseMode.HTML:
+        return message.text_html
+    return None
+
+
+def is_shown(message, text, reply_markup=None, parse_mode=None):
+    """Показывает ли сообщение уже этот текст и эти кнопки"""
+    shown = shown_text(message, parse_mode)
+    if shown is None or message.reply_markup != reply_markup:
+        return False
+    if parse_mode is None:
+        return shown.strip() == text.strip()
+    return normalize(shown) == normalize(text)
+
+
+class MessageViews:
+    """Правки сообщений с inline-кнопками без лишних запросов к Telegram.
+
+    С каждым нажатием кнопки Telegram присылает само сообщение — его текст
+    и клавиатуру. edit() сравнивает с ними новый экран и не вызывает API,
+    если показано то же самое (повторное нажатие, «Назад» на тот же экран).
+    Своего состояния нет, поэтому правки с другой реплики или до рестарта
+    не сбивают сравнение. Если сравнить нельзя (inline-сообщение, другая
+    разметка), ответ «message is not modified» считается тем же пропуском.
+    """
+
+    def __init__(self):
+        self.edits = 0
+        self.skipped = 0
+        self.not_modified = 0
+
+    async def edit(self, query, text, reply_markup=None, parse_mode=None):
+        """Правит сообщение с кнопкой; возвращает False, если правка не понадобилась"""
+        if is_shown(query.message, text, reply_markup, parse_mode):
+            self.skipped += 1
+            return False
+
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+            self.not_modified += 1
+            log.debug("Сообщение %s уже показывает этот экран", query.inline_message_id or query.message.message_id)
+            return False
+        self.edits += 1
+        return True
+
+    def stats(self):
+        return {
+            "edits_total": self.edits,
+            "skipped_total": self.skipped,
+            "not_modified_total": self.not_modified,
+        }
+
+
+views = MessageViews()
@@ -0,0 +1,32 @@
+import html
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from catalog import MESSAGE_LIMIT, digest_pages, escape_limited  # noqa: E402
+
+
+def test_escape_limited_does_not_cut_entities():
+    text = '"&<>' * 1000
+    escaped = escape_limited(text, 100)
+    assert len(escaped) <= 100
+    assert escaped.endswith("…")
+    assert html.unescape(escaped[:-1]) == text[:len(html.unescape(escaped[:-1]))]
+    assert escape_limited("short & sweet", 100) == "short &amp; sweet"
+
+
+def test_digest_pages_split_between_lines():
+    labs = [SimpleNamespace(title="&<" * 5000, deadline_label=None)]
+    labs += [SimpleNamespace(title=f"Лаба {i} & отчёт", deadline_label="01.01.2025 23:59") for i in range(400)]
+    snapshot = SimpleNamespace(subjects=[SimpleNamespace(name="Сети & <b>" * 1000, labs=labs)])
+
+    pages = digest_pages(snapshot)
+    assert len(pages) > 1
+    for page in pages:
+        assert len(page) <= MESSAGE_LIMIT
+        assert page.count("<b>") == page.count("</b>")
+        # Ни одна сущность не обрезана посередине
+        assert not re.search(r"&[a-z]*(?![a-z;])", page)
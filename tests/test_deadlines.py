@@ -0,0 +1,53 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from deadlines import BOT_TIMEZONE, parse_deadline  # noqa: E402
+
+NOW = datetime(2024, 12, 10, 12, 0, tzinfo=BOT_TIMEZONE)
+
+
+def at(year, month, day, hour=23, minute=59):
+    return datetime(year, month, day, hour, minute, tzinfo=BOT_TIMEZONE)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2025-03-15", at(2025, 3, 15)),
+    ("2025-03-15 18:30", at(2025, 3, 15, 18, 30)),
+    ("2025-03-15T18:30", at(2025, 3, 15, 18, 30)),
+    ("15.03.2025", at(2025, 3, 15)),
+    ("15/03/2025 9:05", at(2025, 3, 15, 9, 5)),
+    ("до 15.03.2025 18:00", at(2025, 3, 15, 18, 0)),
+    ("15.03.25", at(2025, 3, 15)),
+    ("  15.03.2025.  ", at(2025, 3, 15)),
+])
+def test_explicit_dates(text, expected):
+    assert parse_deadline(text, now=NOW) == expected
+
+
+def test_without_year_uses_nearest_future_date():
+    assert parse_deadline("20.12", now=NOW) == at(2024, 12, 20)
+    # 15 января уже прошло в 2024 — значит, следующий год
+    assert parse_deadline("15.01", now=NOW) == at(2025, 1, 15)
+    assert parse_deadline("29.02", now=NOW) == at(2028, 2, 29)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    None,
+    "завтра",
+    "1.2.202",
+    "15.03.20255",
+    "31.02.2025",
+    "32.01.2025",
+    "15.13.2025",
+    "2025-02-30",
+    "15.03.2025 25:00",
+    "лаба 3.2, сдать 20.12",
+])
+def test_invalid(text):
+    assert parse_deadline(text, now=NOW) is None
@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from deadlines import BOT_TIMEZONE  # noqa: E402
+from importer import CatalogImportError, errors_text, parse_file  # noqa: E402
+
+
+@pytest.fixture
+def write(tmp_path):
+    def write(name, content, encoding="utf-8"):
+        path = tmp_path / name
+        path.write_bytes(content.encode(encoding) if isinstance(content, str) else content)
+        return str(path)
+    return write
+
+
+def labs(parsed):
+    return [(subject, title, desc) for _, subject, title, desc, _ in parsed.rows]
+
+
+@pytest.mark.parametrize("delimiter", [",", ";"])
+def test_csv(write, delimiter):
+    content = "\n".join(delimiter.join(row) for row in [
+        ("subject", "title", "desc", "deadline"),
+        ("Сети", "VLAN", "Отчёт", "01.03.2099"),
+        ("Сети", "OSPF", "", "-"),
+    ])
+    parsed = parse_file(write("labs.csv", content))
+    assert parsed.errors == []
+    assert parsed.columns == {"subject", "title", "desc", "deadline"}
+    assert labs(parsed) == [("Сети", "VLAN", "Отчёт"), ("Сети", "OSPF", None)]
+    number, *_, deadline = parsed.rows[0]
+    assert number == 2
+    assert (deadline.year, deadline.month, deadline.day, deadline.tzinfo) == (2099, 3, 1, BOT_TIMEZONE)
+    assert parsed.rows[1][4] is None
+
+
+def test_csv_russian_headers_and_bom(write):
+    content = "\ufeffПредмет;Название;Срок\nБазы данных;Индексы;нет\n"
+    parsed = parse_file(write("labs.csv", content))
+    assert parsed.columns == {"subject", "title", "deadline"}
+    assert labs(parsed) == [("Базы данных", "Индексы", None)]
+
+
+def test_json_rows_and_tree(write):
+    rows = [{"subject": "Сети", "title": "VLAN"}, {"предмет": "ОС", "название": "Процессы", "описание": "fork"}]
+    parsed = parse_file(write("labs.json", json.dumps(rows)))
+    assert labs(parsed) == [("Сети", "VLAN", None), ("ОС", "Процессы", "fork")]
+
+    tree = {"subjects": [
+        {"name": "Сети", "labs": [{"title": "VLAN"}, {"title": "OSPF", "deadline": "2099-03-01"}]},
+        {"name": "ОС", "labs": "не список"},
+    ]}
+    parsed = parse_file(write("tree.json", json.dumps(tree)))
+    assert labs(parsed) == [("Сети", "VLAN", None), ("Сети", "OSPF", None)]
+    assert parsed.errors == [(3, "ожидается объект с полями")]
+
+
+def test_jsonl(write):
+    content = '{"subject": "Сети", "title": "VLAN"}\n\n{"subject": "Сети"\n[1]\n{"subject": "ОС", "title": "fork"}\n'
+    parsed = parse_file(write("labs.jsonl", content))
+    assert labs(parsed) == [("Сети", "VLAN", None), ("ОС", "fork", None)]
+    assert [number for number, _ in parsed.errors] == [3, 4]
+    assert parsed.rows[1][0] == 5
+
+
+def test_bad_rows_are_reported_with_line_numbers(write):
+    content = "\n".join([
+        "subject,title,deadline",
+        "Сети,VLAN,01.03.2099",
+        ",Без предмета,",
+        "Сети,OSPF,когда-нибудь",
+        "Сети,VLAN,",
+    ])
+    parsed = parse_file(write("labs.csv", content))
+    assert labs(parsed) == [("Сети", "VLAN", None)]
+    assert parsed.errors == [
+        (3, "не указаны предмет или название"),
+        (4, "не удалось распознать дедлайн «когда-нибудь»"),
+        (5, "повтор строки 2: Сети — VLAN"),
+    ]
+    assert "строка 4: не удалось распознать дедлайн" in errors_text(parsed.errors)
+
+
+@pytest.mark.parametrize("name, content", [
+    ("labs.csv", "subject,desc\nСети,VLAN\n"),
+    ("labs.csv", "subject,title\n"),
+    ("labs.json", "{not json"),
+    ("labs.json", '{"labs": []}'),
+    ("labs.csv", "subject,title\nСети,VLAN\n".encode("cp1251")),
+])
+def test_unreadable_files(write, name, content):
+    with pytest.raises(CatalogImportError):
+        parse_file(write(name, content))
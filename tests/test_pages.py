@@ -0,0 +1,138 @@
+import asyncio
+import operator
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+import catalog  # noqa: E402
+from catalog import load_page, page_callback, page_cursor, page_list  # noqa: E402
+
+
+class Column:
+    """Столбец id: условия и сортировка записываются, а не компилируются в SQL"""
+
+    def __gt__(self, key):
+        return operator.gt, key
+
+    def __lt__(self, key):
+        return operator.lt, key
+
+    def desc(self):
+        return "desc"
+
+
+class Query:
+    def __init__(self, where=None, desc=False, limit=None):
+        self.where_, self.desc_, self.limit_ = where, desc, limit
+
+    def where(self, condition):
+        return Query(condition, self.desc_, self.limit_)
+
+    def order_by(self, order):
+        return Query(self.where_, order == "desc", self.limit_)
+
+    def limit(self, limit):
+        return Query(self.where_, self.desc_, limit)
+
+
+class Session:
+    """Таблица в памяти вместо БД; запоминает выполненные запросы"""
+
+    def __init__(self, ids, subject="Сети"):
+        self.ids = ids
+        self.subject = subject
+        self.queries = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query):
+        self.queries.append(query)
+        compare, key = query.where_
+        ids = sorted((i for i in self.ids if compare(i, key)), reverse=query.desc_)
+        rows = [(i, f"Предмет {i}") for i in ids[:query.limit_]]
+        return type("Result", (), {"all": lambda self: rows})()
+
+    async def scalar(self, query):
+        return self.subject
+
+
+@pytest.fixture
+def table(monkeypatch):
+    session = Session(list(range(1, 26)))
+    monkeypatch.setattr(catalog, "AsyncSessionLocal", lambda: session)
+    monkeypatch.setattr(catalog, "_page_query", lambda kind, scope: (Query(), Column()))
+    return session
+
+
+def ids(page):
+    return [row_id for row_id, _ in page.rows]
+
+
+def test_route_arguments():
+    assert page_list("l12") == ("l", 12)
+    assert page_list("s") == ("s", 0)
+    for bad in ("x", "l1a", "", "ll"):
+        with pytest.raises(ValueError):
+            page_list(bad)
+
+    assert page_cursor("") == ""
+    assert page_cursor(">10") == ">10"
+    assert page_cursor("<3") == "<3"
+    for bad in (">", "10", ">-1", "<1>"):
+        with pytest.raises(ValueError):
+            page_cursor(bad)
+
+    assert page_callback("s") == "pg:s:"
+    assert page_callback("l", 12, ">30") == "pg:l12:>30"
+
+
+def test_forward_pages(table):
+    first = asyncio.run(load_page("s", size=10))
+    assert ids(first) == list(range(1, 11))
+    assert first.prev_cursor is None and first.next_cursor == ">10"
+    # Лишняя строка запрашивается только как признак следующей страницы
+    assert table.queries[-1].limit_ == 11
+
+    second = asyncio.run(load_page("s", cursor=first.next_cursor, size=10))
+    assert ids(second) == list(range(11, 21))
+    assert (second.prev_cursor, second.next_cursor) == ("<11", ">20")
+
+    last = asyncio.run(load_page("s", cursor=second.next_cursor, size=10))
+    assert ids(last) == list(range(21, 26))
+    assert (last.prev_cursor, last.next_cursor) == ("<21", None)
+
+
+def test_backward_pages(table):
+    page = asyncio.run(load_page("s", cursor="<21", size=10))
+    assert ids(page) == list(range(11, 21))
+    assert (page.prev_cursor, page.next_cursor) == ("<11", ">20")
+
+    first = asyncio.run(load_page("s", cursor=page.prev_cursor, size=10))
+    assert ids(first) == list(range(1, 11))
+    assert (first.prev_cursor, first.next_cursor) == (None, ">10")
+
+
+def test_empty_page_restarts_from_first(table):
+    table.ids = [1, 2, 3]
+    page = asyncio.run(load_page("s", cursor=">50", size=10))
+    assert ids(page) == [1, 2, 3]
+    assert (page.prev_cursor, page.next_cursor) == (None, None)
+    assert len(table.queries) == 2
+
+
+def test_missing_subject(table):
+    table.subject = None
+    page = asyncio.run(load_page("l", scope=7))
+    assert not page.found and page.rows == ()
+
+    table.subject = "Сети"
+    page = asyncio.run(load_page("l", scope=7, size=30))
+    assert page.found and page.subject == "Сети"
+    assert page.text.startswith("📚 Сети")
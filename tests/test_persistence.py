@@ -0,0 +1,150 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+import persistence  # noqa: E402
+from persistence import PostgresPersistence  # noqa: E402
+
+
+class Session:
+    """Вместо БД: запоминает выполненные запросы, по флагу падает на commit"""
+
+    def __init__(self):
+        self.executed = []
+        self.commits = 0
+        self.fail = False
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt, params=None):
+        self.executed.append((stmt.__visit_name__, params))
+
+    async def commit(self):
+        if self.fail:
+            raise ConnectionError("db is down")
+        self.commits += 1
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = Session()
+    monkeypatch.setattr(persistence, "AsyncSessionLocal", session)
+    return session
+
+
+def test_writes_are_coalesced(session):
+    store = PostgresPersistence(flush_delay=0)
+
+    async def scenario():
+        await store.update_user_data(1, {"step": 1})
+        await store.update_user_data(1, {"step": 2})
+        await store.update_user_data(2, {"step": 1})
+        await store.update_conversation("add_lab", (1, 1), 3)
+        # Буфер пишется фоновой задачей одной транзакцией
+        await store._writer
+
+    asyncio.run(scenario())
+    assert session.commits == 1
+    assert len(session.executed) == 1
+    kind, rows = session.executed[0]
+    assert kind == "insert"
+    assert {(row["kind"], row["key"]): row["data"] for row in rows} == {
+        ("user", "1"): {"step": 2},
+        ("user", "2"): {"step": 1},
+        ("conv:add_lab", "[1, 1]"): 3,
+    }
+    assert store.stats() == {"pending": 0, "writes": 1, "rows_written": 3, "coalesced": 1, "skipped": 0}
+
+
+def test_unchanged_data_is_not_written(session):
+    store = PostgresPersistence()
+
+    async def scenario():
+        await store.update_user_data(1, {"step": 1})
+        await store.flush()
+        await store.update_user_data(1, {"step": 1})
+        # Пустой user_data того, кого нет в БД, — тоже не запись
+        await store.update_user_data(2, {})
+        # Изменение, вернувшееся к записанному значению, отменяет запись
+        await store.update_user_data(1, {"step": 2})
+        await store.update_user_data(1, {"step": 1})
+        await store.flush()
+
+    asyncio.run(scenario())
+    assert session.commits == 1
+    assert store.stats()["skipped"] == 3
+    assert store.stats()["pending"] == 0
+
+
+def test_snapshot_is_taken_at_staging(session):
+    store = PostgresPersistence()
+    data = {"step": 1}
+
+    async def scenario():
+        await store.update_user_data(1, data)
+        data["step"] = 2
+        await store.flush()
+
+    asyncio.run(scenario())
+    assert session.executed[0][1][0]["data"] == {"step": 1}
+
+
+def test_deletes(session):
+    store = PostgresPersistence()
+
+    async def scenario():
+        await store.update_user_data(1, {"step": 1})
+        await store.update_conversation("add_lab", (1, 1), 3)
+        await store.flush()
+        await store.drop_user_data(1)
+        await store.update_conversation("add_lab", (1, 1), None)
+        await store.flush()
+
+    asyncio.run(scenario())
+    assert [kind for kind, _ in session.executed] == ["insert", "delete"]
+    assert store._stored == {}
+
+
+def test_failed_write_is_retried_with_newer_values(session):
+    store = PostgresPersistence()
+
+    async def scenario():
+        await store.update_user_data(1, {"step": 1})
+        await store.update_user_data(2, {"step": 1})
+        session.fail = True
+        with pytest.raises(ConnectionError):
+            await store.flush()
+        assert store.stats()["pending"] == 2
+
+        # Новое значение, пришедшее после сбоя, не затирается старым
+        await store.update_user_data(1, {"step": 2})
+        session.fail = False
+        await store.flush()
+
+    asyncio.run(scenario())
+    rows = session.executed[-1][1]
+    assert {row["key"]: row["data"] for row in rows} == {"1": {"step": 2}, "2": {"step": 1}}
+    assert store.stats()["pending"] == 0
+
+
+def test_unserializable_data_is_skipped(session):
+    store = PostgresPersistence()
+
+    async def scenario():
+        await store.update_user_data(1, {"file": object()})
+        await store.flush()
+
+    asyncio.run(scenario())
+    assert session.executed == []
+    assert store.stats()["pending"] == 0
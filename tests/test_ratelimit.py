@@ -0,0 +1,164 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import RetryAfter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+import ratelimit  # noqa: E402
+from ratelimit import BotApiRateLimiter, PerChatLimiter, TokenBucket  # noqa: E402
+
+
+class Clock:
+    """Время, которое идёт только во время sleep: ожидания считаются, а не ждутся"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(ratelimit, "asyncio", SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep))
+    monkeypatch.setattr(ratelimit, "random", SimpleNamespace(uniform=lambda low, high: 0.0))
+    return clock
+
+
+def test_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    async def scenario():
+        for _ in range(3):
+            await bucket.acquire()
+        assert clock.sleeps == []
+        await bucket.acquire()
+        await bucket.acquire()
+
+    asyncio.run(scenario())
+    assert clock.sleeps == [0.5, 0.5]
+    assert clock.now == 1.0
+
+
+def test_refill_is_capped(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    async def scenario():
+        for _ in range(3):
+            await bucket.acquire()
+        clock.now += 1
+        await bucket.acquire()
+        await bucket.acquire()
+        assert clock.sleeps == []
+        # Долгий простой не копит больше capacity
+        clock.now += 100
+        for _ in range(4):
+            await bucket.acquire()
+
+    asyncio.run(scenario())
+    assert clock.sleeps == [0.5]
+
+
+def test_pause_blocks_acquire(clock):
+    bucket = TokenBucket(rate=10)
+
+    async def scenario():
+        bucket.pause(5)
+        bucket.pause(1)  # более короткая пауза не сокращает уже заданную
+        await bucket.acquire()
+
+    asyncio.run(scenario())
+    assert clock.sleeps == [5]
+
+
+def test_idle_buckets_are_evicted(clock):
+    limiter = PerChatLimiter(rate=1, capacity=2, max_chats=2)
+
+    async def scenario():
+        await limiter.acquire(1)
+        await limiter.acquire(2)
+        assert not limiter.bucket(1).is_idle()
+        clock.now += 1
+        # Чат 1 полностью восстановился, чат 2 — нет: вытесняется только первый
+        limiter.bucket(2).tokens = 0
+        limiter.bucket(3)
+
+    asyncio.run(scenario())
+    assert set(limiter._buckets) == {2, 3}
+
+
+def call(limiter, endpoint, data, results=None, rate_limit_args=None):
+    results = list(results or [])
+    calls = []
+
+    async def callback():
+        calls.append(endpoint)
+        result = results.pop(0) if results else True
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def scenario():
+        return await limiter.process_request(callback, (), {}, endpoint, data, rate_limit_args)
+
+    return asyncio.run(scenario()), calls
+
+
+def test_only_sends_wait_for_the_chat(clock):
+    limiter = BotApiRateLimiter(rate=100)
+    for _ in range(5):
+        call(limiter, "editMessageText", {"chat_id": 1})
+    assert clock.sleeps == []
+    assert 1 not in limiter.chats._buckets
+
+    for _ in range(4):
+        call(limiter, "sendMessage", {"chat_id": 1})
+    # Всплеск BOT_API_CHAT_BURST, дальше — по BOT_API_CHAT_RATE
+    assert len(clock.sleeps) == 1
+
+    # Без chat_id — без ожидания и без учёта в limited_total
+    call(limiter, "answerCallbackQuery", {"callback_query_id": "1"})
+    assert limiter.stats()["limited_total"] == 9
+
+
+def test_retry_after_pauses_only_the_chat(clock):
+    limiter = BotApiRateLimiter(rate=100)
+    result, calls = call(limiter, "sendMessage", {"chat_id": 1}, [RetryAfter(3), "ok"])
+    assert (result, calls) == ("ok", ["sendMessage", "sendMessage"])
+    assert limiter.chats.bucket(1).blocked_until == 3
+    assert limiter.global_bucket.blocked_until == 0
+    assert limiter.stats()["retries_total"] == 1
+
+    # Другой чат не ждёт паузы первого
+    clock.sleeps.clear()
+    call(limiter, "sendMessage", {"chat_id": 2})
+    assert clock.sleeps == []
+
+
+def test_retry_after_without_chat_pauses_the_bot(clock):
+    limiter = BotApiRateLimiter(rate=100)
+    result, _ = call(limiter, "answerCallbackQuery", {"callback_query_id": "1"}, [RetryAfter(2), "ok"])
+    assert result == "ok"
+    assert limiter.global_bucket.blocked_until == 2
+
+
+def test_gives_up_after_max_retries(clock):
+    limiter = BotApiRateLimiter(rate=100, max_retries=3)
+    with pytest.raises(RetryAfter):
+        call(limiter, "sendMessage", {"chat_id": -100}, [RetryAfter(1)] * 2, rate_limit_args=1)
+    assert limiter.stats()["retries_total"] == 1
+    assert limiter.stats()["gave_up_total"] == 1
+    # Группа ограничивается своим, более строгим bucket
+    assert -100 in limiter.groups._buckets
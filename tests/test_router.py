@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from router import CallbackRouter, choice  # noqa: E402
+from users import roles  # noqa: E402
+
+
+class Query(SimpleNamespace):
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+
+def make_update(data, tg_id=1):
+    query = Query(data=data, from_user=SimpleNamespace(id=tg_id), answers=[])
+    return SimpleNamespace(callback_query=query)
+
+
+def make_router():
+    router = CallbackRouter()
+    calls = []
+
+    @router.route("lab", int)
+    async def open_lab(query, context, lab_id):
+        calls.append(("lab", query, lab_id))
+
+    @router.route("sort", choice("asc", "desc"), int, pass_update=True)
+    async def sort(update, context, order, page):
+        calls.append(("sort", update, order, page))
+
+    @router.route("delete_lab", int, admin=True)
+    async def delete_lab(query, context, lab_id):
+        calls.append(("delete_lab", lab_id))
+
+    @router.route("fail", answer=False)
+    async def fail(query, context):
+        raise RuntimeError("boom")
+
+    return router, calls
+
+
+def test_resolve_parses_arguments():
+    router, _ = make_router()
+    route, args = router.resolve("lab:42")
+    assert route.prefix == "lab" and args == [42]
+    route, args = router.resolve("sort:desc:3")
+    assert route.prefix == "sort" and args == ["desc", 3]
+    assert router.resolve("fail")[1] == []
+
+
+@pytest.mark.parametrize("data", [None, "", "unknown:1", "lab", "lab:x", "lab:1:2", "sort:up:1", "lab1"])
+def test_resolve_rejects_bad_data(data):
+    router, _ = make_router()
+    assert router.resolve(data) == (None, None)
+
+
+def test_route_registration_checks():
+    router, _ = make_router()
+    with pytest.raises(ValueError):
+        router.route("lab")(lambda *args: None)
+    with pytest.raises(ValueError):
+        router.route("a:b")
+    with pytest.raises(KeyError):
+        router.handler("missing")
+
+
+def test_dispatch_passes_query_or_update():
+    router, calls = make_router()
+
+    async def scenario():
+        update = make_update("lab:7")
+        await router.dispatch(update, None)
+        assert calls[-1] == ("lab", update.callback_query, 7)
+        assert update.callback_query.answers == [None]
+
+        update = make_update("sort:asc:2")
+        await router.dispatch(update, None)
+        assert calls[-1] == ("sort", update, "asc", 2)
+
+        # Нераспознанные данные — только ответ на нажатие
+        update = make_update("lab:oops")
+        assert await router.dispatch(update, None) is None
+        assert update.callback_query.answers == [None]
+        assert len(calls) == 2
+
+        # answer=False: отвечает сам хендлер, ошибка учитывается и пробрасывается
+        update = make_update("fail")
+        with pytest.raises(RuntimeError):
+            await router.dispatch(update, None)
+        assert update.callback_query.answers == []
+
+    asyncio.run(scenario())
+    stats = router.stats()
+    assert stats["lab"]["calls"] == 1 and stats["lab"]["errors"] == 0
+    assert stats["sort"]["calls"] == 1
+    assert stats["fail"]["calls"] == 1 and stats["fail"]["errors"] == 1
+
+
+def test_admin_route_checks_role():
+    router, calls = make_router()
+    # Роли — из кэша, без обращения к БД
+    roles._remember(101, False)
+    roles._remember(102, True)
+
+    async def scenario():
+        denied = make_update("delete_lab:5", tg_id=101)
+        await router.dispatch(denied, None)
+        assert calls == []
+        assert denied.callback_query.answers == ["У вас нет доступа к админ панели."]
+
+        await router.dispatch(make_update("delete_lab:5", tg_id=102), None)
+        assert calls == [("delete_lab", 5)]
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        roles.forget(101)
+        roles.forget(102)
+    assert router.stats()["delete_lab"]["denied"] == 1
+    assert router.stats()["delete_lab"]["calls"] == 1
+
+
+def test_label():
+    router, _ = make_router()
+    assert router.label(make_update("lab:1")) == "callback:lab"
+    assert router.label(make_update("nope:1")) == "callback:unknown"
+    assert router.label(SimpleNamespace(callback_query=None)) is None
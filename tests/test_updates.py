@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from updates import PerChatUpdateProcessor  # noqa: E402
+
+
+def make_update(update_id, chat_id):
+    chat = Chat(chat_id, Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, text="x"))
+
+
+def test_busy_chat_does_not_block_other_chats():
+    async def scenario():
+        processor = PerChatUpdateProcessor(2)
+        release = asyncio.Event()
+        order = []
+
+        async def slow(n):
+            await release.wait()
+            order.append(n)
+
+        async def fast():
+            order.append("other")
+
+        # Апдейтов одного чата больше, чем слотов concurrent_updates
+        busy = [
+            asyncio.create_task(processor.process_update(make_update(n, 1), slow(n)))
+            for n in range(processor.max_concurrent_updates + 1)
+        ]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(processor.process_update(make_update(100, 2), fast()), timeout=1)
+        assert order == ["other"]
+
+        release.set()
+        await asyncio.gather(*busy)
+        # Внутри чата порядок сохраняется, замки убраны
+        assert order == ["other", 0, 1, 2]
+        assert not processor._locks and not processor._waiters
+
+    asyncio.run(scenario())
@@ -0,0 +1,70 @@
+import asyncio
+import html
+import os
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+
+from telegram import Chat, InlineKeyboardButton, InlineKeyboardMarkup, Message, MessageEntity
+from telegram.error import BadRequest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+
+from views import MessageViews, is_shown  # noqa: E402
+
+TITLE = 'Лаба "VLAN" & отчёт'
+# Экран так, как его строит бот: html.escape экранирует кавычки, в конце — перевод строки
+RENDERED = f"<b>{html.escape(TITLE)}</b>\n📝 Описание: нет\n"
+
+
+def keyboard(data="lab:1"):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data=data)]])
+
+
+def shown_message(text=TITLE + "\n📝 Описание: нет", bold=len(TITLE), markup=None):
+    # Так сообщение приходит от Telegram: разметка — в entities, пробелы по краям обрезаны
+    entities = [MessageEntity(MessageEntity.BOLD, 0, bold)] if bold else []
+    return Message(1, datetime.now(), Chat(1, Chat.PRIVATE), text=text, entities=entities,
+                   reply_markup=markup or keyboard())
+
+
+def test_same_screen_is_detected():
+    assert is_shown(shown_message(), RENDERED, keyboard(), "HTML")
+
+
+def test_changes_are_not_skipped():
+    assert not is_shown(shown_message(), RENDERED, keyboard("lab:2"), "HTML")
+    assert not is_shown(shown_message(bold=0), RENDERED, keyboard(), "HTML")
+    assert not is_shown(shown_message(), RENDERED.replace("нет", "есть"), keyboard(), "HTML")
+    # Оформленное сообщение нельзя сравнить с текстом без разметки
+    assert not is_shown(shown_message(), TITLE + "\n📝 Описание: нет", keyboard())
+
+
+def test_plain_text_ignores_edges():
+    message = shown_message(text="Импорт отменён.", bold=0)
+    assert is_shown(message, "Импорт отменён.\n", keyboard())
+
+
+def test_edit_skips_and_treats_not_modified_as_skip():
+    class Query(SimpleNamespace):
+        async def edit_message_text(self, text, **kwargs):
+            self.calls += 1
+            if self.error:
+                raise self.error
+
+    views = MessageViews()
+
+    async def scenario():
+        same = Query(message=shown_message(), inline_message_id=None, calls=0, error=None)
+        assert await views.edit(same, RENDERED, reply_markup=keyboard(), parse_mode="HTML") is False
+        assert same.calls == 0
+
+        changed = Query(message=shown_message(), inline_message_id=None, calls=0, error=None)
+        assert await views.edit(changed, "Другой экран", reply_markup=keyboard()) is True
+
+        stale = Query(message=None, inline_message_id="inline", calls=0,
+                      error=BadRequest("Message is not modified"))
+        assert await views.edit(stale, "Экран", reply_markup=keyboard()) is False
+
+    asyncio.run(scenario())
+    assert views.stats() == {"edits_total": 1, "skipped_total": 1, "not_modified_total": 1}